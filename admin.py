@@ -1,5 +1,8 @@
+from django import forms
 from django.contrib import admin
+from pxelinux.ip import parse_ip_ranges
 from pxelinux.models import *
+from pxelinux.overlaps import analyze, format_range
 
 
 def has_change_and_delete_permission(request, obj):
@@ -85,7 +88,42 @@ class TimeSlotInline(admin.TabularInline):
     extra = 1
 
 
+class MachineSetForm(forms.ModelForm):
+    """
+    Rejects IP-ranges overlapping those of other machine sets, which would
+    make the configuration depend on the order of the machine sets.
+    """
+    class Meta:
+        model = MachineSet
+        fields = ('name', 'ip_ranges', 'owner')
+
+    def clean_ip_ranges(self):
+        ip_ranges = self.cleaned_data['ip_ranges']
+        if not ip_ranges:
+            return ip_ranges
+        candidate = MachineSet(
+            pk=self.instance.pk, name=self.cleaned_data.get('name', ''),
+            ip_ranges=parse_ip_ranges(ip_ranges))
+        others = MachineSet.objects.exclude(pk=self.instance.pk).only(
+            'name', 'ip_ranges')
+        overlaps = [
+            overlap for overlap in analyze(list(others) + [candidate]).overlaps
+            if any(machine_set is candidate
+                   for machine_set in overlap.machine_sets)]
+        if overlaps:
+            raise forms.ValidationError(
+                "Overlaps with other machine sets: %s" % "; ".join(
+                    "%s (%s)" % (format_range(overlap.start, overlap.end),
+                                 ", ".join(
+                                     str(machine_set)
+                                     for machine_set in overlap.machine_sets
+                                     if machine_set is not candidate))
+                    for overlap in overlaps[:10]))
+        return ip_ranges
+
+
 class MachineSetAdmin(admin.ModelAdmin):
+    form = MachineSetForm
     inlines = [
         TimeSlotInline,
     ]
@@ -102,6 +140,39 @@ class MachineSetAdmin(admin.ModelAdmin):
         return ()
 
 
+class HostAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'mac', 'uuid', 'machine_set')
+    list_filter = ('machine_set', )
+    search_fields = ('name', 'mac')
+
+
+class ReadOnlyAdmin(admin.ModelAdmin):
+    """
+    Lists records written by the app itself.
+    """
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+class BootEventAdmin(ReadOnlyAdmin):
+    date_hierarchy = 'time'
+    list_display = ('time', 'ip', 'machine_set', 'timeslot', 'menu',
+                    'fallback')
+    list_filter = ('fallback', 'machine_set')
+    list_select_related = ('machine_set', 'timeslot', 'menu')
+    search_fields = ('ip', )
+
+
+class BootCountAdmin(ReadOnlyAdmin):
+    date_hierarchy = 'date'
+    list_display = ('date', 'machine_set', 'count')
+    list_filter = ('machine_set', )
+    list_select_related = ('machine_set', )
+
+
 class ItemAdmin(admin.ModelAdmin):
     prepopulated_fields = {'label': ('menu_label',)}
     fieldsets = (
@@ -118,3 +189,6 @@ class ItemAdmin(admin.ModelAdmin):
 admin.site.register(Menu, MenuAdmin)
 admin.site.register(Item, ItemAdmin)
 admin.site.register(MachineSet, MachineSetAdmin)
+admin.site.register(Host, HostAdmin)
+admin.site.register(BootEvent, BootEventAdmin)
+admin.site.register(BootCount, BootCountAdmin)
@@ -0,0 +1,16 @@
+import time
+from django.apps import AppConfig
+
+
+# Apps are imported while Django populates the app registry.
+_loaded_at = time.perf_counter()
+
+
+class PxelinuxConfig(AppConfig):
+    name = 'pxelinux'
+
+    def ready(self):
+        # Connect signal handlers.
+        from pxelinux import metrics, signals  # noqa: F401
+        metrics.startup_seconds.set(
+            time.perf_counter() - _loaded_at, phase='apps')
@@ -0,0 +1,247 @@
+"""
+ASGI application serving the configuration URLs of this app (see urls.py).
+
+Requests that can be answered from memory (compiled IP-index, timelines and
+rendered configurations) are answered directly on the event loop, so a single
+process can serve thousands of concurrent boot requests. Everything else is
+passed to the regular (synchronous) views running in a thread pool of
+PXELINUX_ASGI_THREADS threads (default: 4).
+
+Point an ASGI server (e.g. uvicorn or daphne) at pxelinux.asgi:application
+with DJANGO_SETTINGS_MODULE set.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import django
+from django.apps import apps
+from django.conf import settings
+from django.http import Http404, HttpRequest, HttpResponse, QueryDict
+from django.urls import Resolver404, get_resolver
+from pxelinux.cache import AsyncSingleFlight
+
+
+_executor = None
+_render_flight = AsyncSingleFlight('async')
+
+
+def _call_view(view, request, args):
+    from django.db import close_old_connections
+    close_old_connections()
+    try:
+        return view(request, *args)
+    except Http404:
+        return HttpResponse(status=404)
+    finally:
+        close_old_connections()
+
+
+async def run_sync(view, request, *args):
+    """
+    Run the synchronous view in the thread pool and return its response.
+    """
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            getattr(settings, 'PXELINUX_ASGI_THREADS', 4))
+    return await asyncio.get_running_loop().run_in_executor(
+        _executor, _call_view, view, request, args)
+
+
+def _cached_response(request, ip, cached, now, private, cache_hit=True):
+    from pxelinux import metrics, views
+    from pxelinux.telemetry import boot_recorder
+    with metrics.RequestTracker(ip):
+        if cache_hit:
+            metrics.render_cache.inc(result='hit')
+        boot_recorder.record(now, ip)
+        return views.config_response(request, cached, now, private)
+
+
+async def generate_config(request, ip, private=False):
+    """
+    Asynchronous variant of views.generate_config. Of concurrent requests for
+    the same uncached configuration only one is passed to the thread pool,
+    the others wait for it and are then answered from the cache.
+    """
+    from pxelinux import changes, profiling, views
+    from pxelinux.cache import rendered_configs
+    from pxelinux.snapshot import snapshot_file
+    changes.watcher.start()
+    now = datetime.now()
+    snapshot = snapshot_file.current()
+    if snapshot is not None:
+        # Configurations found in the mapped snapshot are answered without
+        # blocking; profiled requests and the fallback use the thread pool.
+        cached = None
+        if profiling.HEADER not in request.META:
+            cached = snapshot.config(ip, now)
+        if cached is None:
+            return await run_sync(
+                views.generate_config, request, ip, private)
+        return _cached_response(request, ip, cached, now, private, False)
+    key = views.config_key(ip, now)
+    if key is None:
+        return await run_sync(views.generate_config, request, ip, private)
+    cached = rendered_configs.get(key, now)
+    if cached is None:
+        leader = []
+
+        async def render():
+            leader.append(True)
+            return await run_sync(
+                views.generate_config, request, ip, private)
+
+        response = await _render_flight.do(key, render)
+        if leader:
+            return response
+        cached = rendered_configs.get(key, now)
+        if cached is None:
+            return await run_sync(
+                views.generate_config, request, ip, private)
+    return _cached_response(request, ip, cached, now, private)
+
+
+async def generate_config_from_x_real_ip(request):
+    """
+    Asynchronous variant of views.generate_config_from_x_real_ip.
+    """
+    from pxelinux import views
+    return await generate_config(
+        request, views.client_ip(request), private=True)
+
+
+async def generate_config_from_hex(request, hex_str):
+    """
+    Asynchronous variant of views.generate_config_from_hex.
+    """
+    from pxelinux import views
+    return await generate_config(
+        request, views.ip4_hex_to_grouped_decimal(hex_str))
+
+
+async def generate_config_from_probe(request, probe):
+    """
+    Asynchronous variant of views.generate_config_from_probe. Probes of
+    Hosts (and all probes until the host index is built) are passed to the
+    thread pool.
+    """
+    from pxelinux import metrics, views
+    from pxelinux.index import host_index
+    if '-' in probe:
+        index = host_index.peek()
+        if index is None or index.lookup(probe) is not None:
+            return await run_sync(
+                views.generate_config_from_probe, request, probe)
+    ip = views.probe_ip(request, probe)
+    if ip is None:
+        metrics.requests.inc(result='rejected')
+        raise Http404
+    return await generate_config(request, ip, private=True)
+
+
+def _async_views():
+    from pxelinux import views
+    return {
+        views.generate_config: generate_config,
+        views.generate_config_from_x_real_ip: generate_config_from_x_real_ip,
+        views.generate_config_from_hex: generate_config_from_hex,
+        views.generate_config_from_probe: generate_config_from_probe,
+    }
+
+
+def build_request(scope, body=b''):
+    """
+    Build a Django HttpRequest from an ASGI HTTP connection scope.
+    """
+    request = HttpRequest()
+    request.method = scope['method'].upper()
+    request.path = request.path_info = scope['path']
+    query_string = scope.get('query_string', b'').decode('latin-1')
+    request.GET = QueryDict(query_string)
+    request.META = {
+        'REQUEST_METHOD': request.method,
+        'PATH_INFO': scope['path'],
+        'QUERY_STRING': query_string,
+        'SCRIPT_NAME': scope.get('root_path', ''),
+    }
+    if scope.get('client'):
+        request.META['REMOTE_ADDR'] = scope['client'][0]
+        request.META['REMOTE_PORT'] = scope['client'][1]
+    if scope.get('server'):
+        request.META['SERVER_NAME'] = scope['server'][0]
+        request.META['SERVER_PORT'] = str(scope['server'][1])
+    for name, value in scope.get('headers', ()):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        if name not in ('CONTENT_LENGTH', 'CONTENT_TYPE'):
+            name = 'HTTP_' + name
+        value = value.decode('latin-1')
+        if name in request.META:
+            value = request.META[name] + ',' + value
+        request.META[name] = value
+    request._body = body
+    # Only the configuration views are served here, without middleware.
+    from django.contrib.auth.models import AnonymousUser
+    request.user = AnonymousUser()
+    return request
+
+
+async def respond(request):
+    """
+    Resolve the request against urls.py and return the response of the
+    asynchronous variant of the view (or of the view itself, run in the
+    thread pool).
+    """
+    try:
+        match = get_resolver('pxelinux.urls').resolve(request.path_info)
+    except Resolver404:
+        return HttpResponse(status=404)
+    view = _async_views().get(match.func)
+    if view is None:
+        return await run_sync(match.func, request, *match.args)
+    try:
+        return await view(request, *match.args)
+    except Http404:
+        return HttpResponse(status=404)
+
+
+def _setup():
+    from pxelinux import warmup
+    if not apps.ready:
+        django.setup(set_prefix=False)
+    warmup.serving()
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                _setup()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    if scope['type'] != 'http':
+        return
+    _setup()
+    body = b''
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            break
+    response = await respond(build_request(scope, body))
+    if response.streaming:
+        content = b''.join(response.streaming_content)
+    else:
+        content = response.content
+    headers = [(name.encode('latin-1'), value.encode('latin-1'))
+               for name, value in response.items()]
+    headers.extend((b'Set-Cookie', cookie.output(header='').strip().encode())
+                   for cookie in response.cookies.values())
+    await send({'type': 'http.response.start',
+                'status': response.status_code, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': content})
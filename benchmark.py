@@ -0,0 +1,221 @@
+"""
+Synthetic data and measurements for the boot-request hot path: latency
+percentiles, SQL-queries and memory per request of generate_config,
+generate_config_from_hex and generate_config_from_machine_set_name.
+"""
+import platform
+import random
+import time
+import tracemalloc
+from datetime import time as daytime
+import django
+from django.contrib.auth.models import User
+from django.db import connection
+from django.http import Http404
+from django.test import RequestFactory
+from iptools.ipv4 import ip2hex
+from pxelinux.models import (
+    Item, Menu, MenuItem, MenuRelation, MachineSet, TimeSlot)
+
+
+def generate_data(machine_sets=100, menus=20, timeslots=8, seed=0):
+    """
+    Create a synthetic configuration: machine_sets machine sets with mixed
+    IPv4- and IPv6-ranges (plus a fallback set), menus nested menus and
+    timeslots timeslots of varying priority per machine set. Returns a list of
+    (machine set name, IPv4-address, IPv6-address) to request.
+    """
+    rng = random.Random(seed)
+    owner = User.objects.create(username='benchmark-%d' % seed)
+    items = Item.objects.bulk_create(
+        Item(menu_label='Item %d' % i, kernel='images/kernel-%d' % i,
+             initrd='images/initrd-%d' % i, append='quiet splash',
+             label='benchmark-item-%d' % i)
+        for i in range(menus * 3))
+    if not items[0].pk:
+        items = list(Item.objects.filter(label__startswith='benchmark-item-'))
+    menu_objects = []
+    for i in range(menus):
+        menu_objects.append(Menu.objects.create(
+            title='Menu %d' % i, label='benchmark-menu-%d' % i, owner=owner,
+            password=rng.choice(['', 'secret'])))
+    MenuItem.objects.bulk_create(
+        MenuItem(menu=menu, item=item, priority=priority)
+        for menu in menu_objects
+        for priority, item in enumerate(rng.sample(items, 5)))
+    relations = []
+    for i, menu in enumerate(menu_objects[1:], 1):
+        # A tree plus some links back up and across.
+        relations.append(MenuRelation(
+            sub_menu=menu_objects[rng.randrange(i)], super_menu=menu,
+            priority=i))
+        if rng.random() < 0.2:
+            relations.append(MenuRelation(
+                sub_menu=menu, super_menu=rng.choice(menu_objects),
+                priority=menus + i))
+    MenuRelation.objects.bulk_create(relations)
+
+    clients = []
+    slot_length = 24 * 60 // timeslots
+    for i in range(machine_sets):
+        ranges = ["('10.%d.%d.0', '10.%d.%d.255')" % (
+            i >> 8, i & 255, i >> 8, i & 255), "'fd00:%x::/64'" % i]
+        if i % 3 == 0:
+            ranges.append("'172.%d.%d.%d'" % (
+                16 + (i >> 16 & 15), i >> 8 & 255, i & 255))
+        machine_set = MachineSet.objects.create(
+            name='benchmark-set-%d' % i, ip_ranges=", ".join(ranges),
+            owner=owner)
+        slots = []
+        for j in range(timeslots):
+            start = j * slot_length
+            end = min(start + slot_length * 2, 24 * 60 - 1)
+            slots.append(TimeSlot(
+                machine_set=machine_set, menu=rng.choice(menu_objects),
+                time_start=daytime(start // 60, start % 60),
+                time_end=daytime(end // 60, end % 60, 59),
+                priority=rng.randrange(100),
+                ui=rng.choice(['vesa', 'text', 'text', 'none'])))
+        TimeSlot.objects.bulk_create(slots)
+        clients.append((machine_set.name, '10.%d.%d.%d' % (
+            i >> 8, i & 255, rng.randrange(1, 255)), 'fd00:%x::1' % i))
+    fallback = MachineSet.objects.create(
+        name='benchmark-fallback', ip_ranges="'255.255.255.255'",
+        owner=owner)
+    TimeSlot.objects.create(
+        machine_set=fallback, menu=menu_objects[0], ui='text')
+    return clients
+
+
+def _percentile(values, percent):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+class _QueryCounter(object):
+    """
+    Database execute-wrapper counting the executed queries.
+    """
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def _call(view, request, args):
+    try:
+        view(request, *args)
+    except Http404:
+        return False
+    return True
+
+
+def measure(view, arguments, requests=1000, render=False, seed=0):
+    """
+    Call view with arguments chosen at random (requests times) and return
+    latency percentiles (ms), SQL-queries and allocated memory per request.
+    With render=True rendered configurations are dropped before each request
+    (the compiled index and timelines are kept), otherwise the caches are
+    warmed up before measuring.
+    """
+    from pxelinux.cache import rendered_configs
+    rng = random.Random(seed)
+    request = RequestFactory().get('/')
+    calls = [rng.choice(arguments) for _ in range(requests)]
+    for args in arguments:
+        _call(view, request, args)
+    latencies = []
+    queries = []
+    not_found = 0
+    counter = _QueryCounter()
+    with connection.execute_wrapper(counter):
+        for args in calls:
+            if render:
+                rendered_configs.clear()
+            count = counter.count
+            start = time.perf_counter()
+            if not _call(view, request, args):
+                not_found += 1
+            latencies.append((time.perf_counter() - start) * 1000)
+            queries.append(counter.count - count)
+    # Measure memory separately, tracing slows down every allocation.
+    memory = []
+    tracemalloc.start()
+    for args in calls[:100]:
+        if render:
+            rendered_configs.clear()
+        tracemalloc.reset_peak()
+        current = tracemalloc.get_traced_memory()[0]
+        _call(view, request, args)
+        memory.append(tracemalloc.get_traced_memory()[1] - current)
+    tracemalloc.stop()
+    return {
+        'requests': requests,
+        'not_found': not_found,
+        'latency_ms': dict(
+            ('p%d' % percent, _percentile(latencies, percent))
+            for percent in (50, 90, 99)),
+        'latency_ms_mean': sum(latencies) / len(latencies),
+        'latency_ms_max': max(latencies),
+        'queries_mean': sum(queries) / len(queries),
+        'queries_max': max(queries),
+        'memory_peak_bytes': max(memory),
+    }
+
+
+def _seconds(function):
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+def run(machine_sets=100, menus=20, timeslots=8, requests=1000, seed=0):
+    """
+    Generate data, measure all entry points with and without cached renders
+    and return the results as a JSON-serializable dictionary.
+    """
+    from pxelinux import views
+    from pxelinux.index import IPIndex
+    from pxelinux.models import MachineSet
+    from pxelinux.schedule import build_timelines
+    start = time.perf_counter()
+    clients = generate_data(machine_sets, menus, timeslots, seed)
+    setup = time.perf_counter() - start
+    compile_seconds = {
+        'ip_index': _seconds(lambda: IPIndex(MachineSet.objects.all())),
+        'timelines': _seconds(build_timelines),
+    }
+    entry_points = {
+        'generate_config_ipv4': (views.generate_config, [
+            (ipv4, ) for name, ipv4, ipv6 in clients]),
+        'generate_config_ipv6': (views.generate_config, [
+            (ipv6, ) for name, ipv4, ipv6 in clients]),
+        'generate_config_from_hex': (views.generate_config_from_hex, [
+            (ip2hex(ipv4).upper(), ) for name, ipv4, ipv6 in clients]),
+        'generate_config_from_machine_set_name': (
+            views.generate_config_from_machine_set_name, [
+                (name, ) for name, ipv4, ipv6 in clients]),
+    }
+    results = {}
+    for name, (view, arguments) in sorted(entry_points.items()):
+        for mode in ('render', 'warm'):
+            results['%s/%s' % (name, mode)] = measure(
+                view, arguments, requests, render=mode == 'render',
+                seed=seed)
+    return {
+        'parameters': {
+            'machine_sets': machine_sets, 'menus': menus,
+            'timeslots': timeslots, 'requests': requests, 'seed': seed,
+        },
+        'environment': {
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'machine': platform.machine(),
+        },
+        'setup_seconds': setup,
+        'compile_seconds': compile_seconds,
+        'results': results,
+    }
@@ -0,0 +1,332 @@
+"""
+Declarative bulk import and export of Items, Menus (with their items and
+sub-menus), MachineSets and their TimeSlots as JSON or YAML. Objects are
+identified by their labels (Items, Menus) and names (MachineSets), owners by
+their usernames.
+
+    items:
+    - label: linux
+      menu_label: Linux
+      kernel: images/vmlinuz
+      append: quiet
+    menus:
+    - label: main
+      title: Main
+      owner: admin
+      items: [{item: linux, priority: 1}]
+      menus: [{menu: tools, priority: 1}]
+    machine_sets:
+    - name: lab
+      owner: admin
+      ip_ranges: "'10.0.0.0/24'"
+      timeslots: [{menu: main, time_start: '08:00', ui: text}]
+
+Omitted fields get their default values, omitted lists of items, sub-menus
+or timeslots leave the existing ones alone. Imports validate every object like
+the admin does, compare the document with the database and apply the
+differences in bulk inside one transaction.
+"""
+import json
+from collections import defaultdict
+from datetime import time
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from pxelinux.ip import parse_ip_ranges
+from pxelinux.models import (
+    Item, Menu, MenuItem, MenuRelation, MachineSet, TimeSlot)
+from pxelinux.resolve import parse_time
+
+
+ITEM_FIELDS = ('menu_label', 'kernel', 'initrd', 'append', 'password',
+               'ipappend')
+MENU_FIELDS = ('title', 'owner', 'password', 'background_image')
+MACHINE_SET_FIELDS = ('owner', 'ip_ranges')
+TIMESLOT_FIELDS = ('time_start', 'time_end', 'priority', 'ui', 'timeout')
+BATCH_SIZE = 500
+
+
+def _time(value):
+    """
+    Accept datetime.time, 'HH:MM[:SS]' and seconds since midnight (as which
+    YAML reads unquoted times like 08:00:00).
+    """
+    if isinstance(value, time):
+        return value
+    if isinstance(value, int):
+        return time(value // 3600, value // 60 % 60, value % 60)
+    return parse_time(value)
+
+
+def _lookup(mapping, key, kind):
+    try:
+        return mapping[key]
+    except KeyError:
+        raise ValueError("Unknown %s: %s" % (kind, key))
+
+
+def _defaults(model, fields):
+    return {name: model._meta.get_field(name).get_default()
+            for name in fields}
+
+
+def _validate(model, instances, name=None):
+    """
+    Run the field and model validation of the instances, raising ValueError.
+    Uniqueness and foreign keys are left to the import, which resolves them
+    itself.
+    """
+    exclude = [field.name for field in model._meta.fields if field.is_relation]
+    for instance in instances:
+        try:
+            instance.full_clean(exclude=exclude, validate_unique=False)
+        except ValidationError as e:
+            raise ValueError("Invalid %s%s: %s" % (
+                model._meta.verbose_name,
+                '' if name is None else ' %s' % getattr(instance, name),
+                '; '.join(e.messages)))
+
+
+class ImportResult(object):
+    """
+    Numbers of created, updated and deleted objects per model name.
+    """
+    def __init__(self):
+        self.counts = defaultdict(lambda: [0, 0, 0])
+
+    def add(self, model, created=0, updated=0, deleted=0):
+        counts = self.counts[model._meta.model_name]
+        counts[0] += created
+        counts[1] += updated
+        counts[2] += deleted
+
+    def __str__(self):
+        return "\n".join(
+            "%s: %d created, %d updated, %d deleted" % ((name, ) + tuple(
+                counts)) for name, counts in sorted(self.counts.items()))
+
+
+def _sync(model, key, documents, fields, convert, result, delete):
+    """
+    Create and update the objects of model described by documents (matching
+    them to existing ones by key) with bulk queries. Return a dictionary
+    mapping keys to primary keys.
+    """
+    defaults = _defaults(model, fields)
+    wanted = {}
+    for document in documents:
+        values = dict(defaults)
+        values.update((name, document[name])
+                      for name in fields if name in document)
+        wanted[document[key]] = convert(values)
+    existing = {}
+    for instance in model.objects.all() if delete else \
+            model.objects.filter(**{key + '__in': list(wanted)}):
+        if getattr(instance, key) in existing:
+            raise ValueError("%s %r is not unique." % (
+                model._meta.verbose_name, getattr(instance, key)))
+        existing[getattr(instance, key)] = instance
+    created = []
+    updated = []
+    for name, values in wanted.items():
+        instance = existing.get(name)
+        if instance is None:
+            created.append(model(**dict(values, **{key: name})))
+        elif any(getattr(instance, field) != value
+                 for field, value in values.items()):
+            for field, value in values.items():
+                setattr(instance, field, value)
+            updated.append(instance)
+    obsolete = [instance.pk for name, instance in existing.items()
+                if name not in wanted]
+    _validate(model, created + updated, key)
+    model.objects.bulk_create(created, batch_size=BATCH_SIZE)
+    model.objects.bulk_update(updated, list(fields), batch_size=BATCH_SIZE)
+    if obsolete:
+        model.objects.filter(pk__in=obsolete).delete()
+    result.add(model, len(created), len(updated), len(obsolete))
+    return dict(model.objects.filter(
+        **{key + '__in': list(wanted)}).values_list(key, 'pk'))
+
+
+def _sync_children(model, parent, parents, fields, result):
+    """
+    Replace the children of the given parents (mapping parent pks to lists of
+    tuples of the values of fields) where they differ. Children of parents
+    missing in parents are left alone.
+    """
+    existing = defaultdict(list)
+    for values in model.objects.filter(**{parent + '__in': list(parents)}) \
+            .values_list(parent, *fields):
+        existing[values[0]].append(values[1:])
+    changed = [pk for pk, wanted in parents.items()
+               if sorted(wanted) != sorted(existing[pk])]
+    created = [
+        model(**dict(zip(fields, values), **{parent: pk}))
+        for pk in changed for values in parents[pk]]
+    _validate(model, created)
+    deleted, _ = model.objects.filter(**{parent + '__in': changed}).delete()
+    model.objects.bulk_create(created, batch_size=BATCH_SIZE)
+    result.add(model, len(created), 0, deleted)
+
+
+def import_data(data, delete=False, dry_run=False):
+    """
+    Make the database match the document data (a dictionary with the lists
+    'items', 'menus' and 'machine_sets', any of which may be omitted). With
+    delete, objects of those models missing in the document are deleted. With
+    dry_run, the changes are rolled back. Return an ImportResult.
+    """
+    from pxelinux import changes, signals
+    result = ImportResult()
+    items = data.get('items')
+    menus = data.get('menus')
+    machine_sets = data.get('machine_sets')
+    with transaction.atomic(), changes.batch():
+        users = dict(User.objects.filter(username__in=set(
+            document['owner'] for document in (menus or []) +
+            (machine_sets or []))).values_list('username', 'pk'))
+
+        def owner(values):
+            values['owner_id'] = _lookup(users, values.pop('owner'), 'owner')
+            return values
+
+        def ip_ranges(values):
+            values = owner(values)
+            if values['ip_ranges']:
+                try:
+                    values['ip_ranges'] = parse_ip_ranges(values['ip_ranges'])
+                except Exception:
+                    raise ValueError(
+                        "Invalid IP-ranges: %s" % values['ip_ranges'])
+            return values
+
+        item_ids = {}
+        if items is not None:
+            item_ids = _sync(Item, 'label', items, ITEM_FIELDS, dict, result,
+                             delete)
+        if menus is not None:
+            menu_ids = _sync(Menu, 'label', menus, MENU_FIELDS, owner,
+                             result, delete)
+            item_ids.update(Item.objects.filter(label__in=set(
+                entry['item'] for document in menus
+                for entry in document.get('items', ())) - set(item_ids))
+                .values_list('label', 'pk'))
+            _sync_children(MenuItem, 'menu_id', {
+                menu_ids[document['label']]: [
+                    (_lookup(item_ids, entry['item'], 'item'),
+                     entry['priority'])
+                    for entry in document['items']]
+                for document in menus if 'items' in document},
+                ('item_id', 'priority'), result)
+            all_menu_ids = dict(menu_ids)
+            all_menu_ids.update(Menu.objects.filter(label__in=set(
+                entry['menu'] for document in menus
+                for entry in document.get('menus', ())) - set(menu_ids))
+                .values_list('label', 'pk'))
+            _sync_children(MenuRelation, 'sub_menu_id', {
+                menu_ids[document['label']]: [
+                    (_lookup(all_menu_ids, entry['menu'], 'menu'),
+                     entry['priority'])
+                    for entry in document['menus']]
+                for document in menus if 'menus' in document},
+                ('super_menu_id', 'priority'), result)
+        if machine_sets is not None:
+            defaults = _defaults(TimeSlot, TIMESLOT_FIELDS)
+            set_ids = _sync(MachineSet, 'name', machine_sets,
+                            MACHINE_SET_FIELDS, ip_ranges, result, delete)
+            menu_ids = dict(Menu.objects.filter(label__in=set(
+                entry['menu'] for document in machine_sets
+                for entry in document.get('timeslots', ())))
+                .values_list('label', 'pk'))
+            timeslots = {}
+            for document in machine_sets:
+                if 'timeslots' not in document:
+                    continue
+                timeslots[set_ids[document['name']]] = [
+                    (_lookup(menu_ids, entry['menu'], 'menu'), ) + tuple(
+                        _time(entry.get(name, defaults[name]))
+                        if name.startswith('time_') else
+                        entry.get(name, defaults[name])
+                        for name in TIMESLOT_FIELDS)
+                    for entry in document['timeslots']]
+            _sync_children(TimeSlot, 'machine_set_id', timeslots,
+                           ('menu_id', ) + TIMESLOT_FIELDS, result)
+        if dry_run:
+            transaction.set_rollback(True)
+    if not dry_run:
+        # Bulk queries send no signals.
+        signals.invalidate_all()
+        changes.changed()
+    return result
+
+
+def export_data():
+    """
+    Yield (section, document)-pairs describing all objects in the format
+    read by import_data, querying each model once.
+    """
+    for item in Item.objects.order_by('label').iterator():
+        document = {'label': item.label}
+        document.update((name, getattr(item, name)) for name in ITEM_FIELDS)
+        yield 'items', document
+    users = dict(User.objects.values_list('pk', 'username'))
+    labels = dict(Menu.objects.values_list('pk', 'label'))
+    menu_items = defaultdict(list)
+    for menu_id, label, priority in MenuItem.objects.values_list(
+            'menu_id', 'item__label', 'priority'):
+        menu_items[menu_id].append({'item': label, 'priority': priority})
+    sub_menus = defaultdict(list)
+    for menu_id, super_menu_id, priority in MenuRelation.objects.values_list(
+            'sub_menu_id', 'super_menu_id', 'priority'):
+        sub_menus[menu_id].append(
+            {'menu': labels[super_menu_id], 'priority': priority})
+    for menu in Menu.objects.order_by('label').iterator():
+        yield 'menus', {
+            'label': menu.label, 'title': menu.title,
+            'owner': users[menu.owner_id], 'password': menu.password,
+            'background_image': menu.background_image,
+            'items': menu_items[menu.pk], 'menus': sub_menus[menu.pk]}
+    timeslots = defaultdict(list)
+    for timeslot in TimeSlot.objects.iterator():
+        document = {'menu': labels[timeslot.menu_id]}
+        document.update(
+            (name, getattr(timeslot, name)) for name in TIMESLOT_FIELDS)
+        document['time_start'] = document['time_start'].isoformat()
+        document['time_end'] = document['time_end'].isoformat()
+        timeslots[timeslot.machine_set_id].append(document)
+    for machine_set in MachineSet.objects.order_by('name').iterator():
+        yield 'machine_sets', {
+            'name': machine_set.name, 'owner': users[machine_set.owner_id],
+            'ip_ranges': str(machine_set.ip_ranges),
+            'timeslots': timeslots[machine_set.pk]}
+
+
+def dump_json(documents):
+    """
+    Yield the JSON-representation of export_data()-pairs in chunks.
+    """
+    section = None
+    for next_section, document in documents:
+        if next_section != section:
+            yield '{' if section is None else '],'
+            yield '\n%s: [\n' % json.dumps(next_section)
+            section = next_section
+        else:
+            yield ',\n'
+        yield json.dumps(document, sort_keys=True)
+    yield '{' if section is None else '\n]'
+    yield '}\n'
+
+
+def dump_yaml(documents):
+    """
+    Yield the YAML-representation of export_data()-pairs in chunks.
+    """
+    import yaml
+    section = None
+    for next_section, document in documents:
+        if next_section != section:
+            yield '%s:\n' % next_section
+            section = next_section
+        yield yaml.safe_dump([document], default_flow_style=False)
@@ -0,0 +1,154 @@
+"""
+Process-local cache of rendered PXELINUX configurations and coalescing of
+concurrent renders of the same configuration.
+"""
+import hashlib
+import threading
+from datetime import datetime, timedelta
+from time import time
+from django.conf import settings
+from pxelinux import metrics
+
+
+def content_digest(content, content_type):
+    """
+    Hexadecimal digest of a configuration, used as its ETag.
+    """
+    return hashlib.sha1(content_type.encode() + b'\n' + content).hexdigest()
+
+
+class RenderedConfig(object):
+    """
+    Rendered configuration with its validators for conditional requests: an
+    ETag derived from the content (so it is equal across processes) and the
+    time it was rendered. next_change is the timeslot boundary up to which it
+    is valid.
+    """
+    __slots__ = ('content', 'content_type', 'next_change', 'etag',
+                 'last_modified')
+
+    def __init__(self, content, content_type, next_change, etag=None,
+                 last_modified=None):
+        self.content = content
+        self.content_type = content_type
+        self.next_change = next_change
+        self.etag = etag or '"%s"' % content_digest(content, content_type)
+        self.last_modified = last_modified or int(time())
+
+
+class RenderCache(object):
+    """
+    Maps keys (typically (machine set, timeslot)-pairs) to rendered
+    configurations. Every entry expires at a given datetime, but at the latest
+    after PXELINUX_COMPILED_MAX_AGE seconds so changes made through other
+    worker processes are picked up eventually. clear() drops all entries and is
+    called whenever the boot configuration is modified.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        self.generation = 0
+
+    def get(self, key, now):
+        """
+        Return the value stored for key if it did not expire at now.
+        """
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= now:
+            return None
+        return entry[1]
+
+    def set(self, key, value, expires, generation=None):
+        """
+        Store value for key until expires. If generation is given and clear()
+        was called since it was read from self.generation, value is outdated
+        and gets discarded.
+        """
+        max_age = getattr(settings, 'PXELINUX_COMPILED_MAX_AGE', 60)
+        if max_age is not None:
+            expires = min(expires, datetime.now() + timedelta(seconds=max_age))
+        with self._lock:
+            if generation is None or generation == self.generation:
+                self._entries[key] = (expires, value)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+
+rendered_configs = RenderCache()
+
+
+class _Call(object):
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """
+    Coalesces concurrent calls with equal keys across threads: the first
+    caller runs the function, the others wait for and share its result (or
+    exception).
+    """
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, function):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            metrics.coalesced.inc(flight=self.name)
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = function()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+
+class AsyncSingleFlight(object):
+    """
+    Coalesces concurrent awaits with equal keys on an event loop: the first
+    caller awaits the coroutine, the others await the same task.
+    """
+    def __init__(self, name):
+        self.name = name
+        self._tasks = {}
+
+    async def do(self, key, coroutine_function):
+        # Imported here as only the ASGI application needs it.
+        import asyncio
+        task = self._tasks.get(key)
+        if task is not None:
+            metrics.coalesced.inc(flight=self.name)
+            return await asyncio.shield(task)
+        task = self._tasks[key] = asyncio.ensure_future(coroutine_function())
+        try:
+            return await asyncio.shield(task)
+        finally:
+            if self._tasks.get(key) is task:
+                del self._tasks[key]
+
+
+render_flight = SingleFlight('render')
@@ -0,0 +1,249 @@
+"""
+Change notification across processes and nodes. Every committed change of the
+boot configuration increments the generation counter (models.ConfigGeneration)
+and is published on the change bus given by the PXELINUX_CHANGE_BUS setting
+(dotted path of a class, default: none). Each process learns about changes
+made elsewhere from the bus, dropping only the state derived from the changed
+object, and by polling the counter every PXELINUX_POLL_INTERVAL seconds
+(default: None, no polling), dropping all derived state if it moved. With
+either set up, PXELINUX_COMPILED_MAX_AGE can be raised or set to None.
+
+A bus is a class whose instances provide publish(message), message being a
+dictionary of JSON-serializable values, and subscribe(callback), calling
+callback(message) for every message published by any process.
+"""
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+
+logger = logging.getLogger(__name__)
+
+# Identifies the messages of this process.
+ORIGIN = uuid.uuid4().hex
+
+_local = threading.local()
+
+
+class LocalBus(object):
+    """
+    Bus delivering messages to the subscribers within this process only, as
+    a stand-in for tests. Several nodes need a shared channel (e.g. Redis
+    pub/sub or PostgreSQL LISTEN/NOTIFY) behind the same two methods.
+    """
+    _subscribers = []
+
+    def publish(self, message):
+        for callback in list(self._subscribers):
+            callback(message)
+
+    def subscribe(self, callback):
+        self._subscribers.append(callback)
+
+
+_buses = {}
+
+
+def get_bus():
+    """
+    Return the bus configured by PXELINUX_CHANGE_BUS or None.
+    """
+    path = getattr(settings, 'PXELINUX_CHANGE_BUS', None)
+    if path is None:
+        return None
+    if path not in _buses:
+        _buses[path] = import_string(path)()
+    return _buses[path]
+
+
+def current_generation():
+    """
+    Return the generation counter (one query).
+    """
+    from pxelinux.models import ConfigGeneration
+    generation = ConfigGeneration.objects.filter(pk=1).values_list(
+        'generation', flat=True).first()
+    return generation or 0
+
+
+def bump():
+    """
+    Increment the generation counter and return its new value.
+    """
+    from pxelinux.models import ConfigGeneration
+    if not ConfigGeneration.objects.filter(pk=1).update(
+            generation=F('generation') + 1, changed=timezone.now()):
+        try:
+            with transaction.atomic():
+                ConfigGeneration.objects.create(pk=1, generation=1)
+            return 1
+        except IntegrityError:
+            # Created concurrently.
+            return bump()
+    return current_generation()
+
+
+class ChangeWatcher(object):
+    """
+    Tracks the generation this process' state reflects and drops state when
+    other processes change the configuration.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._started = False
+        # Unknown until the first poll.
+        self.generation = None
+
+    def start(self):
+        """
+        Subscribe to the bus and start polling in a background thread, once
+        per process. Cheap to call on every request.
+        """
+        if self._started:
+            return
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+            bus = get_bus()
+            if bus is not None:
+                bus.subscribe(self.receive)
+            interval = getattr(settings, 'PXELINUX_POLL_INTERVAL', None)
+            if bus is not None or interval is not None:
+                threading.Thread(
+                    target=self._run, args=(interval, ),
+                    name='pxelinux-changes', daemon=True).start()
+
+    def _run(self, interval):
+        while True:
+            try:
+                self.poll()
+            except Exception:
+                logger.exception("Polling the configuration failed.")
+            finally:
+                close_old_connections()
+            if interval is None:
+                return
+            time.sleep(interval)
+
+    def poll(self):
+        """
+        Read the generation counter and drop all state if it moved since the
+        last poll (or if this is the first one). Return whether it did.
+        """
+        from pxelinux.signals import invalidate_all
+        generation = current_generation()
+        with self._lock:
+            stale = generation != self.generation
+            if stale:
+                invalidate_all()
+            self.generation = generation
+        return stale
+
+    def publish(self, model_name=None, pk=None, menu_id=None):
+        """
+        Count a committed change made by this process (which already dropped
+        the affected state) and announce it on the bus.
+        """
+        try:
+            generation = bump()
+        except Exception:
+            # The change itself is committed already.
+            logger.exception("Counting a configuration change failed.")
+            return
+        with self._lock:
+            if self.generation is not None and \
+                    generation == self.generation + 1:
+                self.generation = generation
+        bus = get_bus()
+        if bus is not None:
+            bus.publish({'origin': ORIGIN, 'generation': generation,
+                         'model': model_name, 'pk': pk, 'menu_id': menu_id})
+
+    def receive(self, message):
+        """
+        Drop the state affected by a change announced on the bus, or all
+        state if messages were missed.
+        """
+        from pxelinux.signals import invalidate, invalidate_all
+        if message['origin'] == ORIGIN:
+            return
+        with self._lock:
+            if self.generation is not None and \
+                    message['generation'] <= self.generation + 1:
+                invalidate(message['model'], message['pk'],
+                           message['menu_id'])
+            else:
+                invalidate_all()
+            self.generation = max(self.generation or 0, message['generation'])
+
+
+watcher = ChangeWatcher()
+
+
+class _Publish(object):
+    """
+    on_commit-callback announcing all changes of a transaction at once: the
+    change itself if there is only one, else a change of everything. It is
+    registered once per change but runs only once.
+    """
+    def __init__(self):
+        self.changes = []
+        self.done = False
+
+    def __call__(self):
+        from pxelinux.signals import invalidate, invalidate_all
+        if self.done:
+            return
+        self.done = True
+        if getattr(_local, 'publish', None) is self:
+            _local.publish = None
+        # Requests of this process may have cached the state before the
+        # commit since post_save dropped it.
+        if len(self.changes) == 1:
+            invalidate(*self.changes[0])
+            watcher.publish(*self.changes[0])
+        else:
+            invalidate_all()
+            watcher.publish()
+
+
+def changed(model_name=None, pk=None, menu_id=None):
+    """
+    Announce a change of the given object (see signals.invalidate) once the
+    current transaction commits. A transaction bumps the generation once,
+    however many objects it changes.
+    """
+    # The changes of this thread's (i.e. connection's) transaction. One left
+    # over from a rolled back transaction only adds needless invalidations.
+    publish = getattr(_local, 'publish', None)
+    if publish is None or publish.done:
+        publish = _local.publish = _Publish()
+    if (model_name, pk, menu_id) not in publish.changes:
+        publish.changes.append((model_name, pk, menu_id))
+    transaction.on_commit(publish)
+
+
+@contextmanager
+def batch():
+    """
+    Don't invalidate or announce the single changes made by this thread in
+    the block (see signals.config_changed); the caller takes care of all of
+    them at once afterwards.
+    """
+    _local.batching = True
+    try:
+        yield
+    finally:
+        _local.batching = False
+
+
+def batching():
+    return getattr(_local, 'batching', False)
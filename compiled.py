@@ -0,0 +1,65 @@
+import threading
+import time
+from django.conf import settings
+
+
+class CompiledState(object):
+    """
+    Lazily built, process-local state derived from the database (e.g. lookup
+    tables). The state is built on first access, dropped by invalidate() and
+    rebuilt at the latest after PXELINUX_COMPILED_MAX_AGE seconds so that
+    changes made in other worker processes are picked up eventually.
+    """
+    def __init__(self, builder):
+        self.builder = builder
+        self._lock = threading.Lock()
+        self._value = None
+        self._built_at = 0
+        self._generation = 0
+
+    def _expired(self):
+        max_age = getattr(settings, 'PXELINUX_COMPILED_MAX_AGE', 60)
+        return max_age is not None and \
+            time.monotonic() - self._built_at > max_age
+
+    def get(self):
+        """
+        Return the current state, building it first if necessary.
+        """
+        value = self._value
+        if value is not None and not self._expired():
+            return value
+        with self._lock:
+            if self._value is None or self._expired():
+                generation = self._generation
+                value = self.builder()
+                # Don't keep the result if invalidate() was called meanwhile.
+                if generation == self._generation:
+                    self._value = value
+                    self._built_at = time.monotonic()
+                return value
+            return self._value
+
+    def peek(self):
+        """
+        Return the current state if it is built and fresh, else None. Never
+        touches the database.
+        """
+        value = self._value
+        if value is None or self._expired():
+            return None
+        return value
+
+    def stale(self):
+        """
+        Return the last state built, even if it expired, or None if it was
+        never built or dropped since. Never touches the database.
+        """
+        return self._value
+
+    def invalidate(self):
+        """
+        Drop the current state. It gets rebuilt on the next call to get().
+        """
+        self._generation += 1
+        self._value = None
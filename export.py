@@ -0,0 +1,135 @@
+"""
+Export of the boot configuration as static files which a web- or TFTP-server
+can serve without this app:
+
+* pxelinux.cfg/<HEX>: configuration for all IPv4-addresses starting with the
+  given (upper case) hexadecimal prefix, like PXELINUX requests them. Ranges
+  are written as few prefix-files as possible instead of one per address.
+* pxelinux.cfg/default: configuration of the fallback machine set
+  (255.255.255.255), used by PXELINUX if no other file matches.
+* set/<name>: configuration per machine set (like the set/<name> URL).
+
+IPv6-ranges have no representation in PXELINUX file names and are skipped.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from iptools import ipv4
+
+
+FALLBACK_IP = '255.255.255.255'
+MANIFEST = '.pxelinux-export'
+
+
+def hex_prefixes(start, end):
+    """
+    Decompose the IPv4-range [start, end] (integers) into the shortest list of
+    upper case hexadecimal prefixes (1 to 8 digits) PXELINUX looks for.
+    """
+    while start <= end:
+        digits = 0
+        while digits < 7 and start % 16 ** (digits + 1) == 0 and \
+                start + 16 ** (digits + 1) - 1 <= end:
+            digits += 1
+        yield ('%08X' % start)[:8 - digits]
+        start += 16 ** digits
+
+
+class Exporter(object):
+    """
+    Computes the files to export at a given time and writes the changed ones
+    atomically (by rename) to a directory. An exporter remembers what it wrote,
+    so repeated exports (e.g. in a watch-loop) only touch files whose content
+    changed.
+    """
+    def __init__(self, directory, jobs=None):
+        self.directory = directory
+        self.jobs = jobs
+        self.written = self._read_manifest()
+
+    def _read_manifest(self):
+        try:
+            with open(os.path.join(self.directory, MANIFEST)) as manifest:
+                return dict.fromkeys(manifest.read().splitlines())
+        except IOError:
+            return {}
+
+    def files(self, now):
+        """
+        Return a dictionary mapping relative paths to the content (bytes) they
+        should have at datetime now and the datetime at which that changes
+        next.
+        """
+        from pxelinux.index import ip_index
+        from pxelinux.schedule import timelines
+        from pxelinux.views import _find_machine_set_config
+        # The compiled state of this process: only what changes dropped
+        # (see changes.watcher) gets built and rendered again.
+        index = ip_index.get()
+        compiled_timelines = timelines.get()
+        next_change = None
+        configs = {}
+
+        def config(machine_set):
+            if machine_set is None:
+                return None
+            if machine_set.pk not in configs:
+                found = _find_machine_set_config(machine_set, now)
+                configs[machine_set.pk] = found and found.content
+            return configs[machine_set.pk]
+
+        files = {}
+        fallback = config(index.lookup(FALLBACK_IP))
+        if fallback is not None:
+            files['pxelinux.cfg/default'] = fallback
+        for start, end, machine_set in index.segments(0, ipv4.MAX_IP):
+            content = config(machine_set)
+            # Without a file PXELINUX falls back to 'default' by itself.
+            if content is not None:
+                for prefix in hex_prefixes(start, end):
+                    files['pxelinux.cfg/' + prefix] = content
+        # Rendered directly, like the set/<name> view does.
+        for name, machine_set in index.by_name.items():
+            if '/' in name or name.startswith('.'):
+                continue
+            content = config(machine_set) or fallback
+            if content is not None:
+                files['set/' + name] = content
+        for timeline in compiled_timelines.values():
+            change = timeline.next_change(now)
+            if next_change is None or change < next_change:
+                next_change = change
+        return files, next_change
+
+    def _write(self, path, content):
+        path = os.path.join(self.directory, path)
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+        temporary = os.path.join(
+            directory, '.%s.%d.tmp' % (os.path.basename(path), os.getpid()))
+        with open(temporary, 'wb') as output:
+            output.write(content)
+        os.replace(temporary, path)
+
+    def export(self, now):
+        """
+        Write all files that changed since the last export and remove the ones
+        no longer needed. Returns the number of written and removed files and
+        the datetime of the next scheduled change.
+        """
+        files, next_change = self.files(now)
+        changed = [(path, content) for path, content in files.items()
+                   if self.written.get(path) != content]
+        removed = [path for path in self.written if path not in files]
+        with ThreadPoolExecutor(self.jobs) as executor:
+            for _ in executor.map(lambda item: self._write(*item), changed):
+                pass
+        for path in removed:
+            try:
+                os.remove(os.path.join(self.directory, path))
+            except OSError:
+                pass
+        self.written = files
+        if changed or removed:
+            self._write(MANIFEST, '\n'.join(sorted(files)).encode())
+        return len(changed), len(removed), next_change
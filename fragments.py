@@ -0,0 +1,180 @@
+"""
+Pre-rendered fragments of items and menus. Configurations are assembled by
+joining them along the menu graph instead of rendering every item and menu
+from the ORM on each request; edits re-render only the fragments they touch.
+"""
+import threading
+import time
+from collections import defaultdict
+from django.conf import settings
+from pxelinux import metrics, profiling
+from pxelinux.models import Item, Menu, MenuItem, MenuRelation, walk_menus
+
+
+class MenuFragments(object):
+    """
+    Process-local store of the rendered lines of every Item and of every Menu
+    itself (title, background and its items) together with the menu graph.
+    Built from the database on first use. Afterwards items, menus and the
+    graph marked as changed are re-rendered on the next use, and menus
+    containing a changed item are re-assembled from the item fragments. The
+    whole store is rebuilt after PXELINUX_COMPILED_MAX_AGE seconds to pick up
+    changes made through other worker processes.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._built_at = None
+        self._dirty_items = set()
+        self._dirty_menus = set()
+        self._dirty_graph = False
+        self.items = {}
+        self.menus = {}
+        self.menu_items = {}
+        self.menu_fragments = {}
+        self.sub_menus = defaultdict(list)
+        self._relations = []
+
+    def _expired(self):
+        max_age = getattr(settings, 'PXELINUX_COMPILED_MAX_AGE', 60)
+        if self._built_at is None:
+            return True
+        return max_age is not None and \
+            time.monotonic() - self._built_at > max_age
+
+    def invalidate(self):
+        """
+        Drop all fragments. They get rebuilt on next use.
+        """
+        with self._lock:
+            self._built_at = None
+
+    def item_changed(self, pk):
+        with self._lock:
+            self._dirty_items.add(pk)
+
+    def menu_changed(self, pk):
+        """
+        The menu itself or its items (not their content) changed.
+        """
+        with self._lock:
+            self._dirty_menus.add(pk)
+            self._dirty_graph = True
+
+    def graph_changed(self):
+        with self._lock:
+            self._dirty_graph = True
+
+    def _build(self):
+        self.items = {}
+        self._load_items(Item.objects.all())
+        self.menus = {menu.pk: menu for menu in Menu.objects.all()}
+        self.menu_items = defaultdict(list)
+        for menu_id, item_id in MenuItem.objects.values_list(
+                'menu_id', 'item_id'):
+            self.menu_items[menu_id].append(item_id)
+        self.menu_fragments = {}
+        for menu in self.menus.values():
+            self._render_menu(menu)
+        self._load_graph()
+        self._built_at = time.monotonic()
+
+    def _load_items(self, items):
+        for item in items:
+            self.items[item.pk] = (item.label, item.pxelinux_representation())
+
+    def _load_graph(self):
+        self._relations = list(MenuRelation.objects.values_list(
+            'sub_menu_id', 'super_menu_id'))
+
+    def _link_graph(self):
+        self.sub_menus = defaultdict(list)
+        for sub_menu_id, super_menu_id in self._relations:
+            if super_menu_id in self.menus:
+                self.sub_menus[sub_menu_id].append(self.menus[super_menu_id])
+
+    def _render_menu(self, menu):
+        """
+        Assemble the lines of menu after its title (except the master password
+        only shown in root menus) from the item fragments.
+        """
+        lines = []
+        if menu.background_image != '':
+            lines.append("menu background %s" % menu.background_image)
+        for item_id in self.menu_items[menu.pk]:
+            # Items deleted meanwhile are dropped with the menu's items.
+            if item_id in self.items:
+                lines.append(self.items[item_id][1])
+        self.menu_fragments[menu.pk] = lines
+
+    def _refresh(self, menu_id):
+        if self._expired() or menu_id not in self.menus and \
+                menu_id not in self._dirty_menus:
+            self._build()
+        elif self._dirty_items or self._dirty_menus or self._dirty_graph:
+            dirty_menus = set(self._dirty_menus)
+            if self._dirty_items:
+                for pk in self._dirty_items:
+                    self.items.pop(pk, None)
+                self._load_items(
+                    Item.objects.filter(pk__in=self._dirty_items))
+                dirty_menus.update(
+                    pk for pk, item_ids in self.menu_items.items()
+                    if not self._dirty_items.isdisjoint(item_ids))
+            if self._dirty_menus:
+                for pk in self._dirty_menus:
+                    self.menus.pop(pk, None)
+                    self.menu_items.pop(pk, None)
+                    self.menu_fragments.pop(pk, None)
+                self.menus.update(
+                    (menu.pk, menu) for menu in
+                    Menu.objects.filter(pk__in=self._dirty_menus))
+                for pk, item_id in MenuItem.objects.filter(
+                        menu_id__in=self._dirty_menus).values_list(
+                        'menu_id', 'item_id'):
+                    self.menu_items[pk].append(item_id)
+            for pk in dirty_menus:
+                if pk in self.menus:
+                    self._render_menu(self.menus[pk])
+            if self._dirty_graph:
+                self._load_graph()
+        else:
+            return
+        self._dirty_items = set()
+        self._dirty_menus = set()
+        self._dirty_graph = False
+        self._link_graph()
+
+    def _menu_lines(self, root):
+        def menu_lines(menu):
+            lines = ['', "menu title %s" % menu.title]
+            if menu == root and menu.password != '':
+                lines.append("menu master passwd %s" % menu.password)
+            lines.extend(self.menu_fragments[menu.pk])
+            return lines
+        return menu_lines
+
+    def pxelinux_representation(self, menu_id):
+        """
+        Equivalent of Menu.pxelinux_representation() for the menu with the
+        given pk, joined from the fragments.
+        """
+        with profiling.profiled('menu'), self._lock:
+            with metrics.phase('menu_load'):
+                self._refresh(menu_id)
+            root = self.menus[menu_id]
+            profiling.tag(menu=root.label)
+            with metrics.phase('menu_walk'):
+                return walk_menus(
+                    root, self.sub_menus, self._menu_lines(root))
+
+    def default_item(self, menu_id):
+        """
+        Return (label, fragment) of the first item of the given menu.
+        """
+        with self._lock:
+            with metrics.phase('menu_load'):
+                self._refresh(menu_id)
+            return self.items[self.menu_items[menu_id][0]]
+
+
+menu_fragments = MenuFragments()
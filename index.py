@@ -0,0 +1,112 @@
+"""
+In-memory indexes to resolve clients to MachineSets without touching the ORM
+on each request: an interval index of IP-addresses (O(log n)) and a hash map
+of the MAC-addresses and UUIDs of single hosts (O(1)).
+"""
+from django.utils.functional import cached_property
+from iptools import ipv4
+from pxelinux.compiled import CompiledState
+from pxelinux.ip import (
+    IPV4_MAPPED_START, IPV4_MAPPED_END, IntervalTable, address_to_long,
+    flatten_intervals, lookup_rank)
+from pxelinux.models import Host, MachineSet
+
+
+class IPIndex(object):
+    """
+    Maps IP-addresses to the first MachineSet (in the given order) whose
+    ip_ranges contain them. IPv4- and IPv6-ranges are kept in separate tables
+    which mirrors the membership rules of iptools.IpRange (including
+    IPv4-mapped IPv6-addresses matching IPv4-ranges).
+    """
+    def __init__(self, machine_sets):
+        self.machine_sets = list(machine_sets)
+        ipv4_intervals = []
+        ipv6_intervals = []
+        for rank, machine_set in enumerate(self.machine_sets):
+            ip_ranges = machine_set.ip_ranges
+            if not ip_ranges:
+                continue
+            ipv4_intervals.extend(
+                (start, end, rank) for start, end in
+                zip(ip_ranges.ipv4.starts, ip_ranges.ipv4.ends))
+            ipv6_intervals.extend(
+                (start, end, rank) for start, end in
+                zip(ip_ranges.ipv6.starts, ip_ranges.ipv6.ends))
+        self.ipv4 = IntervalTable(ipv4_intervals)
+        self.ipv6 = IntervalTable(ipv6_intervals)
+
+    def lookup(self, ip):
+        """
+        Return the MachineSet for the given IP-address or None.
+        """
+        rank = lookup_rank(self.ipv4, self.ipv6, address_to_long(ip))
+        if rank is None:
+            return None
+        return self.machine_sets[rank]
+
+    @cached_property
+    def by_name(self):
+        """
+        Dictionary of the MachineSets by name. The first of several machine
+        sets with the same name wins.
+        """
+        return dict((machine_set.name, machine_set)
+                    for machine_set in reversed(self.machine_sets))
+
+    def segments(self, start, end):
+        """
+        Split the addresses [start, end] (integers as used by iptools) into
+        (start, end, machine set)-segments of addresses resolving to the same
+        MachineSet (or None), following the rules of lookup().
+        """
+        intervals = [
+            (max(first, start), min(last, end), rank)
+            for first, last, rank in self.ipv6.overlapping(start, end)]
+        if start <= ipv4.MAX_IP:
+            intervals.extend(
+                (max(first, start), min(last, end), rank)
+                for first, last, rank in self.ipv4.overlapping(
+                    start, min(end, ipv4.MAX_IP)))
+        if start <= IPV4_MAPPED_END and end >= IPV4_MAPPED_START:
+            offset = IPV4_MAPPED_START
+            intervals.extend(
+                (max(first + offset, start), min(last + offset, end), rank)
+                for first, last, rank in self.ipv4.overlapping(
+                    max(start, offset) - offset,
+                    min(end, IPV4_MAPPED_END) - offset))
+        position = start
+        for first, last, rank in flatten_intervals(intervals):
+            if first > position:
+                yield position, first - 1, None
+            yield first, last, self.machine_sets[rank]
+            position = last + 1
+        if position <= end:
+            yield position, end, None
+
+
+class HostIndex(object):
+    """
+    Maps the MAC-addresses (lowercase, colon-separated) and UUIDs (lowercase)
+    of Hosts to their MachineSets.
+    """
+    def __init__(self, hosts):
+        self.machine_sets = {}
+        for host in hosts:
+            if host.mac:
+                self.machine_sets[host.mac] = host.machine_set
+            if host.uuid:
+                self.machine_sets[str(host.uuid)] = host.machine_set
+
+    def lookup(self, probe):
+        """
+        Return the MachineSet for a PXELINUX-probe (UUID or 01-MAC) or None.
+        """
+        if probe.startswith('01-'):
+            probe = probe[3:].replace('-', ':')
+        return self.machine_sets.get(probe.lower())
+
+
+ip_index = CompiledState(lambda: IPIndex(MachineSet.objects.all()))
+host_index = CompiledState(lambda: HostIndex(
+    Host.objects.select_related('machine_set')))
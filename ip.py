@@ -1,32 +1,191 @@
 from ast import literal_eval
+from bisect import bisect_right
+from functools import lru_cache
+from heapq import heappush, heappop
 from django.core.exceptions import ValidationError
 from django.utils.six import with_metaclass
 from django.db import models
 from django import forms
-from iptools import IpRangeList
+from iptools import IpRange, ipv4, ipv6
 
 
-class IPRanges(IpRangeList):
+IPV4_MAPPED_START, IPV4_MAPPED_END = (
+    ipv6.ip2long(ip) for ip in ipv6.cidr2block(ipv6.IPV4_MAPPED))
+
+
+def address_to_long(address):
+    """
+    Convert an IPv4- or IPv6-address to the integer used by iptools or None
+    if it is not a valid address.
+    """
+    parsed = ipv4.ip2long(address)
+    if parsed is None:
+        parsed = ipv6.ip2long(address)
+    return parsed
+
+
+def flatten_intervals(intervals):
+    """
+    Sweep over possibly overlapping (start, end, rank)-intervals and return
+    disjoint, sorted (start, end, rank)-segments. Where intervals overlap the
+    one with the lowest rank wins.
+    """
+    intervals = sorted(intervals)
+    segments = []
+    active = []
+    i = 0
+    position = None
+    while i < len(intervals) or active:
+        if not active:
+            position = intervals[i][0]
+        while i < len(intervals) and intervals[i][0] <= position:
+            start, end, rank = intervals[i]
+            heappush(active, (rank, end))
+            i += 1
+        while active and active[0][1] < position:
+            heappop(active)
+        if not active:
+            continue
+        rank, end = active[0]
+        if i < len(intervals) and intervals[i][0] <= end:
+            end = intervals[i][0] - 1
+        if segments and segments[-1][2] == rank and \
+                segments[-1][1] + 1 == position:
+            segments[-1] = (segments[-1][0], end, rank)
+        else:
+            segments.append((position, end, rank))
+        position = end + 1
+    return segments
+
+
+class IntervalTable(object):
     """
-    Extends the IpRangeList class by an equality-operator, basic validation and
-    a human-friendly string-representation.
+    Sorted table of disjoint integer intervals searchable by bisection.
     """
+    __slots__ = ('starts', 'ends', 'ranks')
+
+    def __init__(self, intervals):
+        segments = flatten_intervals(intervals)
+        self.starts = [segment[0] for segment in segments]
+        self.ends = [segment[1] for segment in segments]
+        self.ranks = [segment[2] for segment in segments]
+
+    @classmethod
+    def from_arrays(cls, starts, ends, ranks):
+        """
+        Wrap sorted, disjoint intervals given as sequences (e.g. memoryviews)
+        without copying them.
+        """
+        table = cls.__new__(cls)
+        table.starts = starts
+        table.ends = ends
+        table.ranks = ranks
+        return table
+
+    def __len__(self):
+        return len(self.starts)
+
+    def overlapping(self, start, end):
+        """
+        Yield the (start, end, rank)-segments overlapping [start, end].
+        """
+        i = max(bisect_right(self.starts, start) - 1, 0)
+        while i < len(self.starts) and self.starts[i] <= end:
+            if self.ends[i] >= start:
+                yield self.starts[i], self.ends[i], self.ranks[i]
+            i += 1
+
+    def lookup(self, number):
+        """
+        Return the rank of the interval containing number or None.
+        """
+        i = bisect_right(self.starts, number) - 1
+        if i >= 0 and number <= self.ends[i]:
+            return self.ranks[i]
+        return None
+
+
+def lookup_rank(ipv4_table, ipv6_table, number):
+    """
+    Return the lowest rank of the intervals containing the address number in
+    the given IntervalTables or None. IPv4-intervals also contain the
+    IPv4-mapped IPv6-representations of their addresses, like in iptools.
+    """
+    if number is None:
+        return None
+    ranks = [ipv6_table.lookup(number)]
+    if IPV4_MAPPED_START <= number <= IPV4_MAPPED_END:
+        number &= ipv4.MAX_IP
+    if number <= ipv4.MAX_IP:
+        ranks.append(ipv4_table.lookup(number))
+    ranks = [rank for rank in ranks if rank is not None]
+    if not ranks:
+        return None
+    return min(ranks)
+
+
+class IPRanges(object):
+    """
+    Parsed list of IP-address ranges with basic validation, an
+    equality-operator and a human-friendly string-representation. Accepts
+    the notations of iptools.IpRangeList. The ranges are kept as sorted,
+    disjoint integer intervals (IPv4 and IPv6 separately) so membership tests
+    are a bisection. Instances are immutable; use parse_ip_ranges() to share
+    them between equal strings.
+    """
+    __slots__ = ('initial_string', 'ips', 'ipv4', 'ipv6')
+
     def __init__(self, value, store_text):
         self.initial_string = value if store_text else None
         range_list = literal_eval("[%s]" % value)
         if type(range_list) != list:
             raise TypeError("Not a list.")
-        super(IPRanges, self).__init__(*range_list)
+        self.ips = tuple(map(IpRange, range_list))
+        ipv4_intervals = []
+        ipv6_intervals = []
+        for ip_range in self.ips:
+            interval = (ip_range.startIp, ip_range.endIp, 0)
+            if ip_range.endIp > ipv4.MAX_IP:
+                ipv6_intervals.append(interval)
+            else:
+                ipv4_intervals.append(interval)
+        self.ipv4 = IntervalTable(ipv4_intervals)
+        self.ipv6 = IntervalTable(ipv6_intervals)
+
+    def __contains__(self, item):
+        if isinstance(item, str):
+            item = address_to_long(item)
+            if item is None:
+                raise TypeError("expected ip address")
+        return lookup_rank(self.ipv4, self.ipv6, item) is not None
+
+    def __bool__(self):
+        return bool(self.ips)
+
+    def __repr__(self):
+        return "IpRangeList%r" % (self.ips,)
 
     def __str__(self):
         if self.initial_string is None:
-            return super(IPRanges, self).__str__()[1:-1]
+            return ", ".join(str(ip_range) for ip_range in self.ips)
         else:
             return self.initial_string
 
     def __eq__(self, other):
         return repr(self) == repr(other)
 
+    def __hash__(self):
+        return hash(repr(self))
+
+
+@lru_cache(maxsize=4096)
+def parse_ip_ranges(value, store_text=True):
+    """
+    Return the (shared) IPRanges-object for value. Rows with unchanged
+    ip_ranges are parsed only once per process.
+    """
+    return IPRanges(value, store_text)
+
 
 class IPRangesField(models.TextField):
     """
@@ -47,7 +206,7 @@ class IPRangesField(models.TextField):
         if isinstance(value, IPRanges):
             return value
         try:
-            ip_range_list = IPRanges(value, self.store_text)
+            ip_range_list = parse_ip_ranges(value, self.store_text)
             return ip_range_list
         except Exception:
             raise ValidationError(
@@ -58,7 +217,16 @@ class IPRangesField(models.TextField):
     def from_db_value(self, value, *args):
         if not value:
             return value
-        return IPRanges(value, True)
+        return parse_ip_ranges(value)
+
+    def get_prep_value(self, value):
+        """
+        Store the (validated) string-representation of the IP-ranges.
+        """
+        value = super(IPRangesField, self).get_prep_value(value)
+        if value is None or value == '':
+            return value
+        return str(value)
 
     def db_type(self, connection):
         return 'text'
@@ -0,0 +1,283 @@
+"""
+Last known good configurations, served while the database is slow or
+unavailable. If PXELINUX_LAST_GOOD_DIR is set, every rendered configuration is
+also written to that directory, together with the routing tables (IP-intervals
+and timelines of the machine sets) it was resolved with. Configuration
+requests that need the database then run in a thread pool of
+PXELINUX_LAST_GOOD_THREADS threads (default: 4); if they take longer than
+PXELINUX_DB_DEADLINE seconds (default: 1) once started, fail with a database
+error or wait for a thread while all of them are stuck in calls past the
+deadline, the last known good configuration of the client is served instead,
+resolved with the routing tables in memory (even if expired) or else the ones
+on disk. The request keeps running in the background and refreshes the stored
+copy as soon as the database answers.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from contextvars import copy_context
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections
+from pxelinux import metrics, profiling
+from pxelinux.cache import RenderedConfig
+from pxelinux.index import ip_index
+from pxelinux.ip import IntervalTable, address_to_long, lookup_rank
+from pxelinux.schedule import Timeline, timelines
+
+
+logger = logging.getLogger(__name__)
+
+ROUTES = 'routes.json'
+
+
+class Unavailable(Exception):
+    """
+    The database did not answer in time; the argument is the reason (timeout,
+    error or busy if all threads wait for it past the deadline already).
+    """
+
+
+def _write(path, data):
+    temporary = os.path.join(os.path.dirname(path), '.%s.%d.%d.tmp' % (
+        os.path.basename(path), os.getpid(), threading.get_ident()))
+    with open(temporary, 'wb') as output:
+        output.write(data)
+    os.replace(temporary, path)
+
+
+class Routes(object):
+    """
+    IP-interval tables and timelines of the machine sets, referring to machine
+    sets and timeslots by pk only.
+    """
+    def __init__(self, ipv4, ipv6, machine_set_ids, timelines):
+        self.ipv4 = ipv4
+        self.ipv6 = ipv6
+        self.machine_set_ids = machine_set_ids
+        self.timelines = timelines
+
+    @classmethod
+    def from_state(cls, index, timelines):
+        """
+        Routes of an IPIndex and the timelines (see schedule.build_timelines).
+        """
+        return cls(index.ipv4, index.ipv6, [
+            machine_set.pk for machine_set in index.machine_sets], dict(
+            (machine_set_id, Timeline.from_arrays(timeline.boundaries, [
+                timeslot and timeslot.pk for timeslot in timeline.timeslots]))
+            for machine_set_id, timeline in timelines.items()))
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(
+            IntervalTable.from_arrays(*data['ipv4']),
+            IntervalTable.from_arrays(*data['ipv6']), data['machine_sets'],
+            dict((int(machine_set_id), Timeline.from_arrays(*timeline))
+                 for machine_set_id, timeline in data['timelines'].items()))
+
+    def to_json(self):
+        return {
+            'ipv4': [list(self.ipv4.starts), list(self.ipv4.ends),
+                     list(self.ipv4.ranks)],
+            'ipv6': [list(self.ipv6.starts), list(self.ipv6.ends),
+                     list(self.ipv6.ranks)],
+            'machine_sets': self.machine_set_ids,
+            'timelines': dict(
+                (machine_set_id, [timeline.boundaries, timeline.timeslots])
+                for machine_set_id, timeline in self.timelines.items())}
+
+    def lookup(self, ip):
+        """
+        Return the pk of the machine set for the given IP-address or None.
+        """
+        rank = lookup_rank(self.ipv4, self.ipv6, address_to_long(ip))
+        return None if rank is None else self.machine_set_ids[rank]
+
+    def key(self, machine_set_id, now):
+        """
+        Return the (machine set, timeslot)-key of the configuration of the
+        machine set active at now and the time it changes, or None.
+        """
+        timeline = self.timelines.get(machine_set_id)
+        timeslot_id = timeline and timeline.active(now)
+        if timeslot_id is None:
+            return None
+        return (machine_set_id, timeslot_id), timeline.next_change(now)
+
+
+class LastGood(object):
+    """
+    Stores the rendered configurations on disk and runs the requests needing
+    the database against the deadline.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor = None
+        # Start times of the calls running in the pool.
+        self._running = {}
+        # The compiled state the current routes were derived from.
+        self._state = (None, None)
+        self._routes = None
+        # Modification time and content of the routes loaded from disk.
+        self._loaded = (None, None)
+
+    def directory(self):
+        return getattr(settings, 'PXELINUX_LAST_GOOD_DIR', None)
+
+    def run(self, function, *args):
+        """
+        Return function(*args), called in the thread pool. Raise Unavailable
+        if it does not return within PXELINUX_DB_DEADLINE seconds of starting
+        (it keeps running then), fails with a database error or cannot start
+        as all threads are stuck past the deadline.
+        """
+        deadline = getattr(settings, 'PXELINUX_DB_DEADLINE', 1)
+        threads = getattr(settings, 'PXELINUX_LAST_GOOD_THREADS', 4)
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    threads, thread_name_prefix='pxelinux-last-good')
+        started = threading.Event()
+        future = self._executor.submit(
+            copy_context().run, self._call, function, args, started)
+        # Waiting for a thread is no sign of a slow database, unless all of
+        # them are busy with calls past the deadline.
+        while not started.wait(deadline):
+            if self._stalled(deadline, threads):
+                raise Unavailable('busy')
+        try:
+            return future.result(deadline)
+        except FutureTimeoutError:
+            raise Unavailable('timeout')
+        except DatabaseError as e:
+            logger.error("Database error: %s", e)
+            raise Unavailable('error')
+
+    def _stalled(self, deadline, threads):
+        now = time.monotonic()
+        with self._lock:
+            return len(self._running) >= threads and all(
+                now - start > deadline for start in self._running.values())
+
+    def _call(self, function, args, started):
+        call = object()
+        with self._lock:
+            self._running[call] = time.monotonic()
+        started.set()
+        close_old_connections()
+        try:
+            with metrics.tracked(), profiling.attached():
+                return function(*args)
+        finally:
+            close_old_connections()
+            with self._lock:
+                del self._running[call]
+
+    def save(self, key, config):
+        """
+        Store the RenderedConfig of the (machine set, timeslot)-key and the
+        routing tables compiled now.
+        """
+        directory = self.directory()
+        if directory is None:
+            return
+        try:
+            os.makedirs(directory, exist_ok=True)
+            _write(os.path.join(directory, 'config-%d-%d' % key),
+                   config.content_type.encode() + b'\n' + config.content)
+        except OSError:
+            logger.exception("Could not store a configuration in %s.",
+                             directory)
+        self._update_routes(ip_index.peek(), timelines.peek())
+
+    def _update_routes(self, index, compiled_timelines):
+        """
+        Return the routes of the compiled state, storing them if it changed
+        since the last call. Return None if the state is not built.
+        """
+        if index is None or compiled_timelines is None:
+            return None
+        with self._lock:
+            if self._state[0] is index and \
+                    self._state[1] is compiled_timelines:
+                return self._routes
+        routes = Routes.from_state(index, compiled_timelines)
+        with self._lock:
+            self._state = (index, compiled_timelines)
+            self._routes = routes
+        directory = self.directory()
+        try:
+            os.makedirs(directory, exist_ok=True)
+            _write(os.path.join(directory, ROUTES),
+                   json.dumps(routes.to_json()).encode())
+        except OSError:
+            logger.exception("Could not store the routes in %s.", directory)
+        return routes
+
+    def _load_routes(self):
+        path = os.path.join(self.directory(), ROUTES)
+        try:
+            modified = os.stat(path).st_mtime
+            if self._loaded[0] != modified:
+                with open(path) as routes_file:
+                    self._loaded = (
+                        modified, Routes.from_json(json.load(routes_file)))
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError):
+            logger.exception("Could not load the routes from %s.", path)
+            return None
+        return self._loaded[1]
+
+    def routes(self):
+        """
+        Return the routes compiled in memory (even if expired) or else the
+        ones stored on disk, or None. Never touches the database.
+        """
+        routes = self._update_routes(ip_index.stale(), timelines.stale())
+        if routes is None:
+            routes = self._load_routes()
+        return routes
+
+    def load(self, key, next_change):
+        """
+        Return the stored RenderedConfig of the (machine set, timeslot)-key
+        or None. Its Last-Modified is the time it was stored.
+        """
+        path = os.path.join(self.directory(), 'config-%d-%d' % key)
+        try:
+            with open(path, 'rb') as config_file:
+                content_type, content = config_file.read().split(b'\n', 1)
+                modified = os.fstat(config_file.fileno()).st_mtime
+        except FileNotFoundError:
+            return None
+        except OSError:
+            logger.exception("Could not load the configuration %s.", path)
+            return None
+        return RenderedConfig(content, content_type.decode(), next_change,
+                              last_modified=int(modified))
+
+    def find(self, ip, machine_set_id, now, fallback_ip):
+        """
+        Return the last known good RenderedConfig at now for the IP-address
+        (or the machine set with the given pk), else for the fallback-address,
+        or None.
+        """
+        routes = self.routes()
+        if routes is None:
+            return None
+        if machine_set_id is None:
+            machine_set_id = routes.lookup(ip)
+        for machine_set_id in (machine_set_id, routes.lookup(fallback_ip)):
+            found = routes.key(machine_set_id, now)
+            config = found and self.load(*found)
+            if config is not None:
+                return config
+        return None
+
+
+last_good = LastGood()
@@ -0,0 +1,36 @@
+import json
+from django.core.management.base import BaseCommand
+from django.db import connection
+from pxelinux import benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the boot-request hot path on synthetic data in a "
+        "temporary test database and write the results as JSON.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--machine-sets', type=int, default=100)
+        parser.add_argument('--menus', type=int, default=20)
+        parser.add_argument('--timeslots', type=int, default=8)
+        parser.add_argument('--requests', type=int, default=1000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--output', default=None,
+            help="File to write the JSON results to (default: stdout).")
+
+    def handle(self, **options):
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True)
+        try:
+            results = benchmark.run(
+                options['machine_sets'], options['menus'],
+                options['timeslots'], options['requests'], options['seed'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+        output = json.dumps(results, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as output_file:
+                output_file.write(output + '\n')
+        else:
+            self.stdout.write(output)
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+from pxelinux.models import MachineSet
+from pxelinux.overlaps import analyze, format_range
+
+
+class Command(BaseCommand):
+    help = (
+        "Report IP-addresses claimed by more than one machine set, the ranges "
+        "of machine sets which never resolve to them and machine sets which "
+        "are shadowed completely by others.")
+
+    def handle(self, **options):
+        report = analyze(MachineSet.objects.all())
+        for overlap in report.overlaps:
+            self.stdout.write('overlap %s: %s' % (
+                format_range(overlap.start, overlap.end),
+                ', '.join(str(machine_set)
+                          for machine_set in overlap.machine_sets)))
+        for machine_set, ranges in report.unreachable:
+            self.stdout.write('unreachable in %s: %s' % (
+                machine_set, ', '.join(
+                    format_range(start, end) for start, end in ranges)))
+        for machine_set in report.shadowed:
+            self.stdout.write('shadowed: %s' % machine_set)
+        if report:
+            raise CommandError(
+                "%d overlapping ranges, %d shadowed machine sets." % (
+                    len(report.overlaps), len(report.shadowed)))
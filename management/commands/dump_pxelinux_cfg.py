@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from pxelinux.bulk import dump_json, dump_yaml, export_data
+
+
+class Command(BaseCommand):
+    help = (
+        "Write all items, menus, machine sets and timeslots as JSON or YAML "
+        "in the format read by load_pxelinux_cfg.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--format', choices=('json', 'yaml'), default='json')
+        parser.add_argument(
+            '--output', '-o',
+            help="File to write to (default: standard output).")
+
+    def handle(self, format, output, **options):
+        dump = dump_yaml if format == 'yaml' else dump_json
+        if output is None:
+            for chunk in dump(export_data()):
+                self.stdout.write(chunk, ending='')
+            return
+        with open(output, 'w') as stream:
+            for chunk in dump(export_data()):
+                stream.write(chunk)
@@ -0,0 +1,51 @@
+import time
+from datetime import datetime
+from django.core.management.base import BaseCommand
+from pxelinux import changes
+from pxelinux.export import Exporter
+
+
+class Command(BaseCommand):
+    help = (
+        "Write the current PXELINUX configuration of all machine sets as "
+        "static files (pxelinux.cfg/<HEX>, pxelinux.cfg/default and "
+        "set/<name>) to a directory.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory')
+        parser.add_argument(
+            '--watch', action='store_true',
+            help="Keep running, rewrite the files affected by changes "
+                 "(checked every --interval seconds) and at timeslot "
+                 "boundaries.")
+        parser.add_argument(
+            '--interval', type=float, default=10,
+            help="Seconds between checks for changes in watch mode.")
+        parser.add_argument(
+            '--jobs', type=int, default=None,
+            help="Number of threads writing files.")
+
+    def handle(self, directory, watch, interval, jobs, **options):
+        exporter = Exporter(directory, jobs)
+        # Changes announced on the bus drop only the affected state.
+        changes.watcher.start()
+        exported = None
+        next_change = None
+        while True:
+            # Drops all state if the generation moved unannounced.
+            changes.watcher.poll()
+            now = datetime.now()
+            if exported != changes.watcher.generation or \
+                    next_change is None or now >= next_change:
+                exported = changes.watcher.generation
+                written, removed, next_change = exporter.export(now)
+                if written or removed or options['verbosity'] > 1:
+                    self.stdout.write("%s: wrote %d, removed %d files." % (
+                        now.replace(microsecond=0), written, removed))
+            if not watch:
+                return
+            delay = interval
+            if next_change is not None:
+                delay = min(
+                    delay, (next_change - datetime.now()).total_seconds())
+            time.sleep(max(delay, 0))
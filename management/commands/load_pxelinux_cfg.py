@@ -0,0 +1,44 @@
+import json
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from pxelinux.bulk import import_data
+
+
+class Command(BaseCommand):
+    help = (
+        "Create or update items, menus, machine sets and timeslots from a "
+        "JSON- or YAML-file (see dump_pxelinux_cfg) in one transaction.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'file', help="JSON- or YAML-file, '-' for standard input.")
+        parser.add_argument(
+            '--format', choices=('json', 'yaml'),
+            help="Format of file (default: guessed from its name).")
+        parser.add_argument(
+            '--delete', action='store_true',
+            help="Delete items, menus and machine sets missing in file (only "
+                 "of the kinds it contains).")
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help="Only report what would change.")
+
+    def handle(self, file, format, delete, dry_run, **options):
+        if format is None:
+            format = 'yaml' if file.endswith(('.yaml', '.yml')) else 'json'
+        load, errors = json.load, (ValueError, KeyError)
+        if format == 'yaml':
+            try:
+                import yaml
+            except ImportError:
+                raise CommandError("Reading YAML requires PyYAML.")
+            load, errors = yaml.safe_load, errors + (yaml.YAMLError, )
+        stream = sys.stdin if file == '-' else open(file)
+        try:
+            result = import_data(load(stream) or {}, delete, dry_run)
+        except errors as e:
+            raise CommandError("Invalid document: %s" % e)
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+        self.stdout.write(str(result))
@@ -0,0 +1,36 @@
+import csv
+from datetime import datetime
+from django.core.management.base import BaseCommand, CommandError
+from pxelinux.index import IPIndex
+from pxelinux.models import MachineSet
+from pxelinux.resolve import (
+    COLUMNS, parse_network, parse_time, resolve)
+from pxelinux.schedule import build_timelines
+
+
+class Command(BaseCommand):
+    help = (
+        "Print a CSV-table of which machine set, timeslot and menu the given "
+        "IP-addresses or -ranges boot with at the given times.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'networks', nargs='+', metavar='ip',
+            help="IP-address or CIDR, e.g. 10.0.0.1 or 10.0.0.0/16.")
+        parser.add_argument(
+            '--time', action='append', dest='times', default=[],
+            help="Time of day as HH:MM[:SS], may be repeated "
+                 "(default: now).")
+
+    def handle(self, networks, times, **options):
+        try:
+            times = [parse_time(value) for value in times]
+            networks = [parse_network(value) for value in networks]
+        except ValueError as e:
+            raise CommandError(e)
+        rows = resolve(IPIndex(MachineSet.objects.all()), build_timelines(),
+                       networks, times or [datetime.now().time()])
+        writer = csv.writer(self.stdout)
+        writer.writerow(COLUMNS)
+        for row in rows:
+            writer.writerow(row)
@@ -0,0 +1,44 @@
+import time
+from datetime import datetime
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from pxelinux import changes, snapshot
+
+
+class Command(BaseCommand):
+    help = (
+        "Write a snapshot of the routing tables, schedules and rendered "
+        "configurations which worker processes map into memory to answer "
+        "requests without database queries (see PXELINUX_SNAPSHOT).")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', nargs='?',
+            help="Snapshot file (default: the PXELINUX_SNAPSHOT setting).")
+        parser.add_argument(
+            '--watch', action='store_true',
+            help="Keep running and write a new snapshot whenever the "
+                 "configuration generation moved, checking every --interval "
+                 "seconds.")
+        parser.add_argument(
+            '--interval', type=float, default=10,
+            help="Seconds between checks for changes in watch mode.")
+
+    def handle(self, path, watch, interval, **options):
+        path = path or getattr(settings, 'PXELINUX_SNAPSHOT', None)
+        if path is None:
+            raise CommandError("No path given and PXELINUX_SNAPSHOT not set.")
+        written_generation = None
+        while True:
+            # Only changes move the generation; time is part of the snapshot.
+            generation = changes.current_generation()
+            if generation != written_generation:
+                written = snapshot.write(path, snapshot.build_from_database())
+                written_generation = generation
+                if written or options['verbosity'] > 1:
+                    self.stdout.write("%s: %s %s." % (
+                        datetime.now().replace(microsecond=0),
+                        'wrote' if written else 'unchanged', path))
+            if not watch:
+                return
+            time.sleep(interval)
@@ -0,0 +1,71 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import (
+    setup_test_environment, teardown_test_environment)
+from iptools import IpRange
+from pxelinux import benchmark, storm
+
+
+class Command(BaseCommand):
+    help = (
+        "Simulate many PXE clients booting at once, each following the "
+        "PXELINUX fetch sequence, and write throughput, latencies, "
+        "SQL-queries per boot and error rates as JSON. Runs in-process on "
+        "synthetic data in a temporary test database unless --url is given.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=1000)
+        parser.add_argument(
+            '--arrival', choices=storm.ARRIVALS, default='burst',
+            help="All clients at once, spread over --ramp seconds or at once "
+                 "right after a (simulated) timeslot boundary.")
+        parser.add_argument('--ramp', type=float, default=10)
+        parser.add_argument('--concurrency', type=int, default=50)
+        parser.add_argument(
+            '--url',
+            help="Base URL of a running server to boot against instead.")
+        parser.add_argument(
+            '--network', default='10.0.0.0/16',
+            help="IPv4-network to draw client addresses from with --url.")
+        parser.add_argument('--machine-sets', type=int, default=100)
+        parser.add_argument('--menus', type=int, default=20)
+        parser.add_argument('--timeslots', type=int, default=8)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--output', default=None,
+            help="File to write the JSON results to (default: stdout).")
+
+    def handle(self, **options):
+        if options['url']:
+            network = IpRange(options['network'])
+            if len(network) < options['clients']:
+                raise CommandError("Network too small for all clients.")
+            addresses = [network[i] for i in range(options['clients'])]
+            results = self.simulate(addresses, options)
+        else:
+            setup_test_environment()
+            old_name = connection.creation.create_test_db(
+                verbosity=0, autoclobber=True)
+            try:
+                machine_sets = benchmark.generate_data(
+                    options['machine_sets'], options['menus'],
+                    options['timeslots'], options['seed'])
+                addresses = [machine_sets[i % len(machine_sets)][1]
+                             for i in range(options['clients'])]
+                results = self.simulate(addresses, options)
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+                teardown_test_environment()
+        output = json.dumps(results, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as output_file:
+                output_file.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+    def simulate(self, addresses, options):
+        return storm.simulate(
+            storm.make_clients(addresses, options['seed']),
+            options['arrival'], options['ramp'], options['concurrency'],
+            options['url'])
@@ -0,0 +1,35 @@
+import asyncio
+from django.core.management.base import BaseCommand
+from pxelinux import tftp
+
+
+class Command(BaseCommand):
+    help = (
+        "Serve pxelinux.cfg/* over TFTP with the same resolution as the HTTP "
+        "views. Other files are fetched from --proxy or denied.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='0.0.0.0')
+        parser.add_argument('--port', type=int, default=69)
+        parser.add_argument(
+            '--proxy',
+            help="Base URL of an HTTP server to fetch all other files from "
+                 "(e.g. http://images.example.com/tftpboot/).")
+        parser.add_argument(
+            '--timeout', type=float, default=1.0,
+            help="Seconds to wait for acknowledgements unless the client "
+                 "negotiates a timeout.")
+        parser.add_argument('--retries', type=int, default=5)
+
+    def handle(self, host, port, proxy, timeout, retries, **options):
+        loop = asyncio.new_event_loop()
+        transport, server = loop.run_until_complete(
+            tftp.serve(host, port, proxy, timeout, retries))
+        self.stdout.write("Serving TFTP on %s port %d." % (host, port))
+        try:
+            loop.run_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            transport.close()
+            loop.close()
@@ -0,0 +1,237 @@
+"""
+Process-local metrics of the boot-request hot path, exposed in the Prometheus
+text format: phase timings, SQL-queries, fallbacks and 404s.
+"""
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+from django.conf import settings
+from django.db import connection
+from django.http import Http404
+
+
+logger = logging.getLogger(__name__)
+
+_tracker = ContextVar('pxelinux_request_tracker', default=None)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (name, str(value).replace('\\', r'\\').replace('"', r'\"'))
+        for name, value in pairs)
+
+
+class Counter(object):
+    """
+    Monotonically increasing counter, optionally split by labels.
+    """
+    type = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(labels[name] for name in self.labels), 0)
+
+    def samples(self):
+        for key, value in sorted(self._values.items()):
+            yield self.name + _format_labels(self.labels, key), value
+
+
+class Gauge(Counter):
+    """
+    Value that is set rather than increased, optionally split by labels.
+    """
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Counter):
+    """
+    Distribution of observed values in cumulative buckets.
+    """
+    type = 'histogram'
+
+    def __init__(self, name, documentation, buckets, labels=()):
+        super(Histogram, self).__init__(name, documentation, labels)
+        self.buckets = tuple(buckets) + (float('inf'), )
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # Counts per bucket (the last one, +Inf, counts all values)
+                # followed by the sum of all values.
+                counts = self._values[key] = [0] * len(self.buckets) + [0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-1] += value
+
+    def samples(self):
+        for key, counts in sorted(self._values.items()):
+            for bound, count in zip(self.buckets, counts):
+                yield self.name + '_bucket' + _format_labels(
+                    self.labels, key, [('le', '+Inf' if bound == float('inf')
+                                        else repr(bound))]), count
+            yield self.name + '_sum' + _format_labels(
+                self.labels, key), counts[-1]
+            yield self.name + '_count' + _format_labels(
+                self.labels, key), counts[-2]
+
+
+requests = Counter(
+    'pxelinux_requests_total',
+    "Configuration requests by result (ok, not_found, error, rejected).",
+    labels=('result', ))
+fallbacks = Counter(
+    'pxelinux_fallbacks_total',
+    "Requests answered for the fallback-address 255.255.255.255.")
+render_cache = Counter(
+    'pxelinux_render_cache_total',
+    "Rendered configuration cache lookups by result (hit, miss).",
+    labels=('result', ))
+coalesced = Counter(
+    'pxelinux_coalesced_requests_total',
+    "Requests which waited for a concurrent identical render instead of "
+    "rendering themselves, by flight (render: threads, async: event loop).",
+    labels=('flight', ))
+boot_events_dropped = Counter(
+    'pxelinux_boot_events_dropped_total',
+    "Boot events not recorded because the buffer was full or writing them "
+    "failed.")
+stale_responses = Counter(
+    'pxelinux_stale_responses_total',
+    "Last known good configurations served because the database did not "
+    "answer in time (timeout, error, busy), none: there was none to serve.",
+    labels=('reason', ))
+startup_seconds = Gauge(
+    'pxelinux_startup_seconds',
+    "Seconds spent per phase of the process start-up (apps: loading the "
+    "Django apps, the others: warm-up, see warmup.py).",
+    labels=('phase', ))
+request_seconds = Histogram(
+    'pxelinux_request_seconds',
+    "Time to answer a configuration request.",
+    (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5))
+phase_seconds = Histogram(
+    'pxelinux_phase_seconds',
+    "Time spent per phase of a configuration request.",
+    (.0001, .0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1),
+    labels=('phase', ))
+request_queries = Histogram(
+    'pxelinux_request_queries',
+    "SQL-queries per configuration request.",
+    (0, 1, 2, 3, 5, 10, 20, 50, 100))
+
+REGISTRY = [requests, fallbacks, render_cache, coalesced,
+            boot_events_dropped, stale_responses, startup_seconds,
+            request_seconds, phase_seconds, request_queries]
+
+
+def render():
+    """
+    Return all metrics in the Prometheus text exposition format.
+    """
+    lines = []
+    for metric in REGISTRY:
+        lines.append('# HELP %s %s' % (metric.name, metric.documentation))
+        lines.append('# TYPE %s %s' % (metric.name, metric.type))
+        for name, value in metric.samples():
+            lines.append('%s %s' % (name, value))
+    return '\n'.join(lines) + '\n'
+
+
+@contextmanager
+def phase(name):
+    """
+    Time the enclosed block as phase name of the current request.
+    """
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        seconds = perf_counter() - start
+        phase_seconds.observe(seconds, phase=name)
+        tracker = _tracker.get()
+        if tracker is not None:
+            tracker.phases[name] = tracker.phases.get(name, 0) + seconds
+
+
+class RequestTracker(object):
+    """
+    Context manager recording duration, SQL-queries and result of a
+    configuration request and logging it if it takes longer than
+    PXELINUX_SLOW_REQUEST_MS milliseconds (default: 500, None to disable).
+    """
+    def __init__(self, ip):
+        self.ip = ip
+        self.phases = {}
+        self.queries = 0
+
+    def _count_query(self, execute, sql, params, many, context):
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        self._token = _tracker.set(self)
+        self._wrapper = connection.execute_wrapper(self._count_query)
+        self._wrapper.__enter__()
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        seconds = perf_counter() - self.start
+        self._wrapper.__exit__(exc_type, exc_value, traceback)
+        _tracker.reset(self._token)
+        if exc_type is None:
+            result = 'ok'
+        elif issubclass(exc_type, Http404):
+            result = 'not_found'
+        else:
+            result = 'error'
+        requests.inc(result=result)
+        request_seconds.observe(seconds)
+        request_queries.observe(self.queries)
+        threshold = getattr(settings, 'PXELINUX_SLOW_REQUEST_MS', 500)
+        if threshold is not None and seconds * 1000 > threshold:
+            logger.warning(
+                'Slow request for %s (%s): %.1f ms (%s), %d queries.',
+                self.ip, result, seconds * 1000, ', '.join(
+                    '%s %.1f ms' % (name, phase_seconds * 1000)
+                    for name, phase_seconds in sorted(self.phases.items())),
+                self.queries)
+
+
+@contextmanager
+def tracked():
+    """
+    Count the SQL-queries of this thread for the request tracked in this
+    context, for parts of a request run in another thread (with a copy of
+    the request's context).
+    """
+    tracker = _tracker.get()
+    if tracker is None:
+        yield
+        return
+    with connection.execute_wrapper(tracker._count_query):
+        yield
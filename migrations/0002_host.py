@@ -0,0 +1,30 @@
+# Generated by Django 2.2.28 on 2026-10-18 02:26
+
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pxelinux', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='machineset',
+            name='name',
+            field=models.CharField(db_index=True, help_text='Descriptive name.', max_length=1023),
+        ),
+        migrations.CreateModel(
+            name='Host',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(blank=True, help_text='Descriptive name, e.g. the hostname.', max_length=255)),
+                ('mac', models.CharField(blank=True, max_length=17, null=True, unique=True, validators=[django.core.validators.RegexValidator('^[0-9a-fA-F]{2}([:-]?[0-9a-fA-F]{2}){5}$', 'Enter a MAC-address like 00:11:22:aa:bb:cc.')], verbose_name='MAC-address')),
+                ('uuid', models.UUIDField(blank=True, help_text='SMBIOS-UUID of the client.', null=True, unique=True, verbose_name='UUID')),
+                ('machine_set', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='hosts', to='pxelinux.MachineSet')),
+            ],
+        ),
+    ]
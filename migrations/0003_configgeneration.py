@@ -0,0 +1,21 @@
+# Generated by Django 2.2.28 on 2026-10-18 02:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pxelinux', '0002_host'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConfigGeneration',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('generation', models.BigIntegerField(default=0)),
+                ('changed', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 2.2.28 on 2026-10-18 02:29
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pxelinux', '0003_configgeneration'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BootEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('time', models.DateTimeField(db_index=True)),
+                ('ip', models.GenericIPAddressField(help_text='Address the configuration was requested for.', null=True, verbose_name='IP-address')),
+                ('fallback', models.BooleanField(default=False, help_text='Served the configuration of 255.255.255.255.')),
+                ('machine_set', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='boot_events', to='pxelinux.MachineSet')),
+                ('menu', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='boot_events', to='pxelinux.Menu')),
+                ('timeslot', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='boot_events', to='pxelinux.TimeSlot')),
+            ],
+            options={
+                'ordering': ['-time'],
+            },
+        ),
+        migrations.CreateModel(
+            name='BootCount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('count', models.IntegerField(default=0)),
+                ('machine_set', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='boot_counts', to='pxelinux.MachineSet')),
+            ],
+            options={
+                'ordering': ['-date'],
+                'unique_together': {('machine_set', 'date')},
+            },
+        ),
+    ]
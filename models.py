@@ -1,4 +1,8 @@
+import re
+from collections import defaultdict
 from datetime import time
+from django.core.exceptions import ValidationError
+from django.core.validators import RegexValidator
 from django.db import models
 from django.contrib.auth.models import User
 from pxelinux.ip import IPRangesField
@@ -113,40 +117,12 @@ class Menu(models.Model):
     def __str__(self):
         return "%s from %s" % (self.label, self.owner)
 
-    def pxelinux_representation(self, visited=None, top=None):
+    def pxelinux_representation(self):
         """
         Generates a menu-structure in PXELINUX configuration syntax. All linked
         sub-menus get included (exactly once).
         """
-        lines = ['', ]
-        lines.append("menu title %s" % self.title)
-        if visited is None:
-            top = self
-            visited = set([self])
-            if self.password != '':
-                lines.append("menu master passwd %s" % self.password)
-        if self.background_image != '':
-            lines.append("menu background %s" % self.background_image)
-        for menu_item in self.menuitem_set.all():
-            lines.append(menu_item.item.pxelinux_representation())
-        for menu_relation in self.sub_menu.all():
-            submenu = menu_relation.super_menu
-            if submenu in visited:
-                lines.append('label %s' % submenu.label)
-                if top == submenu:
-                    lines.append('menu goto .top')
-                else:
-                    lines.append('menu goto %s' % submenu.label)
-                lines.append('menu label %s' % submenu.title)
-            else:
-                visited.add(submenu)
-                lines.append('menu begin %s' % submenu.label)
-                if submenu.password != '':
-                    lines.append("menu passwd %s" % submenu.password)
-                lines.append(submenu.pxelinux_representation(
-                    visited=visited, top=top))
-                lines.append('menu end')
-        return "\n".join(lines)
+        return MenuGraph(self).pxelinux_representation()
 
     def pretty_print(self):
         """
@@ -171,6 +147,7 @@ class MachineSet(models.Model):
     """
     name = models.CharField(
         max_length=1023,
+        db_index=True,
         help_text="Descriptive name.")
     ip_ranges = IPRangesField(
         max_length=1024,
@@ -187,6 +164,57 @@ class MachineSet(models.Model):
         return self.name
 
 
+def normalize_mac(mac):
+    """
+    Lowercase, colon-separated notation of a MAC-address given with colons,
+    dashes or no separators.
+    """
+    digits = re.sub(r'[:-]', '', mac).lower()
+    return ':'.join(digits[i:i + 2] for i in range(0, len(digits), 2))
+
+
+class Host(models.Model):
+    """
+    A single client, identified by its MAC-address and/or SMBIOS-UUID (as
+    sent by PXELINUX), which boots with the given machine set regardless of
+    its IP-address.
+    """
+    name = models.CharField(
+        max_length=255,
+        blank=True,
+        help_text="Descriptive name, e.g. the hostname.")
+    mac = models.CharField(
+        max_length=17,
+        unique=True,
+        null=True,
+        blank=True,
+        validators=[RegexValidator(
+            r'^[0-9a-fA-F]{2}([:-]?[0-9a-fA-F]{2}){5}$',
+            "Enter a MAC-address like 00:11:22:aa:bb:cc.")],
+        verbose_name="MAC-address")
+    uuid = models.UUIDField(
+        unique=True,
+        null=True,
+        blank=True,
+        verbose_name="UUID",
+        help_text="SMBIOS-UUID of the client.")
+    machine_set = models.ForeignKey(
+        MachineSet, related_name='hosts', on_delete=models.CASCADE)
+
+    def __str__(self):
+        return self.name or str(self.mac or self.uuid)
+
+    def clean(self):
+        # Before validate_unique, which compares the normalized notation.
+        self.mac = normalize_mac(self.mac) if self.mac else None
+        if not self.mac and not self.uuid:
+            raise ValidationError("Enter a MAC-address or a UUID.")
+
+    def save(self, *args, **kwargs):
+        self.mac = normalize_mac(self.mac) if self.mac else None
+        super(Host, self).save(*args, **kwargs)
+
+
 class MenuItem(models.Model):
     """
     Specifies the relation between an item and a menu.
@@ -237,3 +265,128 @@ class TimeSlot(models.Model):
 
     class Meta:
         ordering = ['priority', 'time_start', 'time_end']
+
+
+class ConfigGeneration(models.Model):
+    """
+    Single row counting the changes of the boot configuration, so that every
+    process can tell cheaply whether its compiled state is stale (see
+    changes.py).
+    """
+    generation = models.BigIntegerField(default=0)
+    changed = models.DateTimeField(auto_now=True)
+
+
+class BootEvent(models.Model):
+    """
+    A configuration served to a client (see telemetry.py).
+    """
+    time = models.DateTimeField(db_index=True)
+    ip = models.GenericIPAddressField(
+        null=True, verbose_name="IP-address",
+        help_text="Address the configuration was requested for.")
+    machine_set = models.ForeignKey(
+        MachineSet, null=True, related_name='boot_events',
+        on_delete=models.SET_NULL)
+    timeslot = models.ForeignKey(
+        TimeSlot, null=True, related_name='boot_events',
+        on_delete=models.SET_NULL)
+    menu = models.ForeignKey(
+        Menu, null=True, related_name='boot_events',
+        on_delete=models.SET_NULL)
+    fallback = models.BooleanField(
+        default=False,
+        help_text="Served the configuration of 255.255.255.255.")
+
+    class Meta:
+        ordering = ['-time']
+
+
+class BootCount(models.Model):
+    """
+    Number of boots of a machine set per day, kept after the BootEvents
+    expire.
+    """
+    machine_set = models.ForeignKey(
+        MachineSet, related_name='boot_counts', on_delete=models.CASCADE)
+    date = models.DateField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        ordering = ['-date']
+        unique_together = [('machine_set', 'date')]
+
+
+class MenuGraph(object):
+    """
+    A menu together with all menus and items reachable from it, loaded with a
+    fixed number of queries.
+    """
+    def __init__(self, root):
+        self.root = root
+        self.sub_menus = defaultdict(list)
+        for menu_relation in MenuRelation.objects.select_related('super_menu'):
+            self.sub_menus[menu_relation.sub_menu_id].append(
+                menu_relation.super_menu)
+        reachable = set([root.pk])
+        pending = [root.pk]
+        while pending:
+            for submenu in self.sub_menus[pending.pop()]:
+                if submenu.pk not in reachable:
+                    reachable.add(submenu.pk)
+                    pending.append(submenu.pk)
+        self.items = defaultdict(list)
+        for menu_item in MenuItem.objects.filter(
+                menu_id__in=reachable).select_related('item'):
+            self.items[menu_item.menu_id].append(menu_item.item)
+
+    def _menu_lines(self, menu):
+        lines = ['', ]
+        lines.append("menu title %s" % menu.title)
+        if menu == self.root and menu.password != '':
+            lines.append("menu master passwd %s" % menu.password)
+        if menu.background_image != '':
+            lines.append("menu background %s" % menu.background_image)
+        for item in self.items[menu.pk]:
+            lines.append(item.pxelinux_representation())
+        return lines
+
+    def pxelinux_representation(self):
+        """
+        Generates the menu-structure of the root menu in PXELINUX configuration
+        syntax.
+        """
+        return walk_menus(self.root, self.sub_menus, self._menu_lines)
+
+
+def walk_menus(root, sub_menus, menu_lines):
+    """
+    Generates the menu-structure of root in PXELINUX configuration syntax from
+    sub_menus (mapping menu pks to lists of sub-menus) and menu_lines
+    (returning the lines of a menu itself). Walks the graph depth-first; menus
+    seen before are linked by 'menu goto' instead of being included again.
+    """
+    lines = menu_lines(root)
+    visited = set([root])
+    stack = [iter(sub_menus[root.pk])]
+    while stack:
+        submenu = next(stack[-1], None)
+        if submenu is None:
+            stack.pop()
+            if stack:
+                lines.append('menu end')
+        elif submenu in visited:
+            lines.append('label %s' % submenu.label)
+            if submenu == root:
+                lines.append('menu goto .top')
+            else:
+                lines.append('menu goto %s' % submenu.label)
+            lines.append('menu label %s' % submenu.title)
+        else:
+            visited.add(submenu)
+            lines.append('menu begin %s' % submenu.label)
+            if submenu.password != '':
+                lines.append("menu passwd %s" % submenu.password)
+            lines.extend(menu_lines(submenu))
+            stack.append(iter(sub_menus[submenu.pk]))
+    return "\n".join(lines)
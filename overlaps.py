@@ -0,0 +1,119 @@
+"""
+Sweep-line analysis of the IP-ranges of all machine sets: addresses claimed
+by more than one set (overlaps), parts of a set's ranges resolving to an
+earlier set (unreachable ranges) and sets no address resolves to (shadowed
+sets). Takes O(n log n) time in the number of ranges plus the size of the
+report, instead of comparing all pairs of sets.
+"""
+from collections import defaultdict, namedtuple
+from iptools import ipv4, ipv6
+from pxelinux.ip import IPV4_MAPPED_START
+
+
+Overlap = namedtuple('Overlap', ('start', 'end', 'machine_sets'))
+
+
+def format_range(start, end):
+    """
+    Human-friendly representation of the addresses [start, end].
+    """
+    version = ipv6 if end > ipv4.MAX_IP else ipv4
+    if start == end:
+        return version.long2ip(start)
+    return '%s-%s' % (version.long2ip(start), version.long2ip(end))
+
+
+def _intervals(machine_sets):
+    """
+    Yield (start, end, rank, alias)-intervals of the machine sets' ranges.
+    IPv4-ranges also cover their IPv4-mapped IPv6-addresses (see
+    ip.lookup_rank); those copies are marked as alias.
+    """
+    for rank, machine_set in enumerate(machine_sets):
+        ip_ranges = machine_set.ip_ranges
+        if not ip_ranges:
+            continue
+        for start, end in zip(ip_ranges.ipv4.starts, ip_ranges.ipv4.ends):
+            yield start, end, rank, False
+            yield (start + IPV4_MAPPED_START, end + IPV4_MAPPED_START, rank,
+                   True)
+        for start, end in zip(ip_ranges.ipv6.starts, ip_ranges.ipv6.ends):
+            yield start, end, rank, False
+
+
+def sweep(intervals):
+    """
+    Yield (start, end, ranks) for the disjoint segments covered by the given
+    (start, end, rank, alias)-intervals, ranks being the sorted ranks of all
+    intervals covering a segment. Segments covered by aliases only duplicate
+    the addresses they alias and are skipped.
+    """
+    events = []
+    for start, end, rank, alias in intervals:
+        events.append((start, 1, rank, alias))
+        events.append((end + 1, -1, rank, alias))
+    events.sort()
+    real = defaultdict(int)
+    aliases = defaultdict(int)
+    i = 0
+    while i < len(events):
+        position = events[i][0]
+        while i < len(events) and events[i][0] == position:
+            delta, rank, alias = events[i][1:]
+            counts = aliases if alias else real
+            counts[rank] += delta
+            if not counts[rank]:
+                del counts[rank]
+            i += 1
+        if real:
+            ranks = sorted(set(real) | set(aliases))
+            yield position, events[i][0] - 1, ranks
+
+
+class OverlapReport(object):
+    """
+    Result of analyze(). overlaps is a list of Overlap-tuples with the machine
+    sets in the order in which they win, unreachable a list of (machine set,
+    (start, end)-ranges of its addresses resolving to an earlier set)-pairs
+    and shadowed a list of the sets none of whose addresses resolve to them.
+    """
+    def __init__(self, overlaps, unreachable, shadowed):
+        self.overlaps = overlaps
+        self.unreachable = unreachable
+        self.shadowed = shadowed
+
+    def __bool__(self):
+        return bool(self.overlaps)
+
+
+def analyze(machine_sets):
+    """
+    Analyze the ranges of machine_sets, given in the order in which
+    generate_config tries them.
+    """
+    machine_sets = list(machine_sets)
+    overlaps = []
+    unreachable = defaultdict(list)
+    winning = set()
+    for start, end, ranks in sweep(_intervals(machine_sets)):
+        winning.add(ranks[0])
+        if len(ranks) == 1:
+            continue
+        members = tuple(machine_sets[rank] for rank in ranks)
+        if overlaps and overlaps[-1].end + 1 == start and \
+                overlaps[-1].machine_sets == members:
+            overlaps[-1] = overlaps[-1]._replace(end=end)
+        else:
+            overlaps.append(Overlap(start, end, members))
+        for rank in ranks[1:]:
+            ranges = unreachable[rank]
+            if ranges and ranges[-1][1] + 1 == start:
+                ranges[-1] = (ranges[-1][0], end)
+            else:
+                ranges.append((start, end))
+    shadowed = [
+        machine_set for rank, machine_set in enumerate(machine_sets)
+        if machine_set.ip_ranges and rank not in winning]
+    unreachable = [(machine_sets[rank], ranges)
+                   for rank, ranges in sorted(unreachable.items())]
+    return OverlapReport(overlaps, unreachable, shadowed)
@@ -0,0 +1,190 @@
+"""
+Opt-in sampling profiler for configuration requests (views.generate_config)
+and menu rendering (Menu.pxelinux_representation). If PXELINUX_PROFILE_DIR is
+set, one in PXELINUX_PROFILE_SAMPLE calls (default: None, none) and every
+request carrying a valid signed X-Pxelinux-Profile header (see make_token)
+is run under cProfile. Each profile is written to the directory as
+<time>-<pid>-<name>-<tags>.prof (cProfile stats, e.g. for pstats or
+snakeviz) with a .json of the same name holding the tags (machine set, menu
+label), host, duration and the SQL-queries issued. Only the newest
+PXELINUX_PROFILE_KEEP profiles (default: 100) are kept.
+"""
+import json
+import logging
+import os
+import random
+import re
+import socket
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.conf import settings
+from django.core import signing
+from django.db import connection
+
+
+logger = logging.getLogger(__name__)
+
+HEADER = 'HTTP_X_PXELINUX_PROFILE'
+SALT = 'pxelinux.profiling'
+TOKEN_MAX_AGE = 24 * 60 * 60
+
+_active = ContextVar('pxelinux_profile', default=None)
+
+
+def make_token():
+    """
+    Return a value for the X-Pxelinux-Profile header, valid for a day.
+    """
+    return signing.TimestampSigner(salt=SALT).sign('profile')
+
+
+def _requested(request):
+    token = request.META.get(HEADER) if request is not None else None
+    if not token:
+        return False
+    try:
+        signing.TimestampSigner(salt=SALT).unsign(token, max_age=TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        return False
+    return True
+
+
+def _sampled():
+    rate = getattr(settings, 'PXELINUX_PROFILE_SAMPLE', None)
+    return rate is not None and random.randrange(rate) == 0
+
+
+def tag(**tags):
+    """
+    Tag the profile running in this context, if any.
+    """
+    profile = _active.get()
+    if profile is not None:
+        profile.tags.update(tags)
+
+
+def _profiler():
+    # Imported here as profiling is rare.
+    import cProfile
+    return cProfile.Profile()
+
+
+class Profile(object):
+    """
+    cProfile stats, SQL-queries and tags of one profiled call.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.tags = {}
+        self.queries = []
+        self.profiler = _profiler()
+        # Profilers of parts run in other threads (see attached).
+        self.other_profilers = []
+
+    def record_query(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({
+                'sql': sql, 'params': repr(params), 'many': many,
+                'ms': (time.perf_counter() - start) * 1000})
+
+    def write(self, directory, seconds, error=None):
+        """
+        Write the profile to directory and delete the oldest ones beyond
+        PXELINUX_PROFILE_KEEP.
+        """
+        now = time.time()
+        name = '-'.join(
+            [time.strftime('%Y%m%dT%H%M%S', time.localtime(now)) +
+             '.%06d' % (now % 1 * 10 ** 6), str(os.getpid()), self.name] +
+            [re.sub(r'[^\w.]+', '_', str(value))
+             for _, value in sorted(self.tags.items())])
+        path = os.path.join(directory, name)
+        os.makedirs(directory, exist_ok=True)
+        if self.other_profilers:
+            # Imported here as profiling is rare.
+            import pstats
+            stats = pstats.Stats(self.profiler)
+            for profiler in list(self.other_profilers):
+                stats.add(profiler)
+            stats.dump_stats(path + '.prof')
+        else:
+            self.profiler.dump_stats(path + '.prof')
+        with open(path + '.json', 'w') as info:
+            json.dump({
+                'name': self.name, 'tags': self.tags, 'time': now,
+                'host': socket.gethostname(), 'pid': os.getpid(),
+                'seconds': seconds, 'error': error,
+                'queries': self.queries}, info, indent=2, sort_keys=True)
+        rotate(directory, getattr(settings, 'PXELINUX_PROFILE_KEEP', 100))
+
+
+def rotate(directory, keep):
+    """
+    Delete all but the newest keep profiles in directory.
+    """
+    profiles = sorted(name[:-len('.prof')] for name in os.listdir(directory)
+                      if name.endswith('.prof'))
+    for name in profiles[:max(len(profiles) - keep, 0)]:
+        for extension in ('.prof', '.json'):
+            try:
+                os.remove(os.path.join(directory, name + extension))
+            except FileNotFoundError:
+                # Rotated by another process.
+                pass
+
+
+@contextmanager
+def profiled(name, request=None):
+    """
+    Profile the block if it is sampled or the request asks for it (and no
+    profile is running in this context already).
+    """
+    directory = getattr(settings, 'PXELINUX_PROFILE_DIR', None)
+    if directory is None or _active.get() is not None or not (
+            _requested(request) or _sampled()):
+        yield
+        return
+    profile = Profile(name)
+    token = _active.set(profile)
+    error = None
+    start = time.perf_counter()
+    try:
+        with connection.execute_wrapper(profile.record_query):
+            profile.profiler.enable()
+            try:
+                yield
+            finally:
+                profile.profiler.disable()
+    except Exception as e:
+        error = type(e).__name__
+        raise
+    finally:
+        _active.reset(token)
+        try:
+            profile.write(directory, time.perf_counter() - start, error)
+        except OSError:
+            logger.exception("Could not write profile to %s.", directory)
+
+
+@contextmanager
+def attached():
+    """
+    Profile the block as part of the profile running in this context, if any,
+    for parts of a call run in another thread (with a copy of its context).
+    """
+    profile = _active.get()
+    if profile is None:
+        yield
+        return
+    profiler = _profiler()
+    with connection.execute_wrapper(profile.record_query):
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profile.other_profilers.append(profiler)
@@ -0,0 +1,66 @@
+"""
+Bulk resolution of many IP-addresses or -ranges at many times of day to the
+machine set, timeslot and menu they boot with, in one pass over the compiled
+index and timelines instead of one generate_config-call per pair.
+"""
+from datetime import date, datetime
+from iptools import IpRange, ipv4, ipv6
+
+
+FALLBACK_IP = '255.255.255.255'
+COLUMNS = ('first_ip', 'last_ip', 'time', 'machine_set', 'timeslot', 'menu')
+
+
+def parse_time(value):
+    """
+    Parse 'HH:MM' or 'HH:MM:SS' to a datetime.time.
+    """
+    for time_format in ('%H:%M', '%H:%M:%S'):
+        try:
+            return datetime.strptime(value, time_format).time()
+        except ValueError:
+            pass
+    raise ValueError("Invalid time: %s" % value)
+
+
+def parse_network(value):
+    """
+    Parse an IP-address, CIDR or IPv4-subnet to an iptools.IpRange.
+    """
+    try:
+        return IpRange(value)
+    except Exception:
+        raise ValueError("Invalid IP-address or network: %s" % value)
+
+
+def resolve(index, timelines, networks, times):
+    """
+    Yield a row (see COLUMNS) for every range of addresses in networks
+    (iptools.IpRange-objects, see parse_network) resolving to
+    the same machine set, at each of the given times (datetime.time). Machine
+    set, timeslot and menu are None where generate_config would answer 404.
+    """
+    fallback_set = index.lookup(FALLBACK_IP)
+    resolved = {}
+
+    def timeslot(machine_set, at):
+        if (machine_set, at) not in resolved:
+            timeline = machine_set and timelines.get(machine_set.pk)
+            active = timeline and timeline.active(
+                datetime.combine(date.today(), at))
+            resolved[machine_set, at] = (machine_set, active)
+        return resolved[machine_set, at]
+
+    for ip_range in networks:
+        version = ipv6 if ip_range.endIp > ipv4.MAX_IP else ipv4
+        for start, end, machine_set in index.segments(
+                ip_range.startIp, ip_range.endIp):
+            for at in times:
+                resolved_set, active = timeslot(machine_set, at)
+                if active is None:
+                    resolved_set, active = timeslot(fallback_set, at)
+                yield (version.long2ip(start), version.long2ip(end),
+                       at.isoformat(), resolved_set and resolved_set.name,
+                       active and '%s-%s' % (active.time_start.isoformat(),
+                                             active.time_end.isoformat()),
+                       active and active.menu.label)
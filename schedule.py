@@ -0,0 +1,101 @@
+"""
+Compiled daily schedules: the TimeSlots of each MachineSet turned into a
+sorted array of boundaries, so the active TimeSlot and the time of the next
+change are found by bisection.
+"""
+from bisect import bisect_right
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from pxelinux.compiled import CompiledState
+from pxelinux.models import TimeSlot
+
+
+_DAY = 24 * 60 * 60 * 10 ** 6
+
+
+def _microseconds(value):
+    """
+    Microseconds since midnight for a datetime.time.
+    """
+    return ((value.hour * 60 + value.minute) * 60 + value.second) * \
+        10 ** 6 + value.microsecond
+
+
+class Timeline(object):
+    """
+    Splits a day into segments, each mapped to the timeslot active in it (or
+    None). A timeslot is active while time_start <= time <= time_end; where
+    timeslots overlap, the first one in TimeSlot-ordering wins.
+    """
+    def __init__(self, timeslots):
+        timeslots = sorted(timeslots, key=lambda timeslot: (
+            timeslot.priority, timeslot.time_start, timeslot.time_end,
+            timeslot.pk))
+        intervals = [(_microseconds(timeslot.time_start),
+                      _microseconds(timeslot.time_end) + 1, timeslot)
+                     for timeslot in timeslots]
+        points = set([0, _DAY])
+        for start, end, timeslot in intervals:
+            points.update((start, end))
+        self.boundaries = []
+        self.timeslots = []
+        for point in sorted(points):
+            if point >= _DAY:
+                break
+            winner = next((timeslot for start, end, timeslot in intervals
+                           if start <= point < end), None)
+            if not self.timeslots or self.timeslots[-1] != winner:
+                self.boundaries.append(point)
+                self.timeslots.append(winner)
+        self.boundaries.append(_DAY)
+
+    @classmethod
+    def from_arrays(cls, boundaries, timeslots):
+        """
+        Wrap compiled boundaries (microseconds since midnight, ending with a
+        day) and the timeslots (or keys of timeslots) of the segments between
+        them, e.g. memoryviews, without copying them.
+        """
+        timeline = cls.__new__(cls)
+        timeline.boundaries = boundaries
+        timeline.timeslots = timeslots
+        return timeline
+
+    def _segment(self, now):
+        return bisect_right(self.boundaries, _microseconds(now.time())) - 1
+
+    def active(self, now):
+        """
+        Return the timeslot active at the datetime now or None.
+        """
+        return self.timeslots[self._segment(now)]
+
+    def next_change(self, now):
+        """
+        Return the datetime after now at which the active timeslot changes.
+        """
+        i = self._segment(now) + 1
+        midnight = datetime.combine(now.date(), time())
+        if i == len(self.timeslots):
+            if len(self.timeslots) == 1:
+                # The same timeslot (or none) is active all day.
+                return midnight + timedelta(days=1)
+            if self.timeslots[-1] == self.timeslots[0]:
+                # The last segment continues after midnight.
+                i = 1
+                midnight += timedelta(days=1)
+        return midnight + timedelta(microseconds=self.boundaries[i])
+
+
+def build_timelines():
+    """
+    Compile the timelines of all MachineSets, keyed by MachineSet-id.
+    """
+    timeslots = defaultdict(list)
+    for timeslot in TimeSlot.objects.select_related('menu'):
+        timeslots[timeslot.machine_set_id].append(timeslot)
+    return dict((machine_set_id, Timeline(machine_set_timeslots))
+                for machine_set_id, machine_set_timeslots in timeslots.items())
+
+
+timelines = CompiledState(build_timelines)
@@ -0,0 +1,89 @@
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from pxelinux import changes
+from pxelinux.cache import rendered_configs
+from pxelinux.fragments import menu_fragments
+from pxelinux.index import host_index, ip_index
+from pxelinux.models import (
+    Host, Item, Menu, MenuItem, MenuRelation, MachineSet, TimeSlot)
+from pxelinux.schedule import timelines
+
+
+CONFIG_MODELS = (Item, Menu, MenuItem, MenuRelation, MachineSet, TimeSlot)
+
+
+def invalidate(model_name, pk=None, menu_id=None):
+    """
+    Drop the state derived from the object with the given pk of the model
+    (its model_name, e.g. 'menuitem'); menu_id is the menu of MenuItems.
+    Without model_name, drop everything.
+    """
+    if model_name is None:
+        invalidate_all()
+        return
+    if model_name == 'machineset':
+        # MachineSets or their IP-ranges changed.
+        ip_index.invalidate()
+    if model_name in ('host', 'machineset'):
+        host_index.invalidate()
+    if model_name in ('timeslot', 'machineset', 'menu'):
+        # TimeSlots (or the menus they refer to) changed.
+        timelines.invalidate()
+    if model_name == 'item':
+        menu_fragments.item_changed(pk)
+    elif model_name == 'menu':
+        menu_fragments.menu_changed(pk)
+    elif model_name == 'menuitem':
+        menu_fragments.menu_changed(menu_id)
+    elif model_name == 'menurelation':
+        menu_fragments.graph_changed()
+    if model_name != 'host':
+        # Anything that is part of a boot configuration changed.
+        rendered_configs.clear()
+
+
+def config_changed(sender, instance, **kwargs):
+    """
+    Invalidate the state derived from the changed object in this process and
+    let the others know about it once the change is committed.
+    """
+    if changes.batching():
+        return
+    model_name = sender._meta.model_name
+    menu_id = getattr(instance, 'menu_id', None)
+    invalidate(model_name, instance.pk, menu_id)
+    changes.changed(model_name, instance.pk, menu_id)
+
+
+# Connected per model, so deleting objects of other models (e.g. BootEvents)
+# needs no signals and takes a single query.
+for model in CONFIG_MODELS + (Host, ):
+    post_save.connect(config_changed, sender=model)
+    post_delete.connect(config_changed, sender=model)
+
+
+@receiver(m2m_changed, sender=Menu.items.through)
+@receiver(m2m_changed, sender=Menu.menus.through)
+@receiver(m2m_changed, sender=MachineSet.menus.through)
+def invalidate_links(sender, **kwargs):
+    """
+    Menus or machine sets were linked in bulk, render everything again.
+    """
+    if changes.batching():
+        return
+    menu_fragments.invalidate()
+    timelines.invalidate()
+    rendered_configs.clear()
+    changes.changed()
+
+
+def invalidate_all():
+    """
+    Drop all state derived from the database, e.g. after bulk queries (which
+    send no signals).
+    """
+    ip_index.invalidate()
+    host_index.invalidate()
+    timelines.invalidate()
+    menu_fragments.invalidate()
+    rendered_configs.clear()
@@ -0,0 +1,277 @@
+"""
+Compiled routing snapshot: everything needed to answer configuration requests
+(the IP-interval tables, the daily schedule of every machine set and the
+rendered configurations) in one binary file. Worker processes map it
+read-only, so they share its pages and answer requests without touching the
+database. New snapshots are written next to the file and switched in by an
+atomic rename.
+
+Layout (native byte order, sections padded to 8 bytes): the header, then the
+IPv4-table (start, end and machine set index as uint32-arrays), the
+IPv6-table (start and end as 16-byte big endian integers, machine set index
+as uint32), the first segment of each machine set (uint32, one more than
+machine sets), the segment boundaries (uint64 microseconds since midnight;
+every machine set ends with a day), the timeslot of each segment (int32, -1
+for none), the configuration of each timeslot (uint32), the offset of each
+configuration (uint64, one more than configurations) and the configurations
+(40 bytes ETag-digest, content type, newline, content).
+"""
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from django.conf import settings
+from pxelinux.cache import RenderedConfig, content_digest
+from pxelinux.ip import IntervalTable, address_to_long, lookup_rank
+from pxelinux.schedule import Timeline
+
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'PXESNAP1'
+# Magic, digest of everything after the header, creation time and the
+# numbers of IPv4-intervals, IPv6-intervals, machine sets, segments,
+# timeslots and configurations.
+HEADER = struct.Struct('=8s20sdIIIIII')
+
+
+def _pad(data):
+    return data + b'\0' * (-len(data) % 8)
+
+
+class _Wide(object):
+    """
+    Sequence of the 16-byte big endian integers in a memoryview.
+    """
+    def __init__(self, view):
+        self.view = view
+
+    def __len__(self):
+        return len(self.view) // 16
+
+    def __getitem__(self, i):
+        return int.from_bytes(self.view[i * 16:i * 16 + 16], 'big')
+
+
+class _Segments(object):
+    """
+    Timeslot-indexes of a machine set's segments, None for -1.
+    """
+    def __init__(self, view):
+        self.view = view
+
+    def __len__(self):
+        return len(self.view)
+
+    def __getitem__(self, i):
+        timeslot = self.view[i]
+        return None if timeslot < 0 else timeslot
+
+
+def build(index, timelines, render):
+    """
+    Return the snapshot (bytes) of the IPIndex index and the timelines (see
+    schedule.build_timelines), render(timeslot) returning the content and
+    content type of a timeslot's configuration.
+    """
+    ipv4_tables = (index.ipv4.starts, index.ipv4.ends, index.ipv4.ranks)
+    ipv6_tables = (index.ipv6.starts, index.ipv6.ends, index.ipv6.ranks)
+    first_segments = [0]
+    boundaries = []
+    segments = []
+    timeslots = {}
+    configs = {}
+    timeslot_configs = []
+    blobs = []
+    for machine_set in index.machine_sets:
+        timeline = timelines.get(machine_set.pk)
+        if timeline is not None:
+            for timeslot in timeline.timeslots:
+                if timeslot is not None and timeslot.pk not in timeslots:
+                    timeslots[timeslot.pk] = len(timeslots)
+                    content, content_type = render(timeslot)
+                    blob = content_digest(content, content_type).encode() + \
+                        content_type.encode() + b'\n' + content
+                    if blob not in configs:
+                        configs[blob] = len(blobs)
+                        blobs.append(blob)
+                    timeslot_configs.append(configs[blob])
+                segments.append(
+                    -1 if timeslot is None else timeslots[timeslot.pk])
+            boundaries.extend(timeline.boundaries)
+            segments.append(-1)
+        first_segments.append(len(boundaries))
+    offsets = [0]
+    for blob in blobs:
+        offsets.append(offsets[-1] + len(blob))
+    body = b''.join([
+        _pad(struct.pack('=%dI' % len(ipv4_tables[0]), *ipv4_tables[0])),
+        _pad(struct.pack('=%dI' % len(ipv4_tables[1]), *ipv4_tables[1])),
+        _pad(struct.pack('=%dI' % len(ipv4_tables[2]), *ipv4_tables[2])),
+        b''.join(start.to_bytes(16, 'big') for start in ipv6_tables[0]),
+        b''.join(end.to_bytes(16, 'big') for end in ipv6_tables[1]),
+        _pad(struct.pack('=%dI' % len(ipv6_tables[2]), *ipv6_tables[2])),
+        _pad(struct.pack('=%dI' % len(first_segments), *first_segments)),
+        _pad(struct.pack('=%dQ' % len(boundaries), *boundaries)),
+        _pad(struct.pack('=%di' % len(segments), *segments)),
+        _pad(struct.pack('=%dI' % len(timeslot_configs), *timeslot_configs)),
+        _pad(struct.pack('=%dQ' % len(offsets), *offsets)),
+    ] + blobs)
+    header = HEADER.pack(
+        MAGIC, hashlib.sha1(body).digest(), time.time(),
+        len(ipv4_tables[0]), len(ipv6_tables[0]), len(index.machine_sets),
+        len(boundaries), len(timeslot_configs), len(blobs))
+    return _pad(header) + body
+
+
+def build_from_database():
+    """
+    Return the snapshot (bytes) of the current boot configuration.
+    """
+    from pxelinux.fragments import menu_fragments
+    from pxelinux.index import IPIndex
+    from pxelinux.models import MachineSet
+    from pxelinux.schedule import build_timelines
+    from pxelinux.views import render_config
+
+    def render(timeslot):
+        response = render_config(timeslot)
+        return response.content, response['Content-Type']
+
+    # Changes made through other processes send no signals to this one.
+    menu_fragments.invalidate()
+    return build(IPIndex(MachineSet.objects.all()), build_timelines(), render)
+
+
+def write(path, data):
+    """
+    Atomically replace the snapshot at path with data unless they are equal
+    (apart from their creation time). Return whether the file was written.
+    """
+    try:
+        with open(path, 'rb') as current:
+            if current.read(HEADER.size)[:28] == data[:28]:
+                return False
+    except IOError:
+        pass
+    temporary = os.path.join(os.path.dirname(path) or '.', '.%s.%d.tmp' % (
+        os.path.basename(path), os.getpid()))
+    with open(temporary, 'wb') as output:
+        output.write(data)
+    os.replace(temporary, path)
+    return True
+
+
+class Snapshot(object):
+    """
+    A snapshot file mapped read-only into memory.
+    """
+    def __init__(self, path):
+        with open(path, 'rb') as snapshot_file:
+            self._mmap = mmap.mmap(
+                snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mmap)
+        header = HEADER.unpack_from(view)
+        if header[0] != MAGIC:
+            raise ValueError("Not a snapshot: %s" % path)
+        (self.digest, created, ipv4_count, ipv6_count, sets, segment_count,
+         timeslot_count, config_count) = header[1:]
+        self.created = int(created)
+        position = HEADER.size + (-HEADER.size % 8)
+
+        def take(count, format):
+            nonlocal position
+            size = count * struct.calcsize(format)
+            section = view[position:position + size]
+            position += size + (-size % 8)
+            return section.cast(format) if format != '16s' else _Wide(section)
+
+        self.ipv4 = IntervalTable.from_arrays(*(
+            take(ipv4_count, 'I') for i in range(3)))
+        self.ipv6 = IntervalTable.from_arrays(
+            take(ipv6_count, '16s'), take(ipv6_count, '16s'),
+            take(ipv6_count, 'I'))
+        self.first_segments = take(sets + 1, 'I')
+        self.boundaries = take(segment_count, 'Q')
+        self.segments = take(segment_count, 'i')
+        self.timeslot_configs = take(timeslot_count, 'I')
+        self.offsets = take(config_count + 1, 'Q')
+        self.blobs = view[position:]
+
+    def timeline(self, ip):
+        """
+        Return the Timeline (of timeslot-indexes) of the machine set
+        containing the given IP-address or None.
+        """
+        rank = lookup_rank(self.ipv4, self.ipv6, address_to_long(ip))
+        if rank is None:
+            return None
+        first, end = self.first_segments[rank], self.first_segments[rank + 1]
+        if first == end:
+            return None
+        return Timeline.from_arrays(
+            self.boundaries[first:end],
+            _Segments(self.segments[first:end - 1]))
+
+    def config(self, ip, now):
+        """
+        Return the RenderedConfig for the given IP-address at the datetime now
+        or None if no timeslot is active for it.
+        """
+        timeline = self.timeline(ip)
+        timeslot = timeline and timeline.active(now)
+        if timeslot is None:
+            return None
+        i = self.timeslot_configs[timeslot]
+        blob = self.blobs[self.offsets[i]:self.offsets[i + 1]]
+        content_type, content = bytes(blob[40:]).split(b'\n', 1)
+        return RenderedConfig(
+            content, content_type.decode(), timeline.next_change(now),
+            '"%s"' % bytes(blob[:40]).decode(), self.created)
+
+
+class SnapshotFile(object):
+    """
+    The snapshot at the path given by the PXELINUX_SNAPSHOT setting, mapped
+    again at most every second if the file was replaced.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._path = None
+        self._stat = None
+        self._checked = 0
+
+    def current(self):
+        """
+        Return the current Snapshot or None if there is none.
+        """
+        path = getattr(settings, 'PXELINUX_SNAPSHOT', None)
+        if path is None:
+            return None
+        if path == self._path and time.monotonic() - self._checked < 1:
+            return self._snapshot
+        with self._lock:
+            self._path = path
+            self._checked = time.monotonic()
+            try:
+                stat = os.stat(path)
+            except OSError:
+                self._snapshot = self._stat = None
+                return None
+            stat = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            if stat != self._stat:
+                # Replaced mappings are unmapped once no longer referenced.
+                try:
+                    self._snapshot = Snapshot(path)
+                except (OSError, ValueError, struct.error) as e:
+                    logger.error("Could not map snapshot %s: %s", path, e)
+                    self._snapshot = None
+                self._stat = stat
+            return self._snapshot
+
+
+snapshot_file = SnapshotFile()
@@ -0,0 +1,192 @@
+"""
+Boot-storm simulation: many clients following the PXELINUX fetch sequence
+(pxelinux.cfg/<UUID>, 01-<MAC>, the hexadecimal IP-address shortened digit
+by digit, default) at the same time, against this app in-process (Django
+test client) or a running server (HTTP).
+"""
+import http.client
+import queue
+import random
+import threading
+import time
+import uuid
+from urllib.parse import urlsplit
+from django.db import connection
+from django.test import Client
+from iptools.ipv4 import ip2long
+from pxelinux.benchmark import _QueryCounter, _percentile
+
+
+ARRIVALS = ('burst', 'ramp', 'boundary')
+
+
+def probe_paths(client_uuid, mac, ip):
+    """
+    Return the paths PXELINUX requests, in order, until one exists.
+    """
+    paths = ['pxelinux.cfg/%s' % client_uuid,
+             'pxelinux.cfg/01-%s' % mac.replace(':', '-')]
+    hex_ip = '%08X' % ip2long(ip)
+    paths.extend('pxelinux.cfg/%s' % hex_ip[:digits]
+                 for digits in range(8, 0, -1))
+    paths.append('pxelinux.cfg/default')
+    return paths
+
+
+def make_clients(addresses, seed=0):
+    """
+    Return (UUID, MAC, IPv4-address)-triples for the given addresses.
+    """
+    rng = random.Random(seed)
+    return [(str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+             ':'.join('%02x' % rng.randrange(256) for _ in range(6)), ip)
+            for ip in addresses]
+
+
+class _TestClientFetcher(object):
+    """
+    Fetches paths in-process with one Django test client and query counter
+    per thread.
+    """
+    def __init__(self):
+        self.local = threading.local()
+
+    def _thread(self):
+        if not hasattr(self.local, 'client'):
+            self.local.client = Client()
+            self.local.counter = _QueryCounter()
+            connection.execute_wrappers.append(self.local.counter)
+        return self.local
+
+    def __call__(self, path, ip):
+        return self._thread().client.get(
+            '/' + path, REMOTE_ADDR=ip).status_code
+
+    def queries(self):
+        return self._thread().counter.count
+
+
+class _HTTPFetcher(object):
+    """
+    Fetches paths from a running server, with one persistent connection per
+    thread, naming each client's address in an X-Real-IP header.
+    """
+    def __init__(self, url):
+        url = urlsplit(url)
+        self.host = url.netloc
+        self.prefix = url.path.rstrip('/')
+        self.local = threading.local()
+
+    def __call__(self, path, ip):
+        if not hasattr(self.local, 'connection'):
+            self.local.connection = http.client.HTTPConnection(self.host)
+        try:
+            self.local.connection.request(
+                'GET', '%s/%s' % (self.prefix, path),
+                headers={'X-Real-IP': ip})
+            response = self.local.connection.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException):
+            self.local.connection.close()
+            del self.local.connection
+            raise
+        return response.status
+
+    def queries(self):
+        return None
+
+
+def _boot(fetch, client):
+    """
+    Walk the fetch sequence of a client until a configuration is found.
+    Return a list of (status, seconds)-pairs, status None for exceptions.
+    """
+    requests = []
+    for path in probe_paths(*client):
+        start = time.perf_counter()
+        try:
+            status = fetch(path, client[2])
+        except Exception:
+            status = None
+        requests.append((status, time.perf_counter() - start))
+        if status == 200:
+            break
+    return requests
+
+
+def simulate(clients, arrival='burst', ramp=10.0, concurrency=50, url=None):
+    """
+    Boot the clients (see make_clients) with concurrency threads and return
+    throughput, latencies (ms), SQL-queries per boot (in-process only) and
+    error- and 404-rates as a JSON-serializable dictionary. Clients arrive
+    all at once (burst), evenly spread over ramp seconds (ramp) or all at
+    once right after the rendered configurations were dropped, like at a
+    timeslot boundary (boundary, in-process only).
+    """
+    from pxelinux.cache import rendered_configs
+    if arrival not in ARRIVALS:
+        raise ValueError("Unknown arrival: %s" % arrival)
+    fetch = _HTTPFetcher(url) if url else _TestClientFetcher()
+    pending = queue.Queue()
+    for i, client in enumerate(clients):
+        delay = ramp * i / len(clients) if arrival == 'ramp' else 0
+        pending.put((delay, client))
+    boots = []
+    lock = threading.Lock()
+    if arrival == 'boundary':
+        rendered_configs.clear()
+    start = time.perf_counter()
+
+    def work():
+        while True:
+            try:
+                delay, client = pending.get_nowait()
+            except queue.Empty:
+                break
+            wait = start + delay - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+            queries = fetch.queries()
+            boot_start = time.perf_counter()
+            requests = _boot(fetch, client)
+            boot = (requests, time.perf_counter() - boot_start,
+                    None if url else fetch.queries() - queries)
+            with lock:
+                boots.append(boot)
+        if not url:
+            connection.close()
+
+    threads = [threading.Thread(target=work)
+               for _ in range(min(concurrency, len(clients)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - start
+    requests = [request for boot in boots for request in boot[0]]
+    request_ms = [request_seconds * 1000 for status, request_seconds
+                  in requests]
+    boot_ms = [boot_seconds * 1000 for _, boot_seconds, _ in boots]
+    queries = [boot_queries for _, _, boot_queries in boots]
+    return {
+        'clients': len(clients),
+        'arrival': arrival,
+        'concurrency': len(threads),
+        'seconds': seconds,
+        'boots_per_second': len(boots) / seconds,
+        'requests_per_second': len(requests) / seconds,
+        'requests_per_boot': len(requests) / len(boots),
+        'boot_latency_ms': dict(
+            ('p%d' % percent, _percentile(boot_ms, percent))
+            for percent in (50, 99)),
+        'request_latency_ms': dict(
+            ('p%d' % percent, _percentile(request_ms, percent))
+            for percent in (50, 99)),
+        'queries_per_boot': None if url else sum(queries) / len(queries),
+        'failed_boots': sum(1 for boot in boots if boot[0][-1][0] != 200),
+        'not_found_rate': sum(
+            1 for status, _ in requests if status == 404) / len(requests),
+        'error_rate': sum(
+            1 for status, _ in requests
+            if status is None or status >= 500) / len(requests),
+    }
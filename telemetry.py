@@ -0,0 +1,171 @@
+"""
+Boot telemetry: which client got which machine set, timeslot and menu, and
+when. Requests only append the event to an in-memory buffer; a background
+thread resolves the buffered events against the compiled index and timelines
+and writes them with bulk queries every PXELINUX_BOOT_EVENTS seconds
+(default: None, recording disabled), together with the per-day boot counts of
+each machine set (BootCount). Events beyond PXELINUX_BOOT_EVENTS_BUFFER
+(default: 10000) waiting to be written are dropped and counted. BootEvents
+older than PXELINUX_BOOT_EVENTS_DAYS days (default: 30) are deleted, the
+counts are kept.
+"""
+import ipaddress
+import logging
+import threading
+import time
+from collections import Counter, deque
+from datetime import timedelta
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from pxelinux import metrics
+
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+
+
+class BootRecorder(object):
+    """
+    Buffers boot events and writes them from a background thread.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._events = deque()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pruned_at = None
+
+    def record(self, now, ip, machine_set_id=None, lookup_ip=None,
+               fallback=False):
+        """
+        Record that a configuration was served at the (local, naive) datetime
+        now for the IP-address ip, resolved by machine_set_id (if the client
+        was identified otherwise) or by lookup_ip (default: ip). An ip which
+        is no valid address (e.g. from a client's X-Real-IP header) is stored
+        as None, so it cannot fail the bulk insert of the whole batch.
+        """
+        interval = getattr(settings, 'PXELINUX_BOOT_EVENTS', None)
+        if interval is None:
+            return
+        if self._thread is None:
+            self.start(interval)
+        if len(self._events) >= getattr(
+                settings, 'PXELINUX_BOOT_EVENTS_BUFFER', 10000):
+            metrics.boot_events_dropped.inc()
+            return
+        lookup_ip = lookup_ip or ip
+        try:
+            ip = str(ipaddress.ip_address(ip))
+        except ValueError:
+            ip = None
+        self._events.append((now, ip, machine_set_id, lookup_ip, fallback))
+        if len(self._events) >= BATCH_SIZE:
+            self._wakeup.set()
+
+    def start(self, interval):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, args=(interval, ),
+                    name='pxelinux-telemetry', daemon=True)
+                self._thread.start()
+
+    def _run(self, interval):
+        while True:
+            self._wakeup.wait(interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+                if self._pruned_at is None or \
+                        time.monotonic() - self._pruned_at > 3600:
+                    self.prune()
+                    self._pruned_at = time.monotonic()
+            except Exception:
+                logger.exception("Writing boot events failed.")
+            finally:
+                close_old_connections()
+
+    def _take(self):
+        events = []
+        while True:
+            try:
+                events.append(self._events.popleft())
+            except IndexError:
+                return events
+
+    def flush(self):
+        """
+        Write the buffered events and update the boot counts. Return the
+        number of events written.
+        """
+        from pxelinux.index import ip_index
+        from pxelinux.models import (
+            BootCount, BootEvent, MachineSet, Menu, TimeSlot)
+        from pxelinux.schedule import timelines
+        with self._lock:
+            events = self._take()
+        if not events:
+            return 0
+        index = ip_index.get()
+        compiled_timelines = timelines.get()
+        resolved = []
+        for now, ip, machine_set_id, lookup_ip, fallback in events:
+            if machine_set_id is None:
+                machine_set = index.lookup(lookup_ip)
+                machine_set_id = machine_set and machine_set.pk
+            timeline = compiled_timelines.get(machine_set_id)
+            timeslot = timeline and timeline.active(now)
+            resolved.append((now, ip, machine_set_id, timeslot, fallback))
+        # Objects deleted meanwhile are not referenced.
+        machine_set_ids = set(MachineSet.objects.filter(pk__in=set(
+            event[2] for event in resolved)).values_list('pk', flat=True))
+        timeslot_ids = set(TimeSlot.objects.filter(pk__in=set(
+            event[3].pk for event in resolved if event[3])).values_list(
+            'pk', flat=True))
+        menu_ids = set(Menu.objects.filter(pk__in=set(
+            event[3].menu_id for event in resolved if event[3])).values_list(
+            'pk', flat=True))
+        rows = []
+        counts = Counter()
+        for now, ip, machine_set_id, timeslot, fallback in resolved:
+            if machine_set_id not in machine_set_ids:
+                machine_set_id = None
+            else:
+                counts[(machine_set_id, now.date())] += 1
+            rows.append(BootEvent(
+                time=timezone.make_aware(now) if settings.USE_TZ else now,
+                ip=ip, machine_set_id=machine_set_id,
+                timeslot_id=timeslot.pk if timeslot and
+                timeslot.pk in timeslot_ids else None,
+                menu_id=timeslot.menu_id if timeslot and
+                timeslot.menu_id in menu_ids else None,
+                fallback=fallback))
+        try:
+            with transaction.atomic():
+                BootEvent.objects.bulk_create(rows, batch_size=BATCH_SIZE)
+                for (machine_set_id, date), count in sorted(counts.items()):
+                    if not BootCount.objects.filter(
+                            machine_set_id=machine_set_id, date=date).update(
+                            count=F('count') + count):
+                        BootCount.objects.create(
+                            machine_set_id=machine_set_id, date=date,
+                            count=count)
+        except Exception:
+            metrics.boot_events_dropped.inc(len(rows))
+            raise
+        return len(rows)
+
+    def prune(self):
+        """
+        Delete the BootEvents older than PXELINUX_BOOT_EVENTS_DAYS days.
+        """
+        from pxelinux.models import BootEvent
+        days = getattr(settings, 'PXELINUX_BOOT_EVENTS_DAYS', 30)
+        return BootEvent.objects.filter(
+            time__lt=timezone.now() - timedelta(days=days)).delete()[0]
+
+
+boot_recorder = BootRecorder()
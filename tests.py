@@ -5,7 +5,7 @@ when you run "manage.py test".
 Replace this with more appropriate tests for your application.
 """
 
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase
 
 
 class SimpleTest(TestCase):
@@ -14,3 +14,965 @@ class SimpleTest(TestCase):
         Tests that 1 + 1 always equals 2.
         """
         self.assertEqual(1 + 1, 2)
+
+
+class PxelinuxDataMixin(object):
+    """
+    Provides a small boot configuration: one item in one menu, served all day
+    to the machine set 'lab' (10.0.0.0/24).
+    """
+    def setUp(self):
+        from django.contrib.auth.models import User
+        from pxelinux.models import Item, Menu, MenuItem, MachineSet, TimeSlot
+        self.user = User.objects.create(username='admin', is_superuser=True)
+        self.item = Item.objects.create(
+            menu_label='Linux', kernel='vmlinuz', label='linux')
+        self.menu = Menu.objects.create(
+            title='Main', label='main', owner=self.user)
+        MenuItem.objects.create(menu=self.menu, item=self.item, priority=1)
+        self.machine_set = MachineSet.objects.create(
+            name='lab', ip_ranges="'10.0.0.0/24'", owner=self.user)
+        self.timeslot = TimeSlot.objects.create(
+            machine_set=self.machine_set, menu=self.menu, ui='text')
+
+
+class PxelinuxTestCase(PxelinuxDataMixin, TestCase):
+    pass
+
+
+class IPIndexTest(TestCase):
+    def lookup(self, ranges, ip):
+        from pxelinux.index import IPIndex
+        from pxelinux.ip import IPRanges
+
+        class FakeMachineSet(object):
+            def __init__(self, name, ip_ranges):
+                self.name = name
+                self.ip_ranges = IPRanges(ip_ranges, True) if ip_ranges else ''
+
+        machine_sets = [FakeMachineSet(i, r) for i, r in enumerate(ranges)]
+        machine_set = IPIndex(machine_sets).lookup(ip)
+        return None if machine_set is None else machine_set.name
+
+    def test_first_matching_set_wins(self):
+        ranges = ["'10.0.0.10'", "'10/8', '192.168/16'", "'10.0.0.0/24'"]
+        self.assertEqual(self.lookup(ranges, '10.0.0.10'), 0)
+        self.assertEqual(self.lookup(ranges, '10.0.0.11'), 1)
+        self.assertEqual(self.lookup(ranges, '192.168.3.4'), 1)
+        self.assertEqual(self.lookup(ranges, '11.0.0.1'), None)
+        self.assertEqual(self.lookup(['', "'10.0.0.0/24'"], '10.0.0.1'), 1)
+
+    def test_ipv6(self):
+        ranges = ["'fe80::/10'", "'::ffff:0:0/96'", "('10.0.0.1', '10.0.0.9')"]
+        self.assertEqual(self.lookup(ranges, 'fe80::1'), 0)
+        self.assertEqual(self.lookup(ranges, '::ffff:10.0.0.5'), 1)
+        self.assertEqual(self.lookup(ranges[2:], '::ffff:10.0.0.5'), 0)
+        self.assertEqual(self.lookup(ranges, '2001:db8::1'), None)
+
+    def test_agrees_with_iptools(self):
+        import random
+        from pxelinux.ip import IPRanges
+        rng = random.Random(0)
+        ranges = []
+        for _ in range(50):
+            start = rng.randrange(0, 1 << 16)
+            end = start + rng.randrange(0, 1 << 12)
+            ranges.append("('10.%d.%d.0', '10.%d.%d.0')" % (
+                start >> 8, start & 255, end >> 8 & 255, end & 255))
+        parsed = [IPRanges(r, True) for r in ranges]
+        for _ in range(500):
+            number = rng.randrange(0, 1 << 16)
+            ip = '10.%d.%d.0' % (number >> 8, number & 255)
+            expected = next(
+                (i for i, r in enumerate(parsed) if ip in r), None)
+            self.assertEqual(self.lookup(ranges, ip), expected)
+
+    def test_segments_agree_with_lookup(self):
+        from pxelinux.index import IPIndex, address_to_long
+        from pxelinux.ip import IPRanges
+        from iptools import ipv6
+
+        class FakeMachineSet(object):
+            def __init__(self, ip_ranges):
+                self.ip_ranges = IPRanges(ip_ranges, True)
+
+        index = IPIndex([FakeMachineSet(r) for r in [
+            "'10.0.0.8/29'", "('::ffff:10.0.0.0', '::ffff:10.0.0.15')",
+                "'::/64'"]])
+        start = address_to_long('::ffff:9.255.255.250')
+        segments = list(index.segments(start, start + 40))
+        for first, last, machine_set in segments:
+            for number in range(first, last + 1):
+                self.assertIs(
+                    index.lookup(ipv6.long2ip(number)), machine_set)
+        self.assertEqual([(s[0] - start, s[1] - start) for s in segments],
+                         [(0, 5), (6, 13), (14, 21), (22, 40)])
+
+
+class IPRangesTest(TestCase):
+    def test_contains_agrees_with_iptools(self):
+        from iptools import IpRangeList
+        from pxelinux.ip import IPRanges
+        value = "'10/8', ('192.168.0.5', '192.168.1.7'), '::ffff:0:0/96', " \
+                "'fe80::/10', '10.1/16'"
+        ranges = IPRanges(value, True)
+        reference = IpRangeList('10/8', ('192.168.0.5', '192.168.1.7'),
+                                '::ffff:0:0/96', 'fe80::/10', '10.1/16')
+        for ip in ['10.2.3.4', '11.0.0.0', '192.168.0.4', '192.168.1.7',
+                   '::ffff:1.2.3.4', 'fe80::1', '::1', '2001:db8::']:
+            self.assertEqual(ip in ranges, ip in reference, ip)
+        self.assertEqual(str(ranges), value)
+        self.assertEqual(
+            ranges, IPRanges(value.replace("'10/8'", "'10.0.0.0/8'"), False))
+        self.assertEqual(len(ranges.ipv4), 2)
+
+    def test_parsed_once(self):
+        from pxelinux.models import MachineSet
+        from django.contrib.auth.models import User
+        user = User.objects.create(username='user')
+        MachineSet.objects.create(
+            name='a', ip_ranges="'10.0.0.0/24'", owner=user)
+        MachineSet.objects.create(
+            name='b', ip_ranges="'10.0.0.0/24'", owner=user)
+        a, b = MachineSet.objects.order_by('name')
+        self.assertIs(a.ip_ranges, b.ip_ranges)
+
+
+class GenerateConfigTest(PxelinuxTestCase):
+    def test_config_for_ip(self):
+        response = self.client.get('/pxelinux.cfg/0A000005')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'label linux', response.content)
+
+    def test_fallback(self):
+        from pxelinux.models import MachineSet, TimeSlot
+        self.assertEqual(self.client.get('/10.1.0.5').status_code, 404)
+        fallback = MachineSet.objects.create(
+            name='fallback', ip_ranges="'255.255.255.255'", owner=self.user)
+        TimeSlot.objects.create(
+            machine_set=fallback, menu=self.menu, ui='none')
+        response = self.client.get('/10.1.0.5')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content.startswith(b'DEFAULT linux'))
+
+    def test_probes(self):
+        config = self.client.get('/10.0.0.5').content
+        for probe in ('b8945908-d6a6-41a9-611d-74a6ab80b83d',
+                      '01-88-99-aa-bb-cc-dd', '0A00000', '0A'):
+            response = self.client.get(
+                '/pxelinux.cfg/' + probe, REMOTE_ADDR='10.0.0.5')
+            self.assertEqual(response.content, config, probe)
+        with self.assertNumQueries(0):
+            response = self.client.get(
+                '/pxelinux.cfg/C0A8', REMOTE_ADDR='10.0.0.5')
+        self.assertEqual(response.status_code, 404)
+
+    def test_hosts(self):
+        from django.core.exceptions import ValidationError
+        from pxelinux.models import Host, MachineSet, TimeSlot
+        special = MachineSet.objects.create(name='special', owner=self.user)
+        TimeSlot.objects.create(machine_set=special, menu=self.menu, ui='none')
+        Host.objects.create(mac='88-99-AA-BB-CC-DD', machine_set=special)
+        with self.assertRaises(ValidationError):
+            Host(mac='8899aabbccdd', machine_set=special).full_clean()
+        response = self.client.get(
+            '/pxelinux.cfg/01-88-99-aa-bb-cc-dd', REMOTE_ADDR='10.0.0.5')
+        self.assertEqual(response.content.splitlines()[0], b'DEFAULT linux')
+        response = self.client.get(
+            '/pxelinux.cfg/b8945908-d6a6-41a9-611d-74a6ab80b83d',
+            REMOTE_ADDR='10.0.0.5')
+        self.assertIn(b'menu title Main', response.content)
+        self.assertEqual(self.client.get('/set/special').content.splitlines()[
+            0], b'DEFAULT linux')
+        self.assertEqual(self.client.get('/set/unknown').status_code, 404)
+
+    def test_conditional_get(self):
+        from django.utils.cache import get_max_age
+        response = self.client.get('/10.0.0.5')
+        self.assertIn('public', response['Cache-Control'])
+        self.assertLessEqual(get_max_age(response), 60)
+        # The content of these URLs depends on the client.
+        for path in ('/pxelinux.cfg/default', '/pxelinux.cfg/0A00'):
+            self.assertIn('private', self.client.get(
+                path, REMOTE_ADDR='10.0.0.5')['Cache-Control'])
+        self.assertTrue(response.has_header('Last-Modified'))
+        response = self.client.get(
+            '/10.0.0.6', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+
+class RenderCacheTest(PxelinuxTestCase):
+    def test_cached_until_change(self):
+        response = self.client.get('/10.0.0.5')
+        # Served from the cache without touching the database.
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                self.client.get('/10.0.0.6').content, response.content)
+        self.item.append = 'quiet'
+        self.item.save()
+        self.assertIn(b'append quiet', self.client.get('/10.0.0.5').content)
+
+
+class SingleFlightTest(TestCase):
+    def test_concurrent_calls_coalesce(self):
+        import threading
+        from pxelinux import metrics
+        from pxelinux.cache import SingleFlight
+        flight = SingleFlight('test')
+        release = threading.Event()
+        calls = []
+        results = []
+
+        def render():
+            calls.append(1)
+            release.wait(5)
+            return 'config'
+
+        threads = [threading.Thread(
+            target=lambda: results.append(flight.do('key', render)))
+            for i in range(5)]
+        for thread in threads:
+            thread.start()
+        while metrics.coalesced.value(flight='test') < 4:
+            release.wait(0.001)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(calls, [1])
+        self.assertEqual(results, ['config'] * 5)
+        self.assertEqual(flight.do('key', lambda: 'new'), 'new')
+
+
+class TimelineTest(TestCase):
+    def test_active_and_next_change(self):
+        from datetime import datetime, time
+        from pxelinux.models import TimeSlot
+        from pxelinux.schedule import Timeline
+        day = TimeSlot(pk=1, time_start=time(0), priority=50)
+        morning = TimeSlot(pk=2, time_start=time(8), time_end=time(12),
+                           priority=10)
+        late = TimeSlot(pk=3, time_start=time(10), time_end=time(18),
+                        priority=20)
+        timeline = Timeline([late, day, morning])
+        at = lambda *args: datetime(2020, 1, 1, *args)
+        self.assertIs(timeline.active(at(7)), day)
+        self.assertEqual(timeline.next_change(at(7)), at(8))
+        self.assertIs(timeline.active(at(11)), morning)
+        self.assertEqual(timeline.next_change(at(11)), at(12, 0, 0, 1))
+        self.assertIs(timeline.active(at(12, 30)), late)
+        self.assertEqual(timeline.next_change(at(12, 30)), at(18, 0, 0, 1))
+        self.assertIs(timeline.active(at(23, 59, 59, 500)), None)
+        self.assertEqual(
+            timeline.next_change(at(23, 59, 59, 500)), datetime(2020, 1, 2))
+        self.assertEqual(Timeline([day]).next_change(at(23, 59, 59, 500)),
+                         datetime(2020, 1, 2))
+        self.assertEqual(Timeline([late]).next_change(at(19)),
+                         datetime(2020, 1, 2, 10))
+
+
+class MenuGraphTest(PxelinuxTestCase):
+    def test_nested_menus(self):
+        from pxelinux.models import Menu, MenuRelation
+        tools = Menu.objects.create(
+            title='Tools', label='tools', password='pw', owner=self.user)
+        deep = Menu.objects.create(title='Deep', label='deep', owner=self.user)
+        MenuRelation.objects.create(
+            sub_menu=self.menu, super_menu=tools, priority=1)
+        MenuRelation.objects.create(sub_menu=tools, super_menu=deep, priority=1)
+        MenuRelation.objects.create(
+            sub_menu=deep, super_menu=self.menu, priority=1)
+        MenuRelation.objects.create(sub_menu=deep, super_menu=tools, priority=2)
+        with self.assertNumQueries(2):
+            config = self.menu.pxelinux_representation()
+        self.assertEqual(config, "\n".join([
+            '', 'menu title Main', self.item.pxelinux_representation(),
+            'menu begin tools', 'menu passwd pw', '', 'menu title Tools',
+            'menu begin deep', '', 'menu title Deep',
+            'label main', 'menu goto .top', 'menu label Main',
+            'label tools', 'menu goto tools', 'menu label Tools',
+            'menu end', 'menu end']))
+
+    def test_fragments(self):
+        from pxelinux.fragments import menu_fragments
+        from pxelinux.models import Item, Menu, MenuItem, MenuRelation
+        tools = Menu.objects.create(title='Tools', label='tools',
+                                    background_image='http://x/bg.png',
+                                    owner=self.user)
+        MenuRelation.objects.create(
+            sub_menu=self.menu, super_menu=tools, priority=1)
+        memtest = Item.objects.create(
+            menu_label='Memtest', kernel='memtest', label='memtest')
+        MenuItem.objects.create(menu=tools, item=memtest, priority=1)
+        self.assertEqual(menu_fragments.pxelinux_representation(self.menu.pk),
+                         self.menu.pxelinux_representation())
+        memtest.append = 'quiet'
+        memtest.save()
+        # Only the changed item is loaded again.
+        with self.assertNumQueries(1):
+            config = menu_fragments.pxelinux_representation(self.menu.pk)
+        self.assertIn('append quiet', config)
+        self.assertEqual(config, self.menu.pxelinux_representation())
+
+    def test_menu_template(self):
+        from django.template import loader
+        from pxelinux.views import render_menu_template
+        context = {'menu_binary': 'menu.c32', 'menu_body': 'append a="b"'}
+        self.assertEqual(render_menu_template(context),
+                         loader.get_template('menu.cfg').render(context))
+
+
+class ExportTest(PxelinuxTestCase):
+    def test_hex_prefixes(self):
+        from pxelinux.export import hex_prefixes
+        self.assertEqual(list(hex_prefixes(0x0A000000, 0x0A0000FF)),
+                         ['0A0000'])
+        self.assertEqual(list(hex_prefixes(0x0A00000F, 0x0A000020)),
+                         ['0A00000F', '0A00001', '0A000020'])
+
+    def test_export(self):
+        import os
+        import shutil
+        import tempfile
+        from datetime import datetime
+        from io import StringIO
+        from django.core.management import call_command
+        from pxelinux.export import Exporter
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        exporter = Exporter(directory)
+        self.assertEqual(exporter.export(datetime.now())[:2], (2, 0))
+        with open(os.path.join(directory, 'pxelinux.cfg/0A0000'), 'rb') as f:
+            self.assertEqual(
+                f.read(), self.client.get('/10.0.0.1').content)
+        self.assertTrue(os.path.exists(os.path.join(directory, 'set/lab')))
+        # Unchanged configurations are neither loaded nor rendered again.
+        with self.assertNumQueries(0):
+            self.assertEqual(exporter.export(datetime.now())[:2], (0, 0))
+        self.machine_set.ip_ranges = "'10.0.0.0/25'"
+        self.machine_set.save()
+        self.assertEqual(
+            Exporter(directory).export(datetime.now())[:2], (9, 1))
+        self.assertFalse(
+            os.path.exists(os.path.join(directory, 'pxelinux.cfg/0A0000')))
+        output = StringIO()
+        call_command('export_pxelinux_cfg', directory, verbosity=2,
+                     stdout=output)
+        self.assertIn('removed 0 files', output.getvalue())
+
+    def test_machine_set_files(self):
+        from datetime import datetime
+        from pxelinux.export import Exporter
+        from pxelinux.models import MachineSet, TimeSlot
+        unranged = MachineSet.objects.create(name='unranged', owner=self.user)
+        TimeSlot.objects.create(
+            machine_set=unranged, menu=self.menu, ui='none')
+        files = Exporter('unused').files(datetime.now())[0]
+        for name in ('lab', 'unranged'):
+            self.assertEqual(files['set/' + name],
+                             self.client.get('/set/' + name).content)
+
+
+class OverlapTest(PxelinuxTestCase):
+    def test_analyze(self):
+        from pxelinux.models import MachineSet
+        from pxelinux.overlaps import analyze, format_range
+        wide = MachineSet.objects.create(
+            name='wide', ip_ranges="'10.0.0.0/16'", owner=self.user)
+        mapped = MachineSet.objects.create(
+            name='mapped', owner=self.user,
+            ip_ranges="('::ffff:10.0.0.250', '::ffff:10.0.1.5')")
+        report = analyze(MachineSet.objects.order_by('pk'))
+        self.assertEqual(
+            [(format_range(overlap.start, overlap.end),
+              [str(machine_set) for machine_set in overlap.machine_sets])
+             for overlap in report.overlaps],
+            [('10.0.0.0-10.0.0.255', ['lab', 'wide']),
+             ('::ffff:a00:fa-::ffff:a00:ff', ['lab', 'wide', 'mapped']),
+             ('::ffff:a00:100-::ffff:a00:105', ['wide', 'mapped'])])
+        self.assertEqual(
+            [(str(machine_set), len(ranges))
+             for machine_set, ranges in report.unreachable],
+            [('wide', 2), ('mapped', 1)])
+        self.assertEqual(report.shadowed, [mapped])
+        self.assertFalse(analyze(MachineSet.objects.filter(pk=wide.pk)))
+        from django.core.management import CommandError, call_command
+        from io import StringIO
+        output = StringIO()
+        with self.assertRaises(CommandError):
+            call_command('check_pxelinux_cfg', stdout=output)
+        self.assertIn('shadowed: mapped', output.getvalue())
+
+    def test_admin_rejects_overlaps(self):
+        from pxelinux.admin import MachineSetForm
+        data = {'name': 'other', 'owner': self.user.pk}
+        form = MachineSetForm(dict(data, ip_ranges="'10.0.0.128/25'"))
+        self.assertFalse(form.is_valid())
+        self.assertIn('lab', form.errors['ip_ranges'][0])
+        form = MachineSetForm(dict(data, ip_ranges="'10.0.1.0/24'"))
+        self.assertTrue(form.is_valid(), form.errors)
+        form = MachineSetForm(dict(data, ip_ranges="'10.0.0.0/24'"),
+                              instance=self.machine_set)
+        self.assertTrue(form.is_valid(), form.errors)
+
+
+class SnapshotTest(PxelinuxTestCase):
+    def test_snapshot(self):
+        import os
+        import tempfile
+        from django.test import override_settings
+        from pxelinux import snapshot
+        from pxelinux.models import MachineSet, TimeSlot
+        v6 = MachineSet.objects.create(
+            name='v6', ip_ranges="'fd00::/64'", owner=self.user)
+        TimeSlot.objects.create(machine_set=v6, menu=self.menu, ui='none')
+        expected = [self.client.get(path).content
+                    for path in ('/10.0.0.5', '/fd00::1')]
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'snapshot')
+        self.assertTrue(snapshot.write(path, snapshot.build_from_database()))
+        self.assertFalse(snapshot.write(path, snapshot.build_from_database()))
+        with override_settings(PXELINUX_SNAPSHOT=path):
+            with self.assertNumQueries(0):
+                self.assertEqual([self.client.get(path).content
+                                  for path in ('/10.0.0.5', '/fd00::1')],
+                                 expected)
+                response = self.client.get('/10.1.0.5')
+        self.assertEqual(response.status_code, 404)
+        os.remove(path)
+        os.rmdir(directory)
+
+
+class BulkTest(PxelinuxTestCase):
+    def test_round_trip(self):
+        import json
+        import yaml
+        from pxelinux.bulk import dump_json, dump_yaml, export_data, import_data
+        from pxelinux.models import MachineSet, TimeSlot
+        data = json.loads(''.join(dump_json(export_data())))
+        self.assertEqual(yaml.safe_load(''.join(dump_yaml(export_data()))),
+                         data)
+        self.assertEqual(data['machine_sets'][0]['timeslots'][0]['menu'],
+                         'main')
+        self.assertEqual(str(import_data(data)), "\n".join([
+            'item: 0 created, 0 updated, 0 deleted',
+            'machineset: 0 created, 0 updated, 0 deleted',
+            'menu: 0 created, 0 updated, 0 deleted',
+            'menuitem: 0 created, 0 updated, 0 deleted',
+            'menurelation: 0 created, 0 updated, 0 deleted',
+            'timeslot: 0 created, 0 updated, 0 deleted']))
+        data['items'][0]['append'] = 'quiet'
+        data['machine_sets'].append({
+            'name': 'other', 'owner': 'admin', 'ip_ranges': "'10.0.1.0/24'",
+            'timeslots': [{'menu': 'main', 'time_start': 28800,
+                           'ui': 'text'}]})
+        import_data(data, dry_run=True)
+        self.assertFalse(MachineSet.objects.filter(name='other').exists())
+        result = import_data(data)
+        self.assertEqual(result.counts['item'], [0, 1, 0])
+        self.assertEqual(result.counts['timeslot'], [1, 0, 0])
+        self.assertEqual(
+            TimeSlot.objects.get(machine_set__name='other').time_start.hour, 8)
+        self.assertIn(b'append quiet', self.client.get('/10.0.0.5').content)
+        with self.assertRaises(ValueError):
+            import_data({'menus': [{'label': 'x', 'owner': 'nobody'}]})
+        # Objects are validated like in the admin.
+        with self.assertRaisesRegex(ValueError, 'slug'):
+            import_data({'items': [{'label': 'not a slug'}]})
+        data['machine_sets'][1]['timeslots'][0]['ui'] = 'gui'
+        with self.assertRaisesRegex(ValueError, "'gui'"):
+            import_data(data)
+        # Children are only replaced if their list is given.
+        result = import_data({'machine_sets': [
+            {'name': 'other', 'owner': 'admin', 'ip_ranges': ''}]})
+        self.assertEqual(result.counts['machineset'], [0, 1, 0])
+        self.assertEqual(result.counts['timeslot'], [0, 0, 0])
+        self.assertTrue(
+            TimeSlot.objects.filter(machine_set__name='other').exists())
+
+
+class ResolveTest(PxelinuxTestCase):
+    def test_resolve(self):
+        from django.core.management import call_command
+        from io import StringIO
+        self.timeslot.time_end = '11:59:59'
+        self.timeslot.save()
+        output = StringIO()
+        call_command('resolve_pxelinux_cfg', '10.0.0.128/24', '10.0.1.0/31',
+                     time=['08:00', '12:00'], stdout=output)
+        self.assertEqual(output.getvalue().splitlines(), [
+            'first_ip,last_ip,time,machine_set,timeslot,menu',
+            '10.0.0.0,10.0.0.255,08:00:00,lab,00:00:00-11:59:59,main',
+            '10.0.0.0,10.0.0.255,12:00:00,,,',
+            '10.0.1.0,10.0.1.1,08:00:00,,,',
+            '10.0.1.0,10.0.1.1,12:00:00,,,',
+        ])
+
+    def test_view_requires_staff(self):
+        response = self.client.get('/resolve', {'ip': '10.0.0.1'})
+        self.assertEqual(response.status_code, 302)
+        self.user.is_staff = True
+        self.user.save()
+        self.client.force_login(self.user)
+        response = self.client.get(
+            '/resolve', {'ip': '10.0.0.1', 'time': '08:00'})
+        self.assertEqual(b''.join(response.streaming_content).splitlines()[1],
+                         b'10.0.0.1,10.0.0.1,08:00:00,lab,00:00:00-23:59:59,'
+                         b'main')
+        response = self.client.get('/resolve', {'ip': 'x'})
+        self.assertEqual(response.status_code, 400)
+
+
+class BenchmarkTest(TestCase):
+    def test_run(self):
+        from pxelinux import benchmark
+        results = benchmark.run(machine_sets=5, menus=4, requests=10)
+        self.assertEqual(len(results['results']), 8)
+        for result in results['results'].values():
+            self.assertEqual(result['not_found'], 0)
+        self.assertEqual(
+            results['results']['generate_config_ipv4/warm']['queries_max'], 0)
+
+
+class StormTest(PxelinuxDataMixin, TransactionTestCase):
+    def test_simulate(self):
+        from pxelinux import storm
+        self.assertEqual(
+            storm.probe_paths('u', '00:11:22:33:44:55', '10.0.0.1')[1:4],
+            ['pxelinux.cfg/01-00-11-22-33-44-55', 'pxelinux.cfg/0A000001',
+             'pxelinux.cfg/0A00000'])
+        clients = storm.make_clients(['10.0.0.%d' % i for i in range(1, 9)])
+        results = storm.simulate(clients, 'boundary', concurrency=4)
+        self.assertEqual(results['requests_per_boot'], 1)
+        self.assertEqual(results['failed_boots'], 0)
+        self.assertEqual(results['error_rate'], 0)
+        results = storm.simulate(storm.make_clients(['10.1.0.1']))
+        self.assertEqual(results['requests_per_boot'], 11)
+        self.assertEqual(results['failed_boots'], 1)
+        self.assertEqual(results['not_found_rate'], 1)
+
+    def test_http_fetcher(self):
+        import threading
+        from http.server import BaseHTTPRequestHandler, HTTPServer
+        from pxelinux import storm
+        seen = []
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                seen.append((self.path, self.headers['X-Real-IP']))
+                self.send_response(404)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer(('127.0.0.1', 0), Handler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            fetch = storm._HTTPFetcher(
+                'http://127.0.0.1:%d/boot/' % server.server_address[1])
+            self.assertEqual(fetch('pxelinux.cfg/default', '10.0.0.9'), 404)
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+        self.assertEqual(seen, [('/boot/pxelinux.cfg/default', '10.0.0.9')])
+
+
+class TFTPTest(PxelinuxDataMixin, TransactionTestCase):
+    def fetch(self, port, filename, options=b''):
+        """
+        Read filename with a minimal blocking TFTP client. Return the
+        option acknowledgement (or None) and the content, or the error.
+        """
+        import socket
+        import struct
+        client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        client.settimeout(5)
+        client.sendto(b'\0\1%s\0octet\0%s' % (filename, options),
+                      ('127.0.0.1', port))
+        oack = None
+        content = b''
+        blksize = 512
+        while True:
+            packet, addr = client.recvfrom(70000)
+            opcode, block = struct.unpack('!HH', packet[:4])
+            if opcode == 5:
+                client.close()
+                return block, packet[4:-1]
+            if opcode == 6:
+                oack = packet[2:]
+                blksize = int(dict(zip(*[iter(oack.split(b'\0'))] * 2))
+                              .get(b'blksize', 512))
+                client.sendto(b'\0\4\0\0', addr)
+                continue
+            content += packet[4:]
+            client.sendto(b'\0\4' + packet[2:4], addr)
+            if len(packet) - 4 < blksize:
+                client.close()
+                return oack, content
+
+    def test_server(self):
+        import asyncio
+        from pxelinux import tftp
+
+        async def run():
+            transport, server = await tftp.serve('127.0.0.1', 0)
+            port = transport.get_extra_info('sockname')[1]
+            loop = asyncio.get_running_loop()
+            try:
+                return await asyncio.gather(*(
+                    loop.run_in_executor(None, self.fetch, port, *request)
+                    for request in [
+                        (b'pxelinux.cfg/7F', b'blksize\x0016\0tsize\x000\0'),
+                        (b'/pxelinux.cfg/default', ),
+                        (b'pxelinux.cfg/0A', ),
+                        (b'ldlinux.c32', )]))
+            finally:
+                transport.close()
+
+        self.machine_set.ip_ranges = "'10.0.0.0/24', '127.0.0.0/8'"
+        self.machine_set.save()
+        results = asyncio.run(run())
+        self.assertIn(b'label linux', results[0][1])
+        self.assertEqual(results[0][0], b'blksize\x0016\0tsize\0%d\0' % (
+            len(results[0][1]), ))
+        self.assertEqual(results[1], (None, results[0][1]))
+        self.assertEqual(results[2][0], tftp.FILE_NOT_FOUND)
+        self.assertEqual(results[3][0], tftp.ACCESS_VIOLATION)
+
+    def test_proxy_paths(self):
+        import asyncio
+        from pxelinux import tftp
+        server = tftp.TFTPServer('127.0.0.1', 'http://127.0.0.1:9/tftpboot')
+        for filename in ('../secret', 'boot/../../secret', '..\\secret',
+                         'pxelinux.cfg/../admin/'):
+            with self.assertRaises(tftp._Aborted) as aborted:
+                asyncio.run(server.open(filename, '10.0.0.5', 'octet'))
+            self.assertEqual(aborted.exception.args[0],
+                             tftp.ACCESS_VIOLATION)
+
+
+class ChangesTest(PxelinuxDataMixin, TransactionTestCase):
+    def test_generation(self):
+        from django.db.models import F
+        from django.test import override_settings
+        from pxelinux import changes
+        from pxelinux.index import ip_index
+        from pxelinux.models import ConfigGeneration
+        watcher = changes.ChangeWatcher()
+        self.assertTrue(watcher.poll())
+        self.assertFalse(watcher.poll())
+        messages = []
+        changes.LocalBus._subscribers.append(messages.append)
+        try:
+            with override_settings(
+                    PXELINUX_CHANGE_BUS='pxelinux.changes.LocalBus'):
+                self.item.save()
+        finally:
+            changes.LocalBus._subscribers.remove(messages.append)
+        self.assertEqual(messages[0]['model'], 'item')
+        self.assertEqual(messages[0]['generation'], watcher.generation + 1)
+        # The same change made on another node.
+        self.client.get('/10.0.0.1')
+        watcher.receive(dict(messages[0], origin='other', model='machineset'))
+        self.assertIsNone(ip_index.peek())
+        self.assertFalse(watcher.poll())
+        # Missed messages are caught up with by polling.
+        self.client.get('/10.0.0.1')
+        ConfigGeneration.objects.update(generation=F('generation') + 1)
+        self.assertTrue(watcher.poll())
+        self.assertIsNone(ip_index.peek())
+
+    def test_one_bump_per_transaction(self):
+        import json
+        from django.db import connection, transaction
+        from django.test.utils import CaptureQueriesContext
+        from pxelinux import changes
+        from pxelinux.bulk import dump_json, export_data, import_data
+        from pxelinux.index import ip_index
+        generation = changes.current_generation()
+        with transaction.atomic():
+            self.item.save()
+            self.menu.save()
+            self.item.save()
+        self.assertEqual(changes.current_generation(), generation + 1)
+        # State cached again before the commit is dropped once it lands.
+        with transaction.atomic():
+            self.machine_set.save()
+            self.client.get('/10.0.0.1')
+            self.assertIsNotNone(ip_index.peek())
+        self.assertIsNone(ip_index.peek())
+        generation += 1
+        # Deleting the replaced children sends signals, but no bumps.
+        data = json.loads(''.join(dump_json(export_data())))
+        data['menus'][0]['items'] = []
+        with CaptureQueriesContext(connection) as queries:
+            import_data(data)
+        self.assertEqual(len([query for query in queries.captured_queries
+                              if 'configgeneration' in query['sql']]), 2)
+        self.assertEqual(changes.current_generation(), generation + 2)
+
+
+class TelemetryTest(PxelinuxDataMixin, TransactionTestCase):
+    def test_recorder(self):
+        from datetime import date
+        from django.test import override_settings
+        from pxelinux import metrics
+        from pxelinux.models import BootCount, BootEvent, MachineSet, TimeSlot
+        from pxelinux.telemetry import boot_recorder
+        fallback = MachineSet.objects.create(
+            name='fallback', ip_ranges="'255.255.255.255'", owner=self.user)
+        timeslot = TimeSlot.objects.create(
+            machine_set=fallback, menu=self.menu, ui='none')
+        with override_settings(PXELINUX_BOOT_EVENTS=3600):
+            self.client.get('/10.0.0.1')
+            self.client.get('/set/lab', REMOTE_ADDR='10.9.0.1')
+            self.client.get('/10.1.0.1')
+            # Served by the fallback, but not a valid address.
+            self.client.get('/299.0.0.1')
+            self.assertEqual(BootEvent.objects.count(), 0)
+            self.assertEqual(boot_recorder.flush(), 4)
+            dropped = metrics.boot_events_dropped.value()
+            with override_settings(PXELINUX_BOOT_EVENTS_BUFFER=0):
+                self.client.get('/10.0.0.1')
+            self.assertEqual(metrics.boot_events_dropped.value(), dropped + 1)
+        self.assertCountEqual(
+            BootEvent.objects.values_list(
+                'ip', 'machine_set', 'timeslot', 'menu', 'fallback'),
+            [(ip, self.machine_set.pk, self.timeslot.pk, self.menu.pk, False)
+             for ip in ('10.0.0.1', '10.9.0.1')] +
+            [(ip, fallback.pk, timeslot.pk, self.menu.pk, True)
+             for ip in ('10.1.0.1', None)])
+        self.assertEqual(BootCount.objects.get(
+            machine_set=self.machine_set, date=date.today()).count, 2)
+
+
+class ProfilingTest(PxelinuxTestCase):
+    def test_profiled_requests(self):
+        import json
+        import os
+        import tempfile
+        from django.test import override_settings
+        from pxelinux import profiling
+        from pxelinux.fragments import menu_fragments
+        token = profiling.make_token()
+        with tempfile.TemporaryDirectory() as directory, override_settings(
+                PXELINUX_PROFILE_DIR=directory, PXELINUX_PROFILE_KEEP=1):
+            self.client.get('/10.0.0.1', HTTP_X_PXELINUX_PROFILE='forged')
+            self.assertEqual(os.listdir(directory), [])
+            for i in range(2):
+                self.client.get(
+                    '/10.0.0.%d' % (i + 1), HTTP_X_PXELINUX_PROFILE=token)
+            names = sorted(os.listdir(directory))
+            self.assertEqual(len(names), 2)
+            self.assertTrue(names[0].endswith('-generate_config-lab-main.json'))
+            with open(os.path.join(directory, names[0])) as info:
+                info = json.load(info)
+            self.assertEqual(info['tags'], {'machine_set': 'lab',
+                                            'menu': 'main'})
+            self.assertIsInstance(info['queries'], list)
+        # Menus rendered outside of requests (e.g. for snapshots).
+        with tempfile.TemporaryDirectory() as directory, override_settings(
+                PXELINUX_PROFILE_DIR=directory, PXELINUX_PROFILE_SAMPLE=1):
+            menu_fragments.pxelinux_representation(self.menu.pk)
+            self.assertEqual(
+                [name[-15:] for name in sorted(os.listdir(directory))],
+                ['-menu-main.json', '-menu-main.prof'])
+
+
+class WarmUpTest(PxelinuxDataMixin, TransactionTestCase):
+    def test_warm_up(self):
+        from pxelinux import metrics, warmup
+        with self.assertLogs('pxelinux.warmup', 'INFO') as logs:
+            warmup.warm_up()
+        self.assertIn('render: ', logs.output[0])
+        self.assertGreater(metrics.startup_seconds.value(phase='render'), 0)
+        with self.assertNumQueries(0):
+            response = self.client.get('/10.0.0.1')
+        self.assertEqual(response.status_code, 200)
+
+    def test_serving(self):
+        from unittest import mock
+        from django.test import override_settings
+        from pxelinux import warmup
+        with mock.patch('pxelinux.warmup.start') as start, \
+                mock.patch('pxelinux.warmup._started', False):
+            warmup.serving()
+            self.assertFalse(start.called)
+            with override_settings(PXELINUX_WARM_UP=True):
+                warmup.serving()
+                warmup.serving()
+        self.assertEqual(start.call_count, 1)
+
+
+class LastGoodTest(PxelinuxDataMixin, TransactionTestCase):
+    def test_stale_configs(self):
+        import os
+        import tempfile
+        import threading
+        from unittest import mock
+        from django.db import OperationalError
+        from django.test import override_settings
+        from pxelinux import metrics
+        from pxelinux.cache import rendered_configs
+        from pxelinux.signals import invalidate_all
+        released = threading.Event()
+
+        def slow(ip, now):
+            released.wait()
+
+        with tempfile.TemporaryDirectory() as directory, override_settings(
+                PXELINUX_LAST_GOOD_DIR=directory, PXELINUX_DB_DEADLINE=.05):
+            # The queries run in the thread pool still count for the request.
+            with override_settings(PXELINUX_SLOW_REQUEST_MS=0), \
+                    self.assertLogs('pxelinux.metrics', 'WARNING') as logs:
+                fresh = self.client.get('/10.0.0.1')
+            self.assertRegex(logs.output[0], r' [1-9]\d* queries')
+            self.assertEqual(sorted(os.listdir(directory)), [
+                'config-%d-%d' % (self.machine_set.pk, self.timeslot.pk),
+                'routes.json'])
+            # Resolved in memory, then with the routes on disk.
+            for reason, find_config, clear in (
+                    ('timeout', slow, rendered_configs.clear),
+                    ('error', mock.Mock(side_effect=OperationalError),
+                     invalidate_all)):
+                clear()
+                stale = metrics.stale_responses.value(reason=reason)
+                with mock.patch('pxelinux.views._find_config', find_config):
+                    response = self.client.get('/10.0.0.1')
+                self.assertEqual(response.content, fresh.content)
+                self.assertEqual(response['ETag'], fresh['ETag'])
+                self.assertEqual(response['Warning'],
+                                 '110 - "Response is Stale"')
+                self.assertIn('max-age=0', response['Cache-Control'])
+                self.assertIn('Age', response)
+                self.assertEqual(metrics.stale_responses.value(reason=reason),
+                                 stale + 1)
+            released.set()
+            empty = os.path.join(directory, 'empty')
+            with override_settings(PXELINUX_LAST_GOOD_DIR=empty), mock.patch(
+                    'pxelinux.views._find_config',
+                    side_effect=OperationalError):
+                invalidate_all()
+                self.assertEqual(self.client.get('/10.0.0.1').status_code, 503)
+            self.assertNotIn('Warning', self.client.get('/10.0.0.1'))
+        self.assertIn('pxelinux_stale_responses_total{reason="timeout"}',
+                      metrics.render())
+
+    def test_queueing(self):
+        import threading
+        import time
+        from concurrent.futures import ThreadPoolExecutor
+        from django.test import override_settings
+        from pxelinux.lastgood import LastGood, Unavailable
+        last_good = LastGood()
+        with override_settings(PXELINUX_LAST_GOOD_THREADS=1,
+                               PXELINUX_DB_DEADLINE=.2):
+            # Waiting for the thread does not count against the deadline.
+            with ThreadPoolExecutor(3) as executor:
+                self.assertEqual(list(executor.map(
+                    lambda i: last_good.run(time.sleep, .1), range(3))),
+                    [None] * 3)
+            released = threading.Event()
+            with self.assertRaises(Unavailable):
+                last_good.run(released.wait)
+            # Unless the thread is stuck past it.
+            with self.assertRaisesRegex(Unavailable, 'busy'):
+                last_good.run(time.sleep, 0)
+            released.set()
+
+    def test_profiled(self):
+        import json
+        import os
+        import tempfile
+        from django.test import override_settings
+        with tempfile.TemporaryDirectory() as directory, override_settings(
+                PXELINUX_LAST_GOOD_DIR=os.path.join(directory, 'last-good'),
+                PXELINUX_PROFILE_DIR=directory, PXELINUX_PROFILE_SAMPLE=1):
+            self.client.get('/10.0.0.1')
+            name, = [name for name in os.listdir(directory)
+                     if name.endswith('.json')]
+            with open(os.path.join(directory, name)) as info:
+                self.assertTrue(json.load(info)['queries'])
+
+
+class MetricsTest(PxelinuxTestCase):
+    def test_metrics(self):
+        from django.test import override_settings
+        from pxelinux import metrics
+        ok = metrics.requests.value(result='ok')
+        not_found = metrics.requests.value(result='not_found')
+        with override_settings(PXELINUX_SLOW_REQUEST_MS=0):
+            with self.assertLogs('pxelinux.metrics', 'WARNING') as logs:
+                self.client.get('/10.0.0.1')
+        self.assertIn('Slow request for 10.0.0.1 (ok)', logs.output[0])
+        self.assertIn('render', logs.output[0])
+        self.client.get('/10.9.9.9')
+        self.assertEqual(metrics.requests.value(result='ok'), ok + 1)
+        self.assertEqual(
+            metrics.requests.value(result='not_found'), not_found + 1)
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'# TYPE pxelinux_phase_seconds histogram',
+                      response.content)
+        self.assertIn(b'pxelinux_phase_seconds_bucket{phase="menu",'
+                      b'le="+Inf"}', response.content)
+        self.assertIn(b'pxelinux_phase_seconds_bucket{phase="menu_walk",'
+                      b'le="+Inf"}', response.content)
+        self.assertIn(b'pxelinux_fallbacks_total ', response.content)
+
+
+class ASGITest(PxelinuxDataMixin, TransactionTestCase):
+    def request(self, path, headers=()):
+        import asyncio
+        from pxelinux.asgi import application
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b''}
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {'type': 'http', 'method': 'GET', 'path': path,
+                 'query_string': b'', 'headers': list(headers),
+                 'client': ('10.0.0.7', 1234)}
+        asyncio.run(application(scope, receive, send))
+        return messages[0]['status'], messages[1]['body']
+
+    def test_application(self):
+        from django.test import override_settings
+        status, body = self.request('/pxelinux.cfg/0A000005')
+        self.assertEqual(status, 200)
+        self.assertIn(b'label linux', body)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.request('/10.0.0.6'), (200, body))
+            self.assertEqual(self.request('/default'), (200, body))
+        self.assertEqual(self.request('/10.1.0.1')[0], 404)
+        # Behind a trusted proxy, the client is the one named by X-Real-IP.
+        real_ip = [(b'x-real-ip', b'10.1.0.1')]
+        self.assertEqual(self.request('/default', real_ip), (200, body))
+        with override_settings(PXELINUX_TRUST_X_REAL_IP=True):
+            self.assertEqual(self.request('/default', real_ip)[0], 404)
+        self.assertEqual(self.request('/nothing-here')[0], 404)
+        self.assertEqual(self.request('/set/lab')[0], 200)
+
+    def test_snapshot(self):
+        import os
+        import tempfile
+        from django.test import override_settings
+        from pxelinux import snapshot
+        body = self.request('/10.0.0.5')[1]
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'snapshot')
+        snapshot.write(path, snapshot.build_from_database())
+        with override_settings(PXELINUX_SNAPSHOT=path):
+            with self.assertNumQueries(0):
+                self.assertEqual(self.request('/10.0.0.6'), (200, body))
+                # Misses are passed to the thread pool.
+                self.assertEqual(self.request('/10.1.0.1')[0], 404)
+        os.remove(path)
+        os.rmdir(directory)
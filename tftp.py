@@ -0,0 +1,269 @@
+"""
+Asynchronous TFTP server (RFC 1350 with the option extension, blksize, tsize
+and timeout of RFCs 2347-2349) for PXELINUX clients that fetch their
+configuration over TFTP. Reads of pxelinux.cfg/* are answered with the
+configuration views (see urls.py) for the client's address, everything else
+is fetched from an HTTP server (proxy) or denied. Every transfer runs on its
+own UDP port as a task of one event loop, so a single process serves many
+clients at once.
+"""
+import asyncio
+import io
+import logging
+import struct
+import urllib.error
+import urllib.parse
+import urllib.request
+
+
+logger = logging.getLogger(__name__)
+
+RRQ, WRQ, DATA, ACK, ERROR, OACK = range(1, 7)
+# Error codes.
+NOT_DEFINED, FILE_NOT_FOUND, ACCESS_VIOLATION = 0, 1, 2
+ILLEGAL_OPERATION, OPTION_REFUSED = 4, 8
+DEFAULT_BLKSIZE = 512
+MAX_BLKSIZE = 65464
+CONFIG_PREFIX = 'pxelinux.cfg/'
+
+
+class _Aborted(Exception):
+    pass
+
+
+def error_packet(code, message):
+    return struct.pack('!HH', ERROR, code) + message.encode() + b'\0'
+
+
+def parse_request(packet):
+    """
+    Return (filename, mode, options) of a read or write request, options
+    being a dictionary with lowercase names. Raise ValueError if malformed.
+    """
+    fields = packet[2:].split(b'\0')
+    if len(fields) < 3 or fields[-1] != b'' or not len(fields) % 2:
+        raise ValueError("Malformed request.")
+    fields = [field.decode('ascii', 'replace') for field in fields[:-1]]
+    options = {name.lower(): value
+               for name, value in zip(fields[2::2], fields[3::2])}
+    return fields[0], fields[1].lower(), options
+
+
+def negotiate(options, size):
+    """
+    Return the dictionary of the requested options the server accepts, with
+    their values as strings. size is the size of the file or None.
+    """
+    accepted = {}
+    try:
+        if 'blksize' in options and int(options['blksize']) >= 8:
+            accepted['blksize'] = str(min(int(options['blksize']),
+                                          MAX_BLKSIZE))
+        if 'timeout' in options and 1 <= int(options['timeout']) <= 255:
+            accepted['timeout'] = str(int(options['timeout']))
+    except ValueError:
+        pass
+    if 'tsize' in options and size is not None:
+        accepted['tsize'] = str(size)
+    return accepted
+
+
+class _BytesSource(object):
+    def __init__(self, data):
+        self.size = len(data)
+        self.data = io.BytesIO(data)
+
+    async def read(self, size):
+        return self.data.read(size)
+
+    def close(self):
+        pass
+
+
+class _HTTPSource(object):
+    """
+    File streamed from a response of the proxied HTTP server.
+    """
+    def __init__(self, response):
+        self.response = response
+        length = response.headers.get('Content-Length')
+        self.size = int(length) if length and length.isdigit() else None
+
+    def _read(self, size):
+        chunks = []
+        while size > 0:
+            chunk = self.response.read(size)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            size -= len(chunk)
+        return b''.join(chunks)
+
+    async def read(self, size):
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self._read, size)
+
+    def close(self):
+        self.response.close()
+
+
+class _TransferProtocol(asyncio.DatagramProtocol):
+    def __init__(self):
+        self.packets = asyncio.Queue()
+
+    def datagram_received(self, data, addr):
+        self.packets.put_nowait(data)
+
+
+class TFTPServer(asyncio.DatagramProtocol):
+    """
+    Protocol of the listening socket. Starts a transfer task per read
+    request; clients retransmitting their request while it runs are ignored.
+    """
+    def __init__(self, host, proxy=None, timeout=1.0, retries=5):
+        self.host = host
+        self.proxy = proxy
+        self.timeout = timeout
+        self.retries = retries
+        self.transport = None
+        self.transfers = {}
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        opcode = struct.unpack('!H', data[:2])[0] if len(data) >= 2 else None
+        if opcode == WRQ:
+            self.transport.sendto(
+                error_packet(ACCESS_VIOLATION, "Read only."), addr)
+        elif opcode != RRQ:
+            self.transport.sendto(
+                error_packet(ILLEGAL_OPERATION, "Illegal operation."), addr)
+        elif addr not in self.transfers:
+            try:
+                request = parse_request(data)
+            except ValueError as e:
+                self.transport.sendto(
+                    error_packet(ILLEGAL_OPERATION, str(e)), addr)
+                return
+            self.transfers[addr] = asyncio.ensure_future(
+                self.transfer(addr, *request))
+            self.transfers[addr].add_done_callback(
+                lambda task: self.transfers.pop(addr, None))
+
+    async def open(self, filename, ip, mode):
+        """
+        Return the source of the requested file for the client with the
+        given IP-address, or raise _Aborted with the error to send.
+        """
+        from pxelinux import asgi
+        filename = filename.lstrip('/')
+        if '..' in filename.replace('\\', '/').split('/'):
+            raise _Aborted(ACCESS_VIOLATION, "Access violation.")
+        if filename.startswith(CONFIG_PREFIX):
+            request = asgi.build_request({
+                'method': 'GET', 'path': '/' + filename, 'client': (ip, 0)})
+            response = await asgi.respond(request)
+            if response.status_code != 200:
+                raise _Aborted(FILE_NOT_FOUND, "File not found.")
+            content = response.content
+            if mode == 'netascii':
+                content = content.replace(b'\r', b'\r\0') \
+                    .replace(b'\n', b'\r\n')
+            return _BytesSource(content)
+        if self.proxy is None:
+            raise _Aborted(ACCESS_VIOLATION, "Access violation.")
+        # Files are looked up below the proxy URL, never next to or above it.
+        base = self.proxy if self.proxy.endswith('/') else self.proxy + '/'
+        url = urllib.parse.urljoin(base, urllib.parse.quote(filename))
+        if not url.startswith(base):
+            raise _Aborted(ACCESS_VIOLATION, "Access violation.")
+        try:
+            response = await asyncio.get_running_loop().run_in_executor(
+                None, urllib.request.urlopen, url)
+        except urllib.error.HTTPError as e:
+            if e.code == 404:
+                raise _Aborted(FILE_NOT_FOUND, "File not found.")
+            raise _Aborted(NOT_DEFINED, "Proxy: %s" % e)
+        except (OSError, ValueError) as e:
+            raise _Aborted(NOT_DEFINED, "Proxy: %s" % e)
+        return _HTTPSource(response)
+
+    async def send(self, transport, protocol, packet, block, timeout):
+        """
+        Send packet until the client acknowledges block, raising _Aborted if
+        it sends an error or does not answer after all retries.
+        """
+        loop = asyncio.get_running_loop()
+        for attempt in range(self.retries + 1):
+            transport.sendto(packet)
+            deadline = loop.time() + timeout
+            while True:
+                try:
+                    data = await asyncio.wait_for(
+                        protocol.packets.get(), deadline - loop.time())
+                except asyncio.TimeoutError:
+                    break
+                opcode = struct.unpack('!H', data[:2])[0] \
+                    if len(data) >= 4 else None
+                if opcode == ERROR:
+                    raise _Aborted(None, "Aborted by client.")
+                # Duplicate acknowledgements are ignored (not answered with
+                # retransmissions, see RFC 1123 4.2.3.1).
+                if opcode == ACK and struct.unpack('!H', data[2:4])[0] == \
+                        block:
+                    return
+        raise _Aborted(None, "Timed out.")
+
+    async def transfer(self, addr, filename, mode, options):
+        """
+        Send the file to the client at addr on a new port.
+        """
+        loop = asyncio.get_running_loop()
+        transport, protocol = await loop.create_datagram_endpoint(
+            _TransferProtocol, local_addr=(self.host, 0), remote_addr=addr)
+        source = None
+        try:
+            if mode not in ('octet', 'netascii'):
+                raise _Aborted(ILLEGAL_OPERATION, "Unsupported mode.")
+            source = await self.open(filename, addr[0], mode)
+            accepted = negotiate(options, source.size)
+            blksize = int(accepted.get('blksize', DEFAULT_BLKSIZE))
+            timeout = int(accepted.get('timeout', 0)) or self.timeout
+            if accepted:
+                await self.send(transport, protocol, struct.pack(
+                    '!H', OACK) + b''.join(
+                    b'%s\0%s\0' % (name.encode(), value.encode())
+                    for name, value in accepted.items()), 0, timeout)
+            block = 1
+            while True:
+                data = await source.read(blksize)
+                await self.send(
+                    transport, protocol,
+                    struct.pack('!HH', DATA, block) + data, block, timeout)
+                if len(data) < blksize:
+                    break
+                block = (block + 1) % 65536
+            logger.info("Sent %s to %s.", filename, addr[0])
+        except _Aborted as e:
+            code, message = e.args
+            if code is not None:
+                transport.sendto(error_packet(code, message))
+            logger.info("Did not send %s to %s: %s", filename, addr[0],
+                        message)
+        except Exception:
+            logger.exception("Sending %s to %s failed.", filename, addr[0])
+            transport.sendto(error_packet(NOT_DEFINED, "Internal error."))
+        finally:
+            if source is not None:
+                source.close()
+            transport.close()
+
+
+async def serve(host='0.0.0.0', port=69, proxy=None, timeout=1.0, retries=5):
+    """
+    Start a TFTPServer on host and port and return (transport, server).
+    """
+    return await asyncio.get_running_loop().create_datagram_endpoint(
+        lambda: TFTPServer(host, proxy, timeout, retries),
+        local_addr=(host, port))
@@ -1,33 +1,86 @@
+import csv
 import logging
+import re
 from datetime import datetime
+from functools import lru_cache
+from time import time
+from itertools import chain
 from django.conf import settings
-from django.http import HttpResponse, Http404
-from django.shortcuts import render_to_response
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import (
+    HttpResponse, HttpResponseBadRequest, Http404, StreamingHttpResponse)
+from django.template import loader
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.html import escape
+from django.utils.http import http_date
+from iptools import ipv4
 from iptools.ipv4 import hex2ip as ip4_hex_to_grouped_decimal
-from pxelinux.models import MachineSet
+from pxelinux import changes, metrics, profiling
+from pxelinux.cache import RenderedConfig, render_flight, rendered_configs
+from pxelinux.fragments import menu_fragments
+from pxelinux.index import host_index, ip_index
+from pxelinux.lastgood import Unavailable, last_good
+from pxelinux.resolve import COLUMNS, parse_network, parse_time, resolve
+from pxelinux.schedule import timelines
+from pxelinux.snapshot import snapshot_file
+from pxelinux.telemetry import boot_recorder
 
 
 logger = logging.getLogger(__name__)
 
+FALLBACK_IP = '255.255.255.255'
+
+
+def _compiled(state):
+    """
+    Return the current value of the CompiledState. If the database does not
+    answer in time for rebuilding it (see lastgood.py), return the last one
+    built or None.
+    """
+    value = state.peek()
+    if value is not None:
+        return value
+    if last_good.directory() is None:
+        return state.get()
+    try:
+        return last_good.run(state.get)
+    except Unavailable:
+        return state.stale()
+
 
 def generate_config_from_machine_set_name(request, machine_set_name):
     """
     Get the name of a machine-set and generate the corresponding configuration.
     """
-    machine_set = MachineSet.objects.get(name=machine_set_name)
-    ip = machine_set.ip_ranges.ips[0][0]
-    return generate_config(request, ip)
+    index = _compiled(ip_index)
+    machine_set = index and index.by_name.get(machine_set_name)
+    if machine_set is None:
+        metrics.requests.inc(result='not_found')
+        raise Http404
+    return generate_config_for_machine_set(request, machine_set)
 
 
-def generate_config_from_x_real_ip(request):
+def client_ip(request):
     """
-    Get the IP-address from the HTTP-Header and generate the corresponding
-    configuration. Uses REMOTE_ADDR if X-Real-IP is not set.
+    Return the value of the X-Real-IP-header or REMOTE_ADDR if it is not set.
+    The header arrives as X-Real-IP from uwsgi_param. As HTTP_X_REAL_IP
+    (proxy_pass, ASGI) any client could send it, so it is only used if
+    PXELINUX_TRUST_X_REAL_IP is set.
     """
     ip = request.META.get('X-Real-IP')
+    if ip is None and getattr(settings, 'PXELINUX_TRUST_X_REAL_IP', False):
+        ip = request.META.get('HTTP_X_REAL_IP')
     if ip is None:
         ip = request.META.get('REMOTE_ADDR')
-    return generate_config(request, ip)
+    return ip
+
+
+def generate_config_from_x_real_ip(request):
+    """
+    Get the IP-address from the HTTP-Header and generate the corresponding
+    configuration. Uses REMOTE_ADDR if X-Real-IP is not set.
+    """
+    return generate_config(request, client_ip(request), private=True)
 
 
 def generate_config_from_hex(request, hex_str):
@@ -38,49 +91,349 @@ def generate_config_from_hex(request, hex_str):
     return generate_config(request, ip4_hex_to_grouped_decimal(hex_str))
 
 
-def generate_config(request, ip):
+def probe_ip(request, probe):
     """
-    Generates a PXELINUX configuration from the menu object in the active
-    timeslot with  the highest rating in the machine set for the given
-    IP-address or if that fails for the fallback-address '255.255.255.255'.
+    Return the IP-address of the client whose configuration answers the
+    PXELINUX-probe (UUID, 01-MAC or hexadecimal IP-prefix) or None if the
+    probe can never match it: a hexadecimal prefix has to be one of the
+    client's IPv4-address.
     """
+    ip = client_ip(request)
+    if ip is None or '-' in probe:
+        return ip
+    ip_long = ipv4.ip2long(ip)
+    if ip_long is None or not ('%08X' % ip_long).startswith(probe):
+        return None
+    return ip
 
-    now = datetime.now().time()
-    fallback_ip = '255.255.255.255'
-    timeslots = []
-
-    # Get the right TimeSlot.
-    for machines in MachineSet.objects.all():
-        if ip in machines.ip_ranges:
-            timeslots = machines.timeslot_set.filter(
-                time_start__lte=now,
-                time_end__gte=now)
-            break
 
-    # Fall back to fallback_ip if none was found or raise Http404 if that
-    # already failed.
-    if not (ip == fallback_ip or len(timeslots)):
-        logger.error('No timeslot for %s at %s. Trying %s instead.'
-                     % (ip, now, fallback_ip))
-        return generate_config(request, fallback_ip)
-    elif len(timeslots):
-        timeslot = timeslots[0]
-    else:
-        logger.error('No timeslot for %s at %s. Giving up!' % (ip, now))
+def generate_config_from_probe(request, probe):
+    """
+    Answer any probe of PXELINUX (pxelinux.cfg/<UUID>, 01-<MAC>, shortened
+    hexadecimal IP-address) with the final configuration for the client, so
+    it does not have to walk down the whole sequence. UUIDs and MACs of Hosts
+    resolve to their machine set before the IP-ranges are tried. Probes which
+    can never match are rejected without touching the database.
+    """
+    if '-' in probe:
+        index = _compiled(host_index)
+        machine_set = index and index.lookup(probe)
+        if machine_set is not None:
+            return generate_config_for_machine_set(
+                request, machine_set, private=True)
+    ip = probe_ip(request, probe)
+    if ip is None:
+        metrics.requests.inc(result='rejected')
         raise Http404
+    return generate_config(request, ip, private=True)
+
+
+def _resolve(ip, now):
+    """
+    Return the machine set containing the given IP-address, its timeline and
+    the timeslot in it active at now (or None for those not found).
+    """
+    with metrics.phase('resolve'):
+        machine_set = ip_index.get().lookup(ip)
+    if machine_set is None:
+        return None, None, None
+    return (machine_set, ) + _resolve_timeslot(machine_set, now)
+
+
+def _resolve_timeslot(machine_set, now):
+    """
+    Return the timeline of the machine set and the timeslot in it active at
+    now (or None for those not found).
+    """
+    with metrics.phase('timeslot'):
+        timeline = timelines.get().get(machine_set.pk)
+        if timeline is None:
+            return None, None
+        return timeline, timeline.active(now)
+
+
+@lru_cache(maxsize=None)
+def menu_template():
+    """
+    Render the menu.cfg-template once with markers in place of its variables.
+    Return the pieces of the result split at the markers (static text
+    alternating with variable names) and whether the template escapes
+    variables.
+    """
+    rendered = loader.get_template('menu.cfg').render(
+        {name: '\x00&%s\x00' % name for name in ('menu_binary', 'menu_body')})
+    return re.split(r'\x00&(?:amp;)?(\w+)\x00', rendered), '&amp;' in rendered
+
+
+def render_menu_template(context):
+    """
+    Equivalent of rendering the menu.cfg-template with context, by joining its
+    precompiled pieces.
+    """
+    pieces, autoescape = menu_template()
+    output = []
+    for i, piece in enumerate(pieces):
+        if i % 2:
+            piece = escape(context[piece]) if autoescape else context[piece]
+        output.append(piece)
+    return ''.join(output)
 
-    # Generate the configuration.
-    menu = timeslot.menu
+
+def render_config(timeslot):
+    """
+    Generates the PXELINUX configuration for the given timeslot.
+    """
+    menu_id = timeslot.menu_id
     if timeslot.ui != 'none':
+        with metrics.phase('menu'):
+            menu_body = menu_fragments.pxelinux_representation(menu_id)
         context = {
             'menu_binary': settings.STATIC_URL + (
                 'menu.c32' if timeslot.ui == 'text' else 'vesamenu.c32'),
-            'menu_body': "timeout %s\n%s" % (
-                timeslot.timeout, menu.pxelinux_representation())
+            'menu_body': "timeout %s\n%s" % (timeslot.timeout, menu_body)
         }
-        return render_to_response("menu.cfg", context)
+        with metrics.phase('template'):
+            return HttpResponse(render_menu_template(context))
+    else:
+        with metrics.phase('menu'):
+            label, item = menu_fragments.default_item(menu_id)
+        return HttpResponse("DEFAULT %s\n%s" % (label, item))
+
+
+def generate_config(request, ip, private=False):
+    """
+    Generates a PXELINUX configuration from the menu object in the active
+    timeslot with  the highest rating in the machine set for the given
+    IP-address or if that fails for the fallback-address '255.255.255.255'.
+    If the URL does not name the client (private), shared caches must not
+    store the response.
+    """
+    with metrics.RequestTracker(ip), \
+            profiling.profiled('generate_config', request):
+        return _generate_config(request, ip, private=private)
+
+
+def generate_config_for_machine_set(request, machine_set, private=False):
+    """
+    Generates the PXELINUX configuration of the active timeslot of the given
+    machine set or if there is none for the fallback-address.
+    """
+    with metrics.RequestTracker(machine_set.name), \
+            profiling.profiled('generate_config', request):
+        return _generate_config(request, None, machine_set, private)
+
+
+def _generate_config(request, ip, machine_set=None, private=False):
+    changes.watcher.start()
+    now = datetime.now()
+    requested_ip = client_ip(request) if ip is None else ip
+    snapshot = snapshot_file.current()
+    if snapshot is not None:
+        result = _find(snapshot.config, ip, machine_set, now)
+    elif last_good.directory() is None or (
+            machine_set is None and cached_config(ip, now) is not None):
+        result = _find(_find_config, ip, machine_set, now)
+    else:
+        try:
+            result = last_good.run(_find, _find_config, ip, machine_set, now)
+        except Unavailable as e:
+            return _stale_response(request, requested_ip, ip, machine_set,
+                                   now, private, e.args[0])
+    config, ip, machine_set, fallback = result
+    if config is None:
+        raise Http404
+    boot_recorder.record(now, requested_ip, machine_set and machine_set.pk,
+                         ip, fallback)
+    return config_response(request, config, now, private)
+
+
+def _find(find_config, ip, machine_set, now):
+    """
+    Get the configuration of the right TimeSlot with find_config(ip, now) or
+    for the machine set if given. Fall back to FALLBACK_IP if none was found.
+    Return the configuration (None if that failed too), the IP-address and
+    machine set it was found for and whether that is the fallback.
+    """
+    if machine_set is None:
+        config = find_config(ip, now)
+    else:
+        # Hosts and names are not part of snapshots.
+        config = _find_machine_set_config(machine_set, now)
+    fallback = False
+    if not (ip == FALLBACK_IP or config is not None):
+        logger.error('No timeslot for %s at %s. Trying %s instead.'
+                     % (machine_set or ip, now.time(), FALLBACK_IP))
+        metrics.fallbacks.inc()
+        ip = FALLBACK_IP
+        machine_set = None
+        fallback = True
+        config = find_config(ip, now)
+    if config is None:
+        logger.error('No timeslot for %s at %s. Giving up!'
+                     % (ip, now.time()))
+    return config, ip, machine_set, fallback
+
+
+def _stale_response(request, requested_ip, ip, machine_set, now, private,
+                    reason):
+    """
+    Answer with the last known good configuration as the database did not
+    (see lastgood.py), or 503 Service Unavailable if there is none.
+    """
+    config = last_good.find(
+        ip, machine_set and machine_set.pk, now, FALLBACK_IP)
+    if config is None:
+        logger.error('Database unavailable (%s), no last known good '
+                     'configuration for %s.' % (reason, machine_set or ip))
+        metrics.stale_responses.inc(reason='none')
+        return HttpResponse(status=503)
+    logger.warning('Database unavailable (%s), serving the last known good '
+                   'configuration for %s.' % (reason, machine_set or ip))
+    metrics.stale_responses.inc(reason=reason)
+    boot_recorder.record(now, requested_ip, machine_set and machine_set.pk, ip)
+    response = config_response(request, config, now, private)
+    response['Age'] = max(int(time() - config.last_modified), 0)
+    response['Warning'] = '110 - "Response is Stale"'
+    patch_cache_control(response, max_age=0)
+    return response
+
+
+def _find_config(ip, now):
+    """
+    Return the RenderedConfig for the given IP-address at now or None if no
+    timeslot is active for it.
+    """
+    machine_set, timeline, timeslot = _resolve(ip, now)
+    if timeslot is None:
+        return None
+    return _cached_config(machine_set, timeline, timeslot, now)
+
+
+def _find_machine_set_config(machine_set, now):
+    """
+    Return the RenderedConfig of the given machine set at now or None if no
+    timeslot is active in it.
+    """
+    timeline, timeslot = _resolve_timeslot(machine_set, now)
+    if timeslot is None:
+        return None
+    return _cached_config(machine_set, timeline, timeslot, now)
+
+
+def _cached_config(machine_set, timeline, timeslot, now):
+    profiling.tag(machine_set=machine_set.name, menu=timeslot.menu.label)
+
+    # Generate the configuration or take it from the cache. Cached
+    # configurations expire when the active timeslot changes.
+    # Concurrent requests for the same configuration wait for one render.
+    key = (machine_set.pk, timeslot.pk)
+    cached = rendered_configs.get(key, now)
+    if cached is None:
+        metrics.render_cache.inc(result='miss')
+        cached = render_flight.do(
+            key, lambda: _render_and_cache(key, timeline, timeslot, now))
     else:
-        item = menu.menuitem_set.all()[0].item
-        return HttpResponse(
-            "DEFAULT %s\n%s" %
-            (item.label, item.pxelinux_representation()))
+        metrics.render_cache.inc(result='hit')
+    return cached
+
+
+def _render_and_cache(key, timeline, timeslot, now):
+    generation = rendered_configs.generation
+    with metrics.phase('render'):
+        response = render_config(timeslot)
+    config = RenderedConfig(
+        response.content, response['Content-Type'], timeline.next_change(now))
+    rendered_configs.set(key, config, config.next_change, generation)
+    last_good.save(key, config)
+    return config
+
+
+def config_response(request, config, now, private=False):
+    """
+    Return the response for a RenderedConfig or 304 Not Modified if the
+    client (or a caching proxy) already has it. It may be cached until the
+    next timeslot boundary, but at most PXELINUX_HTTP_MAX_AGE seconds
+    (default: 60, None for no limit). Responses to URLs not naming the client
+    (default, probes) are private: a shared cache keyed by URL would hand
+    them to other clients.
+    """
+    response = get_conditional_response(
+        request, etag=config.etag, last_modified=config.last_modified)
+    if response is None:
+        response = HttpResponse(
+            config.content, content_type=config.content_type)
+    response['ETag'] = config.etag
+    response['Last-Modified'] = http_date(config.last_modified)
+    max_age = max(int((config.next_change - now).total_seconds()), 0)
+    limit = getattr(settings, 'PXELINUX_HTTP_MAX_AGE', 60)
+    if limit is not None:
+        max_age = min(max_age, limit)
+    if private:
+        patch_cache_control(response, private=True, max_age=max_age)
+    else:
+        patch_cache_control(response, public=True, max_age=max_age)
+    return response
+
+
+def config_key(ip, now):
+    """
+    Return the (machine set, timeslot)-key of the configuration for the given
+    IP-address at now if it can be resolved from memory alone, else None (also
+    if the fallback-address would be needed). Never touches the database.
+    """
+    index = ip_index.peek()
+    compiled_timelines = timelines.peek()
+    if index is None or compiled_timelines is None:
+        return None
+    machine_set = index.lookup(ip)
+    timeline = machine_set and compiled_timelines.get(machine_set.pk)
+    timeslot = timeline and timeline.active(now)
+    if timeslot is None:
+        return None
+    return machine_set.pk, timeslot.pk
+
+
+def cached_config(ip, now):
+    """
+    Return the cached RenderedConfig for the given IP-address if it can be
+    answered from memory alone, else None.
+    """
+    key = config_key(ip, now)
+    return key and rendered_configs.get(key, now)
+
+
+def metrics_view(request):
+    """
+    Expose the metrics of this process in the Prometheus text format.
+    """
+    return HttpResponse(
+        metrics.render(), content_type='text/plain; version=0.0.4')
+
+
+class _Echo(object):
+    """
+    File-like object returning what is written to it, for csv.writer.
+    """
+    def write(self, value):
+        return value
+
+
+@staff_member_required
+def resolve_bulk(request):
+    """
+    Stream a CSV-table of which machine set, timeslot and menu the addresses
+    given as 'ip'-parameters (IPs, CIDRs) boot with at the times given as
+    'time'-parameters (HH:MM[:SS], default: now).
+    """
+    try:
+        times = [parse_time(value) for value in request.GET.getlist('time')]
+        networks = [parse_network(value)
+                    for value in request.GET.getlist('ip')]
+    except ValueError as e:
+        return HttpResponseBadRequest("%s\n" % e)
+    rows = resolve(ip_index.get(), timelines.get(), networks,
+                   times or [datetime.now().time()])
+    writer = csv.writer(_Echo())
+    return StreamingHttpResponse(
+        (writer.writerow(row) for row in chain([COLUMNS], rows)),
+        content_type='text/csv')
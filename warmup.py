@@ -0,0 +1,91 @@
+"""
+Warm-up of worker processes. With PXELINUX_WARM_UP set, the entry points
+serving requests (pxelinux.wsgi and pxelinux.asgi) start a background thread
+building everything the first configuration requests would otherwise pay
+for: the views and templates, the IP- and host indexes (parsing all
+ip_ranges), the timelines and the configurations active now (rendering the
+menus). Requests arriving meanwhile take the regular lazy path. The time
+spent per phase is logged and exported as pxelinux_startup_seconds. With
+uwsgi, use lazy-apps so that every worker warms itself up after being
+(re)spawned.
+"""
+import logging
+import threading
+import time
+from datetime import datetime
+from django.conf import settings
+from django.db import close_old_connections
+from pxelinux import metrics
+
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_started = False
+
+
+def _phase(phases, name, function):
+    start = time.perf_counter()
+    function()
+    phases.append((name, time.perf_counter() - start))
+    metrics.startup_seconds.set(phases[-1][1], phase=name)
+
+
+def _import_views():
+    from pxelinux import urls, views  # noqa: F401
+    views.menu_template()
+
+
+def _render():
+    from pxelinux import views
+    from pxelinux.index import ip_index
+    now = datetime.now()
+    for machine_set in ip_index.get().machine_sets:
+        views._find_machine_set_config(machine_set, now)
+
+
+def warm_up():
+    """
+    Build the state needed to answer configuration requests.
+    """
+    from pxelinux.index import host_index, ip_index
+    from pxelinux.schedule import timelines
+    from pxelinux.snapshot import snapshot_file
+    phases = [('apps', metrics.startup_seconds.value(phase='apps'))]
+    try:
+        _phase(phases, 'views', _import_views)
+        if snapshot_file.current() is None:
+            _phase(phases, 'ip_index', ip_index.get)
+            _phase(phases, 'host_index', host_index.get)
+            _phase(phases, 'timelines', timelines.get)
+            _phase(phases, 'render', _render)
+        logger.info("Started up in %.3fs (%s).",
+                    sum(seconds for name, seconds in phases),
+                    ", ".join("%s: %.3fs" % phase for phase in phases))
+    except Exception:
+        logger.exception("Warm-up failed.")
+    finally:
+        close_old_connections()
+
+
+def start():
+    """
+    Start warming up in a background thread.
+    """
+    threading.Thread(
+        target=warm_up, name='pxelinux-warm-up', daemon=True).start()
+
+
+def serving():
+    """
+    Called by the entry points serving requests: start warming up once per
+    process if PXELINUX_WARM_UP is set.
+    """
+    global _started
+    if _started or not getattr(settings, 'PXELINUX_WARM_UP', False):
+        return
+    with _lock:
+        if _started:
+            return
+        _started = True
+    start()
@@ -0,0 +1,11 @@
+"""
+WSGI application of the Django project that also warms up the process if
+PXELINUX_WARM_UP is set (see warmup.py). Point uwsgi or gunicorn at
+pxelinux.wsgi:application with DJANGO_SETTINGS_MODULE set.
+"""
+from django.core.wsgi import get_wsgi_application
+from pxelinux import warmup
+
+
+application = get_wsgi_application()
+warmup.serving()